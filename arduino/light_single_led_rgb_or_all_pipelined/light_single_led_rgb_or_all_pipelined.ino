@@ -0,0 +1,154 @@
+// NeoPixel Ring simple sketch (c) 2013 Shae Erisson
+// released under the GPLv3 license to match the rest of the AdaFruit NeoPixel library
+
+#include <Adafruit_NeoPixel.h>
+#ifdef __AVR__
+  #include <avr/power.h>
+#endif
+
+// Which pin on the Arduino is connected to the NeoPixels?
+// On a Trinket or Gemma we suggest changing this to 1
+#define PIN            6
+
+// How many NeoPixels are attached to the Arduino?
+#define NUMPIXELS      255
+
+// When we setup the NeoPixel library, we tell it how many pixels, and which pin to use to send signals.
+// Note that for older NeoPixel strips you might need to change the third parameter--see the strandtest
+// example for more information on possible values.
+Adafruit_NeoPixel pixels = Adafruit_NeoPixel(NUMPIXELS, PIN, NEO_GRB + NEO_KHZ800);
+
+uint8_t current_led = 255; // 255 means all pixels
+uint8_t current_r = 0;
+uint8_t current_g = 0;
+uint8_t current_b = 0;
+
+// packets are: start byte, number of commands, commands of five bytes (sequence number, led, r, g, b), checksum
+#define START_BYTE     0xA5
+#define MAX_COMMANDS   12
+#define COMMAND_LENGTH 5
+// a packet arrives in one piece, a longer pause means bytes were lost
+#define BYTE_TIMEOUT_US 10000
+
+uint8_t packet[MAX_COMMANDS * COMMAND_LENGTH];
+
+void setup() {
+  // This is for Trinket 5V 16MHz, you can remove these three lines if you are not using a Trinket
+#if defined (__AVR_ATtiny85__)
+  if (F_CPU == 16000000) clock_prescale_set(clock_div_1);
+#endif
+  // End of trinket special code
+
+  pixels.begin(); // This initializes the NeoPixel library.
+  Serial.begin(115200);
+  //Serial.begin(9600);
+  pixels.show();
+}
+
+// waits for the next byte, returns false if none arrives in time
+bool read_byte(uint8_t &value) {
+  unsigned long t_start = micros();
+  while (Serial.available() == 0){
+    if (micros() - t_start > BYTE_TIMEOUT_US){
+      return false;
+    }
+  }
+  value = Serial.read();
+  return true;
+}
+
+// the whole packet is read before the leds are updated, and the sender only sends the next packet after all
+// commands of this one have been acknowledged, so no bytes arrive while pixels.show() has interrupts disabled.
+// if a packet is incomplete or its checksum is wrong, it is dropped and the next start byte is searched
+void loop() {
+
+  while (Serial.available() == 0){
+  }
+  if (Serial.read() != START_BYTE){
+    return;
+  }
+
+  uint8_t n_commands;
+  if (!read_byte(n_commands) || n_commands == 0 || n_commands > MAX_COMMANDS){
+    return;
+  }
+
+  uint8_t checksum = n_commands;
+  for (int i=0; i < n_commands * COMMAND_LENGTH; i++){
+    if (!read_byte(packet[i])){
+      return;
+    }
+    checksum += packet[i];
+  }
+
+  uint8_t received_checksum;
+  if (!read_byte(received_checksum) || received_checksum != checksum){
+    return;
+  }
+
+  for (int i=0; i < n_commands; i++){
+    uint8_t *command = packet + i * COMMAND_LENGTH;
+    set_leds(command[1], command[2], command[3], command[4]);
+
+    // acknowledge this command, flushed so the ack isn't held back by the next pixels.show()
+    Serial.write(command[0]);
+    Serial.flush();
+  }
+}
+
+void set_leds(uint8_t led, uint8_t r, uint8_t g, uint8_t b) {
+
+  // something must have changed compared to the previous command to execute a new one
+  if (led != current_led || r != current_r || g != current_g || b != current_b){
+
+    // light all leds with the same color
+    if (led == NUMPIXELS){
+      
+      for (int i=0; i < NUMPIXELS; i++){
+        
+        pixels.setPixelColor(i, pixels.Color(r, g, b));
+        
+      }
+    }
+    
+    // light a single led
+    else {
+      
+      // previously all leds were lit
+      if (current_led == NUMPIXELS){
+        
+        for (int i=0; i < NUMPIXELS; i++){
+
+          // light the led
+          if (i == led){
+            pixels.setPixelColor(i, pixels.Color(r, g, b));
+          }
+          
+          // turn off all leds but the chosen one
+          else {
+            pixels.setPixelColor(i, 0);
+          }
+        }
+      }
+      
+      // previously only one led was lit
+      else {
+        
+        // light single led
+        pixels.setPixelColor(led, pixels.Color(r, g, b));
+        
+        // turn off previous led
+        if (led != current_led){
+          pixels.setPixelColor(current_led, 0);
+        }
+      }
+      
+    }
+       
+    pixels.show(); // This sends the updated pixel color to the hardware.
+    current_led = led;
+    current_r = r;
+    current_g = g;
+    current_b = b;
+  }
+}
@@ -0,0 +1,119 @@
+import multiprocessing
+import asyncio
+import weakref
+import logging
+import zmq
+import msgpack
+import freehead as fh
+from freehead.OptotrakThread import merged_config, default_server_config, default_client_config
+
+logger = logging.getLogger(__name__)
+
+# fork keeps the shared memory mapping of the parent, so the buffer doesn't need to be pickled and reattached
+mp_context = multiprocessing.get_context('fork')
+
+
+class AcquisitionProcess(mp_context.Process):
+    """
+    Runs one of the acquisition threads in a child process instead of the experiment's interpreter, so the
+    acquisition loop doesn't compete for the GIL with the experiment loop. The child writes into a shared memory
+    ring buffer, the experiment process reads from it without copying. Exposes the same attributes as the thread
+    classes, so it can be used in their place.
+    """
+
+    thread_class = None
+    buffer_length = None
+    sample_size = None
+
+    def __init__(self, **thread_kwargs):
+        super(AcquisitionProcess, self).__init__()
+        self.daemon = True
+        self.thread_kwargs = thread_kwargs
+
+        self.should_stop = mp_context.Event()
+        self.started_running = mp_context.Event()
+
+        self.buffer = fh.SharedRingBuffer(self.buffer_length, self.sample_size, condition=mp_context.Condition())
+        # release the shared memory block when this object is gone in the experiment process
+        self._finalizer = weakref.finalize(self, self.buffer.unlink)
+
+    def run(self):
+        # this is executed in the child process
+        thread = self.thread_class(**self.thread_kwargs)
+        thread.buffer = self.buffer
+        thread.should_stop = self.should_stop
+        thread.started_running = self.started_running
+        # the thread's run method is called directly, so it runs as the main thread of the child
+        thread.run()
+
+    @property
+    def buffer_mark(self):
+        # read from shared memory because the child moves it forward if the buffer overflows
+        return self.buffer.last_mark
+
+    @property
+    def current_sample(self):
+        return self.buffer.latest()
+
+    @property
+    def i_current_sample(self):
+        # number of samples received since the last reset
+        return self.buffer.n_written - self.buffer_mark
+
+    @property
+    def data(self):
+        return self.buffer.view(self.buffer_mark)
+
+    def reset_data_buffer(self):
+        self.buffer.mark()
+        logger.debug('Successfully reset shared data buffer.')
+
+    def wait_for_sample(self, after_index, timeout=None):
+        # blocks until more than after_index samples have arrived since the last reset
+        # returns the new i_current_sample, or None if the timeout ran out first
+        if self.buffer.wait_for_sample(self.buffer_mark + after_index, timeout):
+            return self.i_current_sample
+        return None
+
+    async def wait_for_sample_async(self, after_index, timeout=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.wait_for_sample, after_index, timeout)
+
+    def get_shortened_data(self):
+        # copy, because the ring buffer rows are reused after the buffer has wrapped around
+        return self.buffer.view(self.buffer_mark).copy()
+
+
+class OptotrakProcess(AcquisitionProcess):
+
+    thread_class = fh.OptotrakThread
+    buffer_length = fh.OptotrakThread.buffer_length * 6  # one hour, the shared buffer can't grow
+
+    def __init__(self, server_config=None, client_config=None):
+        # the experiment process needs the configuration too, e.g. for the collection frequency
+        self.server_config = merged_config(default_server_config, server_config)
+        self.client_config = merged_config(default_client_config, client_config)
+        self.sample_size = self.server_config['lsl']['outlet']['n_channels'] + 1  # plus 1 for lsl timestamp
+        super(OptotrakProcess, self).__init__(server_config=server_config, client_config=client_config)
+
+
+class PupilProcess(AcquisitionProcess):
+
+    thread_class = fh.PupilThread
+    buffer_length = fh.PupilThread.buffer_length * 6  # one hour, the shared buffer can't grow
+    sample_size = fh.PupilThread.sample_size
+
+    context = None
+    request_socket = None
+
+    def reset_3d_eye_model(self):
+        # the child's request socket can't be used from here, so the experiment process opens its own
+        if self.request_socket is None:
+            self.context = zmq.Context()
+            self.request_socket = self.context.socket(zmq.REQ)
+            self.request_socket.connect("tcp://{}:{}".format(fh.PupilThread.address, fh.PupilThread.request_port))
+        self.request_socket.send_string('notify.detector3d.reset_model', flags=zmq.SNDMORE)
+        self.request_socket.send(msgpack.dumps({
+            'subject': 'detector3d.reset_model'
+        }))
+        return self.request_socket.recv_string()
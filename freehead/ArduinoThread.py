@@ -5,72 +5,214 @@ from collections import deque
 import time
 import logging
 import numbers
+import numpy as np
+import freehead as fh
 
 logger = logging.getLogger(__name__)
 
 
 class ArduinoThread(threading.Thread):
-
-    def __init__(self, path='/dev/ttyUSB0', baudrate=115200):
+    """
+    Sends led commands to the arduino running the light_single_led_rgb_or_all_pipelined sketch.
+
+    Queued commands are sent together in one packet of up to window_size commands: a start byte, the number of
+    commands, every command prefixed with a sequence byte, and a checksum. The arduino reads the whole packet before
+    it updates the leds and sends back the sequence byte of every command once it has been executed. The next packet
+    is only sent after all acks of the previous one have come back, because the led strip update disables interrupts
+    on the arduino for several milliseconds, and bytes that arrive during that time are lost. If a packet is
+    corrupted anyway, the arduino drops it and waits for the next start byte.
+
+    The acks are read by a second thread and matched back to the command index that write_uint8 returned. A command
+    whose ack doesn't arrive within ack_timeout after the previous progress is counted as failed, its index is added
+    to failed_commands and its ack timestamp is nan.
+
+    For every command three time.monotonic() timestamps are kept: when it was queued, when the serial write of it had
+    completed and when its ack was received (command_timestamps). The latencies from queueing and from writing to the
+    ack are collected in histograms that can be queried at any time during a session.
+    """
+
+    start_byte = 0xA5
+    # a packet of 12 commands is 63 bytes, so it fits into the arduino's serial receive buffer of 64 bytes
+    window_size = 12
+    # one led strip update takes about 8 ms
+    ack_timeout = 0.1
+    # the arduino resets when the serial port is opened
+    startup_duration = 2
+
+    def __init__(self, path='/dev/ttyUSB0', baudrate=115200, window_size=None):
         super(ArduinoThread, self).__init__()
         self.daemon = True
         self.should_stop = threading.Event()
         logger.info(f'Establishing connection to arduino at "{path}" with baudrate {baudrate}.')
-        self.arduino = serial.Serial(path, baudrate=baudrate, timeout=1)
+        # the read timeout is also how often the ack thread checks for commands that timed out
+        self.arduino = serial.Serial(path, baudrate=baudrate, timeout=0.01)
         self.started_running = threading.Event()
         self.queue = deque([])
+        self.command_available = threading.Event()
+
+        if window_size is not None:
+            self.window_size = window_size
+        # set while no command is in flight, so the next packet can be sent
+        self.idle = threading.Event()
+        self.idle.set()
+        # (sequence byte, command index) of sent commands in the order they were sent
+        self.in_flight = deque([])
+        self.ack_deadline = None
+        # guards the queue, the commands in flight and the timestamp lists between the sending and the ack thread
+        self.lock = threading.Lock()
+        self.ack_thread = threading.Thread(target=self.receive_acks, daemon=True)
 
         self.command_index = -1
+        self.command_enqueue_timestamps = []
+        self.command_write_timestamps = []
         self.command_timestamps = []
+        self.failed_commands = []
+
+        self.latency_histogram = fh.LatencyHistogram()  # from queueing to ack
+        self.write_latency_histogram = fh.LatencyHistogram()  # from completed write to ack
 
     def run(self):
         logger.info('Pausing shortly for arduino start-up.')
-        time.sleep(2)
+        time.sleep(self.startup_duration)
         logger.info('Arduino ready.')
 
         self.reset_command_timestamps()
+        self.ack_thread.start()
         self.started_running.set()
 
         while not self.should_stop.is_set():
 
             if len(self.queue):
-                self.arduino.write(self.queue.popleft())
-                logger.debug('Command sent')
-
-                # before the next one a ready signal needs to be read
-                while not self.should_stop.is_set() and self.arduino.read() == b'':
-                    time.sleep(0.0005)
-
-                # when the return message has been received, a timestamp is appended to be retrieved later
-                self.command_timestamps.append(time.monotonic())
-
-                # and the next message can be retrieved
+                # wait until all commands of the previous packet are done, with a timeout to check should_stop again
+                if not self.idle.wait(timeout=0.1):
+                    continue
+                with self.lock:
+                    n_commands = min(len(self.queue), self.window_size)
+                    if n_commands == 0:
+                        # the queue was cleared by reset_command_timestamps
+                        continue
+                    packet = self.pop_packet(n_commands)
+                    self.idle.clear()
+                    self.ack_deadline = time.monotonic() + self.ack_timeout
+                    self.arduino.write(packet)
+                    # block until the bytes have actually left the serial port
+                    self.arduino.flush()
+                    t_written = time.monotonic()
+                    self.command_write_timestamps.extend([t_written] * n_commands)
+                logger.debug('Commands sent')
                 continue
 
-            # if there is no command waiting, control is given away if possible
-            time.sleep(0.0005)
+            # if there is no command waiting, sleep until write_uint8 signals a new one
+            self.command_available.clear()
+            if not len(self.queue):
+                self.command_available.wait(timeout=0.1)
 
+        self.ack_thread.join()
         logger.info('Closing arduino.')
         self.arduino.close()
 
+    def pop_packet(self, n_commands) -> bytes:
+        payload = b''
+        for _ in range(n_commands):
+            index, byte_message = self.queue.popleft()
+            sequence_byte = index % 256
+            # registered before writing, so the ack can't arrive before its command is known
+            self.in_flight.append((sequence_byte, index))
+            payload += bytes([sequence_byte]) + byte_message
+        checksum = (n_commands + sum(payload)) % 256
+        return bytes([self.start_byte, n_commands]) + payload + bytes([checksum])
+
+    def receive_acks(self):
+        while not self.should_stop.is_set():
+            # blocks until an ack arrives or the serial timeout runs out
+            ack = self.arduino.read()
+            t_ack = time.monotonic()
+
+            with self.lock:
+                if ack != b'':
+                    self.match_ack(ack[0], t_ack)
+                elif len(self.in_flight) and t_ack > self.ack_deadline:
+                    # the packet or the ack got lost, the arduino won't execute the remaining commands anymore
+                    while len(self.in_flight):
+                        _, index = self.in_flight.popleft()
+                        self.fail_command(index, 'timed out')
+                if not len(self.in_flight):
+                    self.idle.set()
+
+    def match_ack(self, sequence_byte, t_ack):
+        if not any(expected_byte == sequence_byte for expected_byte, _ in self.in_flight):
+            # a late ack of a command that already timed out, or a corrupted byte, says nothing about the commands in
+            # flight, they may still be executing
+            logger.warning(f'Received ack {sequence_byte} that matches no command in flight.')
+            return
+
+        # acks arrive in the order the commands were sent, skipped ones were lost on the way
+        while len(self.in_flight):
+            expected_byte, index = self.in_flight.popleft()
+            if expected_byte == sequence_byte:
+                self.command_timestamps.append(t_ack)
+                self.ack_deadline = t_ack + self.ack_timeout
+                self.latency_histogram.record(t_ack - self.command_enqueue_timestamps[index])
+                # the write timestamp is appended after the write returned, which can be after the ack
+                if len(self.command_write_timestamps) > index:
+                    self.write_latency_histogram.record(t_ack - self.command_write_timestamps[index])
+                return
+            self.fail_command(index, 'was skipped')
+
+    def fail_command(self, index, reason):
+        logger.warning(f'No ack received for command {index}, it {reason}.')
+        # keeps the timestamps aligned with the command index
+        self.command_timestamps.append(np.nan)
+        self.failed_commands.append(index)
+
     def write_uint8(self, *ints) -> int:
         if not all([isinstance(part, numbers.Integral) and (0 <= part <= 255) for part in ints]):
             raise ValueError('Message needs to be a tuple with ints between 0 and 255')
         byte_message = struct.pack(f'>{len(ints)}B', *ints)
-        self.queue.append(byte_message)
 
         # with the command index, it will later be possible to retrieve the end timestamp of the led change
         self.command_index += 1
+        self.command_enqueue_timestamps.append(time.monotonic())
+        self.queue.append((self.command_index, byte_message))
+        self.command_available.set()
         return self.command_index
 
-    def reset_command_timestamps(self):
+    def write_many(self, commands) -> list:
+        # queues several commands, e.g. (led, r, g, b) tuples, at once so they are sent in as few writes as possible
+        if not all([isinstance(part, numbers.Integral) and (0 <= part <= 255) for ints in commands for part in ints]):
+            raise ValueError('Messages need to be tuples with ints between 0 and 255')
+        first_index = self.command_index + 1
+        t_enqueue = time.monotonic()
+        indexed_messages = [
+            (first_index + i, struct.pack(f'>{len(ints)}B', *ints)) for i, ints in enumerate(commands)]
 
-        logger.info('Waiting for remaining commands to finish...')
-        while len(self.command_timestamps) < (self.command_index + 1):  # index 0 needs 1 timestamp, 1 needs 2 etc.
-            time.sleep(0)
-
-        self.command_timestamps = []
-        self.command_index = -1
-        logger.info('Command timestamps reset.')
+        self.command_index += len(indexed_messages)
+        self.command_enqueue_timestamps.extend([t_enqueue] * len(indexed_messages))
+        self.queue.extend(indexed_messages)
+        self.command_available.set()
+        return list(range(first_index, self.command_index + 1))
 
+    def reset_command_timestamps(self, timeout=1.0):
 
+        logger.info('Waiting for remaining commands to finish...')
+        # index 0 needs 1 timestamp, 1 needs 2 etc.
+        # the write timestamps are checked too, because they can be stored after the ack came back
+        t_deadline = time.monotonic() + timeout
+        while (len(self.command_timestamps) < (self.command_index + 1)
+               or len(self.command_write_timestamps) < (self.command_index + 1)):
+            if time.monotonic() > t_deadline:
+                logger.warning(f'Commands still unfinished after {timeout} s, dropping them.')
+                break
+            time.sleep(0.001)
+
+        with self.lock:
+            # commands from before the reset would otherwise be matched to the new command indices
+            self.queue.clear()
+            self.in_flight.clear()
+            self.idle.set()
+            self.command_enqueue_timestamps = []
+            self.command_write_timestamps = []
+            self.command_timestamps = []
+            self.failed_commands = []
+            self.command_index = -1
+        logger.info('Command timestamps reset.')
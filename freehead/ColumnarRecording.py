@@ -0,0 +1,153 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from .SessionWriter import TRIALS_FILE, RIG_FILE
+
+# files inside a columnar recording folder
+COLUMNS_FILE = 'columns.json'  # original column order and dtype and row shape of every array column
+TABLE_FILE = 'table.pickle'  # all columns that aren't arrays, one row per trial
+SAMPLES_SUFFIX = '_samples.npy'  # rows of one array column, concatenated over all trials
+OFFSETS_SUFFIX = '_offsets.npy'  # n_trials + 1 row offsets into the samples of one array column
+
+
+def array_column_layout(values):
+    # dtype and row shape if every cell is a numeric array with the same row shape, otherwise None
+    if not len(values) or not all(isinstance(v, np.ndarray) and v.dtype != object and v.ndim > 0 for v in values):
+        return None
+    row_shapes = {v.shape[1:] for v in values if v.size > 0}
+    if len(row_shapes) > 1:
+        return None
+    row_shape = row_shapes.pop() if row_shapes else ()
+    return np.result_type(*[v.dtype for v in values]), row_shape
+
+
+def write_columnar_recording(folder_path, experiment_df: pd.DataFrame, trial_df: pd.DataFrame = None, rig_leds=None):
+    """Writes an experiment DataFrame with arrays in its cells as a columnar recording folder.
+
+    Every column whose cells are arrays with the same row shape, like o_data and p_data, is stored as one flat array
+    of all rows plus the row offsets of each trial, all other columns go into one pickled table. The flat arrays are
+    .npy files, so ColumnarRecording can memory map them.
+    """
+    os.makedirs(folder_path, exist_ok=True)
+
+    array_columns = OrderedDict()
+    for name in experiment_df.columns:
+        values = list(experiment_df[name])
+        layout = array_column_layout(values)
+        if layout is None:
+            continue
+        dtype, row_shape = layout
+
+        lengths = np.array([v.shape[0] if v.size > 0 else 0 for v in values], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        # filled trial by trial, so the concatenated array never has to exist in memory next to the DataFrame
+        samples = np.lib.format.open_memmap(
+            os.path.join(folder_path, name + SAMPLES_SUFFIX),
+            mode='w+', dtype=dtype, shape=(int(offsets[-1]), *row_shape))
+        for value, start, end in zip(values, offsets[:-1], offsets[1:]):
+            if end > start:
+                samples[start:end] = value
+        samples.flush()
+        del samples
+        np.save(os.path.join(folder_path, name + OFFSETS_SUFFIX), offsets)
+        array_columns[name] = dict(dtype=np.dtype(dtype).str, shape=list(row_shape))
+
+    experiment_df.drop(columns=list(array_columns)).to_pickle(os.path.join(folder_path, TABLE_FILE))
+    if trial_df is not None:
+        trial_df.to_pickle(os.path.join(folder_path, TRIALS_FILE))
+    if rig_leds is not None:
+        np.save(os.path.join(folder_path, RIG_FILE), rig_leds)
+
+    # written last, a folder without it is an incomplete conversion
+    with open(os.path.join(folder_path, COLUMNS_FILE), 'w') as f:
+        json.dump(dict(columns=list(experiment_df.columns), arrays=array_columns), f, indent=2)
+
+
+def is_columnar_recording(path):
+    return os.path.isfile(os.path.join(path, COLUMNS_FILE))
+
+
+class ColumnarRecording:
+    """
+    Reader for a folder written by write_columnar_recording.
+
+    The flat sample arrays are memory mapped when the recording is opened, the data of a trial is only read from disk
+    when it is accessed. trial_array and arrays return views into the mapped arrays, nothing is copied. to_dataframe
+    gives the same DataFrame that was written, with such views in the array cells.
+
+    Example:
+        recording = ColumnarRecording(folder_path)
+        o_data = recording.trial_array('o_data', 12)
+    """
+
+    def __init__(self, folder_path, mmap_mode='r'):
+        self.folder_path = folder_path
+        with open(os.path.join(folder_path, COLUMNS_FILE)) as f:
+            layout = json.load(f)
+        self.columns = layout['columns']
+        self.array_columns = list(layout['arrays'])
+
+        self.table = pd.read_pickle(os.path.join(folder_path, TABLE_FILE))
+        self.samples = {}
+        self.offsets = {}
+        for name in self.array_columns:
+            self.samples[name] = np.load(os.path.join(folder_path, name + SAMPLES_SUFFIX), mmap_mode=mmap_mode)
+            self.offsets[name] = np.load(os.path.join(folder_path, name + OFFSETS_SUFFIX))
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def n_trials(self):
+        return len(self.table)
+
+    def trial_array(self, name, i):
+        # i is the position of the trial, not its index label
+        return self.samples[name][self.offsets[name][i]:self.offsets[name][i + 1]]
+
+    def arrays(self, name):
+        samples, offsets = self.samples[name], self.offsets[name]
+        return [samples[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    @property
+    def trial_frame(self):
+        path = os.path.join(self.folder_path, TRIALS_FILE)
+        return pd.read_pickle(path) if os.path.exists(path) else None
+
+    @property
+    def rig_leds(self):
+        path = os.path.join(self.folder_path, RIG_FILE)
+        return np.load(path) if os.path.exists(path) else None
+
+    def to_dataframe(self, columns=None) -> pd.DataFrame:
+        columns = self.columns if columns is None else columns
+        data = OrderedDict()
+        for name in columns:
+            if name in self.samples:
+                # filled element by element, so pandas keeps one array view per cell
+                views = np.empty(self.n_trials, dtype=object)
+                for i, view in enumerate(self.arrays(name)):
+                    views[i] = view
+                data[name] = views
+            else:
+                data[name] = self.table[name].values
+        return pd.DataFrame(data, index=self.table.index)
+
+
+def load_recording(experiment_path, trials_path=None, rig_path=None):
+    """Returns experiment DataFrame, trial DataFrame and rig led positions of a recording.
+
+    experiment_path can either be a columnar recording folder or the experiment pickle of the original layout, in
+    which case trials_path and rig_path are needed as well.
+    """
+    if is_columnar_recording(experiment_path):
+        recording = ColumnarRecording(experiment_path)
+        return recording.to_dataframe(), recording.trial_frame, recording.rig_leds
+    return pd.read_pickle(experiment_path), pd.read_pickle(trials_path), np.load(rig_path)
+
+
+def convert_recording(experiment_path, trials_path, rig_path, folder_path):
+    """Converts a recording from the original layout of three files written by save_experiment_files."""
+    write_columnar_recording(folder_path, *load_recording(experiment_path, trials_path, rig_path))
@@ -13,7 +13,6 @@ import pandas as pd
 import freehead as fh
 import os
 import numpy as np
-from collections import OrderedDict
 from PIL import Image
 
 
@@ -28,12 +27,11 @@ class ExperimentVisualization(QtWidgets.QWidget):
     trial_changed = pyqtSignal(int)
     frame_changed = pyqtSignal(int)
 
-    def __init__(self, exp_df_path, trial_df_path, rig_leds_path):
+    def __init__(self, exp_df_path, trial_df_path=None, rig_leds_path=None):
 
-        exp_df = pd.read_pickle(exp_df_path)
-        trial_df = pd.read_pickle(trial_df_path)
+        # exp_df_path can also be a columnar recording folder, which contains the trials and rig as well
+        exp_df, trial_df, self.rig_leds = fh.load_recording(exp_df_path, trial_df_path, rig_leds_path)
         self.df = exp_df.join(trial_df.drop('block', axis=1), on='trial_number')
-        self.rig_leds = np.load(rig_leds_path)
 
         self.precalculate_data()
 
@@ -185,44 +183,43 @@ class ExperimentVisualization(QtWidgets.QWidget):
             self.update_rig()
 
     def precalculate_data(self):
-        fh.array_apply(
-            self.df,
-            OrderedDict([
-                ('target_led', lambda r: r['fixation_led'] + r['amplitude']),
-                ('shifted_target_led', lambda r: r['target_led'] + r['shift']),
-                # optotrak data interpolated onto pupil labs timestamps
-                ('o_data_interp',
-                 lambda r: fh.interpolate_a_onto_b_time(r['o_data'][:, 3:15], r['o_data'][:, 30], r['p_data'][:, 2],
-                                                     kind='linear')),
-                # gaze data
-                ('gaze_normals', lambda r: r['p_data'][:, 3:6]),
-                # rotation of head rigidbody
-                ('R_head_world', lambda r: r['helmet'].solve(r['o_data_interp'].reshape((-1, 4, 3)))[0]),
-                # yaw pitch roll head rigidbody
-                ('ypr_head_world', lambda r: fh.to_yawpitchroll(r['R_head_world'])),
-                # reference positions of head rigidbody
-                ('Ts_head_world', lambda r: r['helmet'].solve(r['o_data_interp'].reshape((-1, 4, 3)))[1]),
-                # position of target led
-                ('target_pos', lambda r: self.rig_leds[r['target_led'], :]),
-                # vector from eye to target position
-                ('eye_to_target', lambda r: fh.to_unit(r['target_pos'] - r['Ts_head_world'][:, 5, :])),
-                # gaze vector in head without distortion correction
-                ('gaze_head_distorted', lambda r: (r['R_eye_head'] @ r['gaze_normals'].T).T),
-                # gaze vector in head with distortion correction
-                ('gaze_head',
-                 lambda r: fh.normals_nonlinear_angular_transform(r['gaze_head_distorted'], r['nonlinear_parameters'])),
-                # gaze vector in world
-                ('gaze_world', lambda r: np.einsum('tij,tj->ti', r['R_head_world'], r['gaze_head'])),
-                # gaze angles in world
-                ('gaze_ang_world', lambda r: np.rad2deg(fh.to_azim_elev(r['gaze_world']))),
-                # angles from eye to target in world
-                ('eye_ang_target', lambda r: np.rad2deg(fh.to_azim_elev(r['eye_to_target']))),
-                # difference of eye to target angles and gaze in world
-                ('d_ang_gaze_eye_target', lambda r: r['gaze_ang_world'] - r['eye_ang_target']),
-                # time steps
-            ]),
-            add_inplace=True
-        )
+        fh.Pipeline([
+            fh.Step('target_led', ['fixation_led', 'amplitude'], lambda r: r['fixation_led'] + r['amplitude']),
+            fh.Step('shifted_target_led', ['target_led', 'shift'], lambda r: r['target_led'] + r['shift']),
+            # optotrak data interpolated onto pupil labs timestamps
+            fh.Step('o_data_interp', ['o_data', 'p_data'],
+                    lambda r: fh.interpolate_a_onto_b_time(r['o_data'][:, 3:15], r['o_data'][:, 30], r['p_data'][:, 2],
+                                                           kind='linear')),
+            # gaze data
+            fh.Step('gaze_normals', ['p_data'], lambda r: r['p_data'][:, 3:6]),
+            # rotation and reference positions of head rigidbody, solved together
+            fh.Step(('R_head_world', 'Ts_head_world'), ['helmet', 'o_data_interp'],
+                    lambda r: r['helmet'].solve(r['o_data_interp'].reshape((-1, 4, 3)))),
+            # yaw pitch roll head rigidbody
+            fh.Step('ypr_head_world', ['R_head_world'], lambda r: fh.to_yawpitchroll(r['R_head_world'])),
+            # position of target led
+            fh.Step('target_pos', ['target_led'], lambda r: self.rig_leds[r['target_led'], :]),
+            # vector from eye to target position
+            fh.Step('eye_to_target', ['target_pos', 'Ts_head_world'],
+                    lambda r: fh.to_unit(r['target_pos'] - r['Ts_head_world'][:, 5, :])),
+            # gaze vector in head without distortion correction
+            fh.Step('gaze_head_distorted', ['R_eye_head', 'gaze_normals'],
+                    lambda r: (r['R_eye_head'] @ r['gaze_normals'].T).T),
+            # gaze vector in head with distortion correction
+            fh.Step('gaze_head', ['gaze_head_distorted', 'nonlinear_parameters'],
+                    lambda r: fh.normals_nonlinear_angular_transform(
+                        r['gaze_head_distorted'], r['nonlinear_parameters'])),
+            # gaze vector in world
+            fh.Step('gaze_world', ['R_head_world', 'gaze_head'],
+                    lambda r: np.einsum('tij,tj->ti', r['R_head_world'], r['gaze_head'])),
+            # gaze angles in world
+            fh.Step('gaze_ang_world', ['gaze_world'], lambda r: np.rad2deg(fh.to_azim_elev(r['gaze_world']))),
+            # angles from eye to target in world
+            fh.Step('eye_ang_target', ['eye_to_target'], lambda r: np.rad2deg(fh.to_azim_elev(r['eye_to_target']))),
+            # difference of eye to target angles and gaze in world
+            fh.Step('d_ang_gaze_eye_target', ['gaze_ang_world', 'eye_ang_target'],
+                    lambda r: r['gaze_ang_world'] - r['eye_ang_target']),
+        ]).run(self.df)
 
     def update_rig(self):
 
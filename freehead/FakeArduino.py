@@ -0,0 +1,70 @@
+import os
+import pty
+import tty
+import select
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FakeArduino(threading.Thread):
+    """
+    Stands in for the arduino running the light_single_led_rgb_or_all_pipelined sketch, so ArduinoThread can be
+    tested without hardware. It opens a pseudo terminal, ArduinoThread connects to its path like to a serial port.
+    Every command of a received packet is stored in commands and acknowledged with its sequence byte after
+    update_duration seconds, which simulates the time the led strip needs to update. Like the sketch, packets with a
+    wrong checksum or missing bytes are dropped and the next start byte is searched.
+
+    Example:
+        fake = FakeArduino()
+        fake.start()
+        athread = ArduinoThread(path=fake.path)
+    """
+
+    start_byte = 0xA5
+    command_length = 5  # sequence byte, led, r, g, b
+    byte_timeout = 0.01
+
+    def __init__(self, update_duration=0.001):
+        super(FakeArduino, self).__init__()
+        self.daemon = True
+        self.should_stop = threading.Event()
+        self.update_duration = update_duration
+        self.master_fd, self.slave_fd = pty.openpty()
+        # no echo or line processing, bytes have to pass through unchanged
+        tty.setraw(self.slave_fd)
+        self.path = os.ttyname(self.slave_fd)
+        self.commands = []
+        logger.info(f'Fake arduino listening at "{self.path}".')
+
+    def run(self):
+        received = b''
+        while not self.should_stop.is_set():
+            readable, _, _ = select.select([self.master_fd], [], [], self.byte_timeout if received else 0.1)
+            if not readable:
+                # like the sketch, an incomplete packet is dropped when no more bytes arrive
+                received = b''
+                continue
+            received += os.read(self.master_fd, 1024)
+
+            while len(received) >= 2:
+                if received[0] != self.start_byte:
+                    received = received[1:]
+                    continue
+                packet_length = 3 + received[1] * self.command_length
+                if len(received) < packet_length:
+                    break
+                packet, received = received[:packet_length], received[packet_length:]
+                if sum(packet[1:-1]) % 256 != packet[-1]:
+                    logger.warning('Fake arduino dropped a packet with a wrong checksum.')
+                    continue
+                for start in range(2, packet_length - 1, self.command_length):
+                    command = packet[start:start + self.command_length]
+                    time.sleep(self.update_duration)
+                    self.commands.append(tuple(command[1:]))
+                    os.write(self.master_fd, command[:1])
+
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
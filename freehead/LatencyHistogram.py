@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations with logarithmically growing bucket widths, in the style of HdrHistogram. Values are
+    counted in whole microseconds, every bucket is at most 2 ** -(precision_bits - 1) of its value wide, so the
+    relative error stays constant from microseconds to seconds while recording is one array increment.
+    Can be queried while it is being filled from another thread.
+    """
+
+    def __init__(self, max_seconds=10.0, precision_bits=7):
+        self.precision_bits = precision_bits
+        self.sub_bucket_count = 2 ** precision_bits
+        self.half_count = self.sub_bucket_count // 2
+        self.max_value = int(max_seconds * 1e6)
+        self.counts = np.zeros(self._index(self.max_value) + 1, dtype=np.int64)
+        # lower bound of each bucket in microseconds
+        self.bucket_values = np.array([self._value(i) for i in range(self.counts.size)], dtype=np.int64)
+        self.n_recorded = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _index(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        exponent = value.bit_length() - self.precision_bits
+        return self.sub_bucket_count + (exponent - 1) * self.half_count + (value >> exponent) - self.half_count
+
+    def _value(self, index):
+        if index < self.sub_bucket_count:
+            return index
+        exponent, offset = divmod(index - self.sub_bucket_count, self.half_count)
+        return (offset + self.half_count) << (exponent + 1)
+
+    def record(self, seconds):
+        value = min(max(int(seconds * 1e6), 0), self.max_value)
+        self.counts[self._index(value)] += 1
+        self.n_recorded += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        # in seconds, accurate to the width of the bucket the percentile falls into
+        if self.n_recorded == 0:
+            return np.nan
+        cumulative = np.cumsum(self.counts)
+        index = np.searchsorted(cumulative, percent / 100 * cumulative[-1])
+        return self.bucket_values[index] / 1e6
+
+    @property
+    def mean(self):
+        return self.total / self.n_recorded if self.n_recorded else np.nan
+
+    def summary(self):
+        return dict(
+            n=self.n_recorded,
+            mean=self.mean,
+            min=self.min,
+            p50=self.percentile(50),
+            p90=self.percentile(90),
+            p99=self.percentile(99),
+            p999=self.percentile(99.9),
+            max=self.max)
+
+    def reset(self):
+        self.counts[:] = 0
+        self.n_recorded = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
@@ -4,7 +4,6 @@ import time
 import enum
 import pandas as pd
 from collections import OrderedDict
-from scipy.interpolate import interp1d
 from typing import Optional
 
 
@@ -46,11 +45,13 @@ class LedShiftExperiment:
             rig_leds: np.ndarray,
             trial_frame: pd.DataFrame,
             calib_duration=10,
-            after_reset_wait=15
+            after_reset_wait=15,
+            trial_sink=None
     ):
         import pygame
 
-        self.trial_data = []
+        # completed trials are collected here, with a trial_sink they're also streamed out as soon as they're done
+        self.trial_store = fh.TrialStore(sink=trial_sink)
 
         self.othread = othread
         self.pthread = pthread
@@ -73,36 +74,21 @@ class LedShiftExperiment:
         self.create_helmet()
         self.calibrate()
 
-        experiment_dataframe = None
         block_lengths = self.trial_frame['block'].value_counts(sort=False).values
-        block_borders = np.concatenate(([0], np.cumsum(block_lengths)))
 
         for block, block_length in zip(self.blocks, block_lengths):
             self.pause_experiment(nleds=block + 1)  # show block number through number of leds blinking
 
-            block_dataframe = self.run_block(block)
+            n_completed = self.run_block(block)
 
-            if block_dataframe is None:
-                # block was quit prematurely
-                # return experiment dataframe in it's current state
-                return experiment_dataframe
-
-            block_dataframe['trial_in_block'] = block_dataframe.index
-            # make a new index so the trial numbers are correct when appending. trials are in random order depending on
-            # when they were successfully finished
-            block_dataframe.index = pd.Series(np.arange(block_borders[block], block_borders[block] + len(block_dataframe)))
-
-            if experiment_dataframe is None:
-                experiment_dataframe = block_dataframe
-            else:
-                experiment_dataframe = experiment_dataframe.append(block_dataframe)
-
-            if len(block_dataframe) < block_length:
-                # block was quit prematurely, with some, but not all, trials being done
-                # quit experiment
-                return experiment_dataframe
+            if n_completed < block_length:
+                # block was quit prematurely, with some or no trials being done
+                # quit experiment and return the trials done so far
+                return self.trial_store.to_dataframe() if len(self.trial_store) else None
 
         self.play_finish_animation()
+        # trials are indexed in the order they were finished
+        experiment_dataframe = self.trial_store.to_dataframe()
 
         t_end = time.monotonic()
         duration = (t_end - t_start)
@@ -111,10 +97,9 @@ class LedShiftExperiment:
 
         return experiment_dataframe
 
-    def run_block(self, block) -> Optional[pd.DataFrame]:
+    def run_block(self, block) -> int:
         block_frame = self.trial_frame[self.trial_frame['block'] == block]
         remaining_block_trials = block_frame.index.values
-        block_dataframe = None
         trial_in_block = 0
         while remaining_block_trials.size > 0:
             random_index = np.random.randint(0, remaining_block_trials.size)
@@ -128,11 +113,9 @@ class LedShiftExperiment:
                 trial_data.update({'trial_number': random_trial_number, 'block': block})
                 trial_data.move_to_end('block', last=False)
                 trial_data.move_to_end('trial_number', last=False)
+                trial_data['trial_in_block'] = trial_in_block
 
-                if block_dataframe is None:
-                    block_dataframe = pd.DataFrame(trial_data, index=[trial_in_block])
-                else:
-                    block_dataframe = block_dataframe.append(pd.DataFrame(trial_data, index=[trial_in_block]))
+                self.trial_store.append(trial_data)
                 trial_in_block += 1
 
             elif trial_result == TrialResult.FAILED:
@@ -148,7 +131,7 @@ class LedShiftExperiment:
             elif trial_result == TrialResult.QUIT_EXPERIMENT:
                 break
 
-        return block_dataframe
+        return trial_in_block
 
     def run_trial(self, trial_frame: pd.DataFrame) -> (TrialResult, Optional[OrderedDict]):
 
@@ -166,6 +149,12 @@ class LedShiftExperiment:
         fixation_threshold = trial_frame['fixation_threshold']
         fixation_head_velocity_threshold = trial_frame['fixation_head_velocity_threshold']
         saccade_threshold = trial_frame['saccade_threshold']
+        # 'threshold' starts the saccade when the gaze leaves saccade_threshold around the fixation led, 'velocity'
+        # when the online Engbert & Mergenthaler detector reports a saccade onset
+        saccade_detection = trial_frame.get('saccade_detection', 'threshold')
+        saccade_detector = fh.OnlineSaccadeDetector(
+            VFAC=trial_frame.get('saccade_vfac', 6),
+            MINDUR=trial_frame.get('saccade_mindur', 2)) if saccade_detection == 'velocity' else None
         landing_fixation_threshold = trial_frame['landing_fixation_threshold']
 
         pupil_min_confidence = trial_frame['pupil_min_confidence']
@@ -205,7 +194,7 @@ class LedShiftExperiment:
         phase = Phase.BEFORE_FIXATION
 
         t_trial_started = time.monotonic()
-        last_i = None
+        last_i = 0
         R_head_world = np.full((3, 3), np.nan)
         # this loop runs during data collection in the trial
         # if trial_successful is true when you break out of it, the trial's parameters and timings are saved
@@ -232,12 +221,11 @@ class LedShiftExperiment:
                     self.athread.write_uint8(255, 0, 0, 0)
                     return TrialResult.QUIT_EXPERIMENT, None
 
-            # check that a new pupil sample is available
-            current_i = self.pthread.i_current_sample
-            if current_i == last_i:
-                time.sleep(0.0005)
+            # wait until a new pupil sample is available, the timeout keeps the key checks responsive
+            current_i = self.pthread.wait_for_sample(last_i, timeout=0.01)
+            if current_i is None:
                 continue
-            last_i = current_i
+            previous_i, last_i = last_i, current_i
             pdata = self.pthread.current_sample.copy()
 
             gaze_normals = pdata[NORMALS]
@@ -249,6 +237,20 @@ class LedShiftExperiment:
             R_head_world, helmet_ref_points = self.helmet.solve(helmet_leds)
             T_eye_world = helmet_ref_points[I_EYE, :]
 
+            saccade_onset = False
+            if saccade_detector is not None:
+                # every pupil sample since the last pass, so that velocities and MINDUR refer to single sample
+                # intervals, all with the current head pose; bad samples go in as nan to keep the sample count
+                new_pdata = self.pthread.data[previous_i:current_i]
+                new_gaze_normals_world = np.atleast_2d(fh.normals_nonlinear_angular_transform(
+                    new_pdata[:, NORMALS] @ self.R_eye_head.T, self.nonlinear_parameters)) @ R_head_world.T
+                # horizontal gaze angle like in the offline detection
+                new_azimuths = np.rad2deg(fh.to_azim_elev(new_gaze_normals_world)[:, 0])
+                new_azimuths[new_pdata[:, CONFIDENCE] < pupil_min_confidence] = np.nan
+                for azimuth, t in zip(new_azimuths, new_pdata[:, PTIME]):
+                    event = saccade_detector.update(azimuth, t)
+                    saccade_onset |= event is not None and event.kind == 'onset'
+
             # if helmet rigidbody couldn't be solved or pupil data is bad
             if fh.anynan(R_head_world) or fh.anynan(gaze_normals) or (confidence < pupil_min_confidence and phase != Phase.DURING_SACCADE):
                 if phase == Phase.BEFORE_FIXATION:
@@ -278,10 +280,11 @@ class LedShiftExperiment:
                 )
             ) * self.othread.server_config['optotrak']['collection_frequency']
 
+            gaze_normals_world = R_head_world @ fh.normals_nonlinear_angular_transform(
+                self.R_eye_head @ gaze_normals, self.nonlinear_parameters)
+
             def is_eye_within_led_threshold(led, threshold):
                 eye_to_led = fh.to_unit(self.rig_leds[led, :] - T_eye_world)
-                gaze_normals_world = R_head_world @ fh.normals_nonlinear_angular_transform(
-                    self.R_eye_head @ gaze_normals, self.nonlinear_parameters)
                 eye_to_led_azim_elev = np.rad2deg(
                     np.abs(fh.to_azim_elev(gaze_normals_world) - fh.to_azim_elev(eye_to_led)))
                 # threshold is only horizontal right now because of increased vertical angle noise and spikes
@@ -323,7 +326,11 @@ class LedShiftExperiment:
                     print('maximum saccade latency exceeded')
                     break
 
-                has_started_saccade = not is_eye_within_led_threshold(fixation_led, saccade_threshold)
+                if saccade_detector is not None:
+                    # an onset can also end again within the samples of one pass
+                    has_started_saccade = saccade_onset or saccade_detector.in_saccade
+                else:
+                    has_started_saccade = not is_eye_within_led_threshold(fixation_led, saccade_threshold)
 
                 if has_started_saccade:
                     i_saccade_started = current_i
@@ -367,12 +374,12 @@ class LedShiftExperiment:
         if trial_successful:
 
             trial_data = OrderedDict([
-                # arrays need to be wrapped in a list so pandas doesn't try to make them long columns
-                ('o_data', [self.othread.get_shortened_data()]),
-                ('p_data', [self.pthread.get_shortened_data()]),
+                # views into the ring buffers are enough, the trial store copies them
+                ('o_data', self.othread.data),
+                ('p_data', self.pthread.data),
                 ('helmet', self.helmet),
-                ('nonlinear_parameters', [self.nonlinear_parameters]),
-                ('R_eye_head', [self.R_eye_head]),
+                ('nonlinear_parameters', self.nonlinear_parameters),
+                ('R_eye_head', self.R_eye_head),
                 ('t_trial_started', t_trial_started),
                 ('i_started_fixating', i_started_fixating),
                 ('t_started_fixating', t_started_fixating),
@@ -384,6 +391,8 @@ class LedShiftExperiment:
                 ('i_saccade_landed', i_saccade_landed),
                 ('i_blanking_ended', i_blanking_ended),
                 ('t_blanking_ended', t_blanking_ended),
+                ('t_led_shift_requested', self.athread.command_enqueue_timestamps[i_led_shift_done]),
+                ('t_led_shift_written', self.athread.command_write_timestamps[i_led_shift_done]),
                 ('t_led_shift_done', self.athread.command_timestamps[i_led_shift_done]),
                 ('t_target_turned_off', self.athread.command_timestamps[i_target_turned_off] if blanking_duration > 0 else None),
                 ('response', response),
@@ -432,21 +441,29 @@ class LedShiftExperiment:
             pdata = self.pthread.get_shortened_data().copy()
             gaze_normals = pdata[:, NORMALS]
 
-            f_interpolate = interp1d(odata[:, OTIME], odata[:, HELMET], axis=0, bounds_error=False, fill_value=np.nan)
-            odata_interpolated = f_interpolate(pdata[:, PTIME]).reshape((-1, 4, 3))
+            resample = fh.Resampler(odata[:, OTIME], pdata[:, PTIME], kind='linear')
+            odata_interpolated = resample(odata[:, HELMET]).reshape((-1, 4, 3))
 
             R_head_world, ref_points = self.helmet.solve(odata_interpolated)
             T_head_world = ref_points[:, I_BARY, :]
 
             confidence_enough = pdata[:, CONFIDENCE] > 0.3
             rotations_valid = ~np.any(np.isnan(R_head_world).reshape((-1, 9)), axis=1)
-            chosen_mask = confidence_enough & rotations_valid
+            normals_valid = ~np.any(np.isnan(gaze_normals), axis=1)
+            chosen_mask = confidence_enough & rotations_valid & normals_valid
+
+            # the levenberg-marquardt solver needs at least as many residuals as the 9 parameters, 3 per sample
+            if chosen_mask.sum() < 3:
+                print(f'Only {chosen_mask.sum()} valid samples, calibration failed. Press space to repeat.\n')
+                self.athread.write_uint8(127, 255, 0, 0)  # red
+                fh.wait_for_keypress(pygame.K_SPACE)
+                continue
 
             T_target_world = np.tile(self.rig_leds[calibration_point, :], (chosen_mask.sum(), 1))
 
             ini_T_eye_head = self.helmet.ref_points[I_EYE, :] - self.helmet.ref_points[I_BARY, :]
 
-            calibration_result = fh.calibrate_pupil_nonlinear(
+            calibration_result = fh.calibrate_pupil_nonlinear_least_squares(
                 T_head_world[chosen_mask, ...],
                 R_head_world[chosen_mask, ...],
                 gaze_normals[chosen_mask, ...],
@@ -454,7 +471,7 @@ class LedShiftExperiment:
                 ini_T_eye_head=ini_T_eye_head,
                 leave_T_eye_head=True)
 
-            print('Optimization done.\n')
+            print(f'Optimization done in {calibration_result.wall_time * 1000:.0f} ms.\n')
             print('Error: ', calibration_result.fun, '\n')
             print('Parameters: ', calibration_result.x, '\n')
 
@@ -0,0 +1,134 @@
+import numpy as np
+from collections import deque, namedtuple
+
+# kind is 'onset' or 'offset', i_start and i_end are sample numbers counted from the first update, i_end is inclusive
+# and None for onsets, peak_velocity is the signed velocity of largest magnitude so far
+SaccadeEvent = namedtuple('SaccadeEvent', ['kind', 'i_start', 'i_end', 'peak_velocity'])
+
+
+class SlidingMedian:
+    """
+    Median of the last window_length values in O(1) per value, from a histogram with bins of bin_width between low
+    and high, so the median is exact up to the bin width. Values outside of that range count in the outermost bins.
+
+    The bin that holds the median is tracked together with the number of values below it. Adding or removing one
+    value moves the rank of the median by at most one, so the tracked bin only has to move a few bins.
+    """
+
+    def __init__(self, window_length, low, high, bin_width):
+        self.window_length = window_length
+        self.low = low
+        self.bin_width = bin_width
+        self.counts = np.zeros(int(np.ceil((high - low) / bin_width)), dtype=np.int64)
+        self.bins = deque()
+        self.i_median_bin = len(self.counts) // 2
+        self.n_below = 0
+
+    def __len__(self):
+        return len(self.bins)
+
+    def add(self, value):
+        i_bin = min(max(int((value - self.low) // self.bin_width), 0), len(self.counts) - 1)
+        self.bins.append(i_bin)
+        self.counts[i_bin] += 1
+        if i_bin < self.i_median_bin:
+            self.n_below += 1
+
+        if len(self.bins) > self.window_length:
+            i_oldest = self.bins.popleft()
+            self.counts[i_oldest] -= 1
+            if i_oldest < self.i_median_bin:
+                self.n_below -= 1
+
+    @property
+    def median(self):
+        if not self.bins:
+            return np.nan
+        rank = (len(self.bins) - 1) // 2
+        while self.n_below > rank:
+            self.i_median_bin -= 1
+            self.n_below -= self.counts[self.i_median_bin]
+        while self.n_below + self.counts[self.i_median_bin] <= rank:
+            self.n_below += self.counts[self.i_median_bin]
+            self.i_median_bin += 1
+        return self.low + (self.i_median_bin + 0.5) * self.bin_width
+
+
+class OnlineSaccadeDetector:
+    """
+    Engbert & Mergenthaler saccade detection one sample at a time, for deciding about saccades during a trial.
+
+    Like sacc_dec_engb_merg_horizontal, a sample is part of a saccade if its velocity is more than VFAC times
+    sqrt(median(v ** 2) - median(v) ** 2), and a saccade needs at least MINDUR samples after its first one. The medians
+    are taken over the velocities of the last window_length samples before the current one, with SlidingMedian, so
+    every update takes constant time. median(v ** 2) is computed as median(|v|) ** 2.
+
+    The onset of a saccade is reported as soon as it has lasted MINDUR samples, the offset with the first sample that
+    is below the threshold again. No saccades are reported before min_samples velocities have been collected.
+
+    Example:
+        detector = OnlineSaccadeDetector(VFAC=6, MINDUR=2)
+        for t, azimuth in samples:
+            event = detector.update(azimuth, t)
+            if event is not None and event.kind == 'onset':
+                ...
+    """
+
+    def __init__(self, VFAC=6, MINDUR=2, window_length=400, min_samples=50, max_velocity=2000, bin_width=0.25):
+        self.VFAC = VFAC
+        self.MINDUR = MINDUR
+        self.min_samples = min_samples
+        self.velocity_median = SlidingMedian(window_length, -max_velocity, max_velocity, bin_width)
+        self.speed_median = SlidingMedian(window_length, 0, max_velocity, bin_width)
+        self.reset()
+
+    def reset(self):
+        self.i_sample = -1
+        self.last_position = None
+        self.last_time = None
+        self.i_saccade_start = None
+        self.peak_velocity = 0.0
+        self.in_saccade = False
+
+    @property
+    def threshold(self):
+        if len(self.velocity_median) < self.min_samples:
+            return np.nan
+        msd = np.sqrt(max(self.speed_median.median ** 2 - self.velocity_median.median ** 2, 0.0))
+        return self.VFAC * msd
+
+    def update(self, position, t):
+        """Adds a position sample in degrees at time t in seconds, returns a SaccadeEvent or None."""
+        velocity = np.nan
+        if self.last_time is not None and t > self.last_time:
+            velocity = (position - self.last_position) / (t - self.last_time)
+        if not np.isnan(position):
+            self.last_position, self.last_time = position, t
+        return self.update_velocity(velocity)
+
+    def update_velocity(self, velocity):
+        """Adds a velocity sample in degrees per second, returns a SaccadeEvent or None."""
+        self.i_sample += 1
+        threshold = self.threshold
+        above_threshold = abs(velocity) > threshold  # False for nan velocities and thresholds
+        if not np.isnan(velocity):
+            self.velocity_median.add(velocity)
+            self.speed_median.add(abs(velocity))
+
+        if above_threshold:
+            if self.i_saccade_start is None:
+                self.i_saccade_start = self.i_sample
+                self.peak_velocity = velocity
+            elif abs(velocity) > abs(self.peak_velocity):
+                self.peak_velocity = velocity
+            if not self.in_saccade and self.i_sample - self.i_saccade_start >= self.MINDUR:
+                self.in_saccade = True
+                return SaccadeEvent('onset', self.i_saccade_start, None, self.peak_velocity)
+            return None
+
+        event = None
+        if self.in_saccade:
+            event = SaccadeEvent('offset', self.i_saccade_start, self.i_sample - 1, self.peak_velocity)
+        self.i_saccade_start = None
+        self.in_saccade = False
+        return event
@@ -1,5 +1,7 @@
 import threading
+import asyncio
 import numpy as np
+import freehead as fh
 import pandas as pd
 import time
 import logging
@@ -103,12 +105,18 @@ class OptotrakThread(threading.Thread):
     current_sample = None
     current_timestamp = None
 
-    data = None
-    i_current_sample = 0
-    buffer_length = 120 * 60 * 10
-    buffer_limit_reached = False
+    buffer = None
+    buffer_mark = 0
+    buffer_length = 120 * 60 * 10  # initial capacity, the ring buffer grows if a trial is longer than this
     sample_size = None
 
+    pull_chunks = True  # pull all available samples at once instead of one per loop iteration with a sleep
+    max_chunk_length = 256
+    chunk_timeout = 0.1  # seconds to wait for the first sample of a chunk before checking should_stop again
+    time_correction_interval = 5.0  # seconds between lsl time correction updates in chunk mode
+    time_correction = 0.0
+    t_last_time_correction = None
+
     def __init__(self, server_config=None, client_config=None):
         super(OptotrakThread, self).__init__()
         self.daemon = True
@@ -116,19 +124,18 @@ class OptotrakThread(threading.Thread):
         self.config_outlet = None
 
         # prepare the config dictionaries
-        self.server_config = dcopy(default_server_config) if server_config is None else dcopy(default_server_config).update(server_config)
-        self.client_config = dcopy(default_client_config) if client_config is None else dcopy(default_client_config).update(client_config)
+        self.server_config = merged_config(default_server_config, server_config)
+        self.client_config = merged_config(default_client_config, client_config)
 
         self.sample_size = self.server_config['lsl']['outlet']['n_channels'] + 1  # plus 1 for lsl timestamp
 
         self.control_outlet = None
         self.data_inlet = None
+        self.chunk_destination = None
+        self.chunk_samples = None
 
         self.should_stop = threading.Event()
         self.started_running = threading.Event()
-        self.recording_allowed = threading.Event()
-        self.requesting_data_reset = threading.Event()
-        self.reset_request_received = threading.Event()
 
     def run(self):
 
@@ -142,56 +149,97 @@ class OptotrakThread(threading.Thread):
         self.control_outlet.push_sample([self.client_config['lsl']['start_code']])
         self.started_running.set()
 
-        while not self.should_stop.is_set():
-
-            if self.requesting_data_reset.is_set():
-                self.reset_request_received.set()
-                logger.debug('Waiting for recording allowance')
-                self.recording_allowed.wait()
-                logger.debug('Recording allowance received. Continuing.')
+        if self.pull_chunks:
+            self.prepare_chunk_buffers()
 
-            if self.i_current_sample == self.buffer_length - 1:
-                self.buffer_limit_reached = True
-                logger.warning('Buffer limit reached, all samples until reset will be lost.')
+        while not self.should_stop.is_set():
 
-            # receive samples even if buffer limit reached, so the socket doesn't fill up
             try:
-                current_data, current_timestamp = self.data_inlet.pull_sample()
-                current_data = np.array(current_data)
-                current_data[current_data < -3.6e+28] = np.nan
-                current_timestamp += self.data_inlet.time_correction();
-                self.current_sample = np.concatenate((current_data, [current_timestamp]))
+                if self.pull_chunks:
+                    self.receive_chunk()
+                else:
+                    self.receive_sample()
+                    time.sleep(0.001)
             except KeyboardInterrupt:
                 logger.warning('Keyboard Interrupt detected, closing...')
                 break
 
-            if not self.buffer_limit_reached:
-                self.data[self.i_current_sample, :] = self.current_sample
-
-            self.i_current_sample += 1
-            time.sleep(0.001)
-
         self.cleanup()
 
-    def reset_data_buffer(self):
-
-        if self.started_running.is_set():
-            self.recording_allowed.clear()
-            self.requesting_data_reset.set()
-            logger.debug('Waiting for reset request received signal.')
-            self.reset_request_received.wait()
-            # now the data gathering loop should wait for allowance, the data array can be reset
-
-        data_array = np.full((self.buffer_length, self.sample_size), np.nan, dtype=np.float)
-        self.data = data_array
-        self.i_current_sample = 0
-        self.buffer_limit_reached = False
-        logger.debug('Successfully reset data array.')
-
-        self.reset_request_received.clear()
-        self.requesting_data_reset.clear()
-        self.recording_allowed.set()
+    def receive_sample(self):
+        current_data, current_timestamp = self.data_inlet.pull_sample()
+        current_data = np.array(current_data)
+        current_data[current_data < -3.6e+28] = np.nan
+        current_timestamp += self.data_inlet.time_correction();
+        self.current_sample = np.concatenate((current_data, [current_timestamp]))
+        self.buffer.append(self.current_sample)
+
+    def prepare_chunk_buffers(self):
+        # lsl writes directly into this array, so it needs the channel format of the stream
+        self.chunk_destination = np.empty(
+            (self.max_chunk_length, self.sample_size - 1), dtype=np.dtype(self.data_inlet.value_type))
+        self.chunk_samples = np.empty((self.max_chunk_length, self.sample_size), dtype=np.float64)
+        self.refresh_time_correction()
+
+    def refresh_time_correction(self):
+        self.time_correction = self.data_inlet.time_correction()
+        self.t_last_time_correction = time.monotonic()
+
+    def receive_chunk(self):
+        # pull_chunk with a timeout waits until max_samples have arrived or the timeout ran out, so only the first
+        # sample is waited for with pull_sample, the samples that are already available after it are drained
+        # without waiting, so there is no added latency compared to pull_sample
+        first_sample, first_timestamp = self.data_inlet.pull_sample(timeout=self.chunk_timeout)
+        if first_timestamp is None:
+            return
+        self.chunk_destination[0] = first_sample
+        _, timestamps = self.data_inlet.pull_chunk(
+            timeout=0.0, max_samples=self.max_chunk_length - 1, dest_obj=self.chunk_destination[1:])
+        timestamps = [first_timestamp] + list(timestamps)
+        n_samples = len(timestamps)
+
+        if time.monotonic() - self.t_last_time_correction >= self.time_correction_interval:
+            self.refresh_time_correction()
+
+        samples = self.chunk_samples[:n_samples]
+        channels = samples[:, :-1]
+        channels[:] = self.chunk_destination[:n_samples]
+        channels[channels < -3.6e+28] = np.nan
+        samples[:, -1] = timestamps
+        samples[:, -1] += self.time_correction
+
+        self.buffer.extend(samples)
+        # view of the newest row, it's only overwritten again once the ring buffer wraps around
+        self.current_sample = self.buffer.latest()
+
+    @property
+    def i_current_sample(self):
+        # number of samples received since the last reset
+        if self.buffer is None:
+            return 0
+        return self.buffer.n_written - self.buffer_mark
+
+    @property
+    def data(self):
+        return None if self.buffer is None else self.buffer.view(self.buffer_mark)
 
+    def reset_data_buffer(self):
+        # the buffer is only allocated once, a reset just marks the current write position
+        if self.buffer is None:
+            self.buffer = fh.RingBuffer(self.buffer_length, self.sample_size)
+        self.buffer_mark = self.buffer.mark()
+        logger.debug('Successfully reset data buffer.')
+
+    def wait_for_sample(self, after_index, timeout=None):
+        # blocks until more than after_index samples have arrived since the last reset
+        # returns the new i_current_sample, or None if the timeout ran out first
+        if self.buffer.wait_for_sample(self.buffer_mark + after_index, timeout):
+            return self.i_current_sample
+        return None
+
+    async def wait_for_sample_async(self, after_index, timeout=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.wait_for_sample, after_index, timeout)
 
     def create_data_inlet(self):
         logger.info('Trying to resolve data inlet stream.')
@@ -216,14 +264,10 @@ class OptotrakThread(threading.Thread):
         self.config_outlet.push_chunk(config_string)
 
     def get_shortened_data(self):
-        if self.data is None:
+        if self.buffer is None:
             return None
-        # check if data has been written to the last sample of the row
-        # otherwise we're currently filling this time step and return the last complete
-        if self.data[self.i_current_sample, -1] == np.nan:
-            return self.data[0:self.i_current_sample, :]
-        else:
-            return self.data[0:self.i_current_sample + 1, :]
+        # copy, because the ring buffer rows are reused after the buffer has wrapped around
+        return self.buffer.view(self.buffer_mark).copy()
 
     def cleanup(self):
         logger.info('Pushing stop code to Optotrak server.')
@@ -235,5 +279,13 @@ class OptotrakThread(threading.Thread):
         logger.info('Deleting data inlet.')
         del self.data_inlet
 
+def merged_config(default_config, config):
+    # dict.update returns None, so the copy has to be updated first and returned afterwards
+    merged = dcopy(default_config)
+    if config is not None:
+        merged.update(config)
+    return merged
+
+
 def padded_lsl_string(string):
     return '<<STRT>>' + string + '<<STOP>>'
@@ -0,0 +1,489 @@
+import pandas as pd
+import numpy as np
+import multiprocessing
+import itertools
+import threading
+import time
+import sys
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .array_apply import stack_column, unstack_array
+from .PipelineCache import PipelineCache, new_hash, content_hash, column_trial_hashes, step_fingerprint
+
+# inputs of row steps that are computed in forked worker processes, the workers inherit them instead of receiving
+# them pickled, keyed by a job number so several steps could be in flight at once
+fork_jobs = {}
+fork_job_numbers = itertools.count()
+
+# cache key of a row or stacked step, the manifest of the step function, one key per trial and the stored entries of
+# the trials that find_trials returned
+TrialKeys = namedtuple('TrialKeys', ['manifest', 'keys', 'found'])
+
+
+def compute_rows_in_fork(job):
+    job_number, start, end = job
+    step, input_values = fork_jobs[job_number]
+    return [step.func({name: values[i] for name, values in input_values.items()}) for i in range(start, end)]
+
+
+class ProgressBar:
+    # one line progress display of a pipeline run, counts finished rows of all steps
+
+    def __init__(self, n_steps, n_rows, width=30):
+        self.n_total = max(n_steps * n_rows, 1)
+        self.n_done = 0
+        self.width = width
+        self.running = set()
+        self.lock = threading.Lock()
+
+    def start(self, step):
+        with self.lock:
+            self.running.add(step.name)
+            self.draw()
+
+    def advance(self, n_rows):
+        with self.lock:
+            self.n_done += n_rows
+            self.draw()
+
+    def finish(self, step):
+        with self.lock:
+            self.running.discard(step.name)
+            self.draw()
+
+    def draw(self):
+        n_filled = int(self.width * self.n_done / self.n_total)
+        bar = '#' * n_filled + '.' * (self.width - n_filled)
+        sys.stdout.write(f'\r[{bar}] {100 * self.n_done / self.n_total:5.1f}% {", ".join(sorted(self.running))}\033[K')
+        sys.stdout.flush()
+
+    def close(self):
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+
+
+class Step:
+    """
+    One step of a Pipeline.
+
+    :param outputs: Name of the column the step computes, or a tuple of names if func returns a tuple
+    :param inputs: Names of the columns func reads, the step only sees these
+    :param func: For kind 'row' called with a dict of the inputs of one trial, for kind 'df' with a DataFrame of the
+        input columns, for kind 'stacked' with a dict of the input columns as arrays with the trials along the first
+        axis (see stack_column), returning such arrays. The outputs of a trial of a stacked step may only depend on
+        the inputs of that trial, like for row steps, because they are cached and computed again per trial.
+    :param kind: 'row', 'df' or 'stacked'
+    :param version: Part of the key of the step in a PipelineCache, change it to invalidate cached outputs when
+        something the function calls has changed
+    """
+
+    def __init__(self, outputs, inputs, func, kind='row', version=None):
+        if kind not in ('row', 'df', 'stacked'):
+            raise Exception(f'Unknown step kind {kind} for {outputs}.')
+        self.outputs = (outputs,) if isinstance(outputs, str) else tuple(outputs)
+        self.inputs = tuple(inputs)
+        self.func = func
+        self.kind = kind
+        self.version = version
+
+    @property
+    def name(self):
+        return self.outputs[0] if len(self.outputs) == 1 else ', '.join(self.outputs)
+
+    def __repr__(self):
+        return f'Step({self.name})'
+
+
+class Pipeline:
+    """
+    Adds columns to a DataFrame of trials with steps that declare which columns they read, like array_apply with an
+    OrderedDict, but the order of execution comes from the dependencies between the steps.
+
+    Steps whose inputs are all available run at the same time in a thread pool. Intermediate columns are only kept
+    while a step still needs them, and if targets are given, only the steps those depend on are run. A step can
+    replace a column of the DataFrame by having it as input and output, later steps then see the new values.
+
+    With processes, the trials of each row step are split into chunks that are computed in a pool of forked
+    processes. The workers inherit the step's input columns from the forked memory, only the results are sent back.
+    The duration of every step of the last run is kept in timings.
+
+    Steps of kind 'stacked' compute all trials at once on arrays with the trials along the first axis, for example
+    the upsampled data that has the same number of samples in every trial. Their outputs are kept as one contiguous
+    array, the next stacked step gets that array without stacking the trials again, the cells of the column are
+    views into it.
+
+    With a PipelineCache, outputs of steps are loaded from disk if the step and its inputs are unchanged since they
+    were stored, only the other steps are computed. Row and stacked steps are cached per trial, only their trials
+    that are new or changed are computed.
+
+    Example:
+        pipeline = Pipeline([
+            Step('t_sacc', [], lambda r: np.arange(-400, 801, 5)),
+            Step('dt', ['t_sacc'], lambda r: fh.padded_diff(r['t_sacc'])),
+        ])
+        pipeline.run(df, targets=['dt'])
+    """
+
+    def __init__(self, steps=()):
+        self.steps = []
+        self.producers = {}
+        self.timings = OrderedDict()
+        for step in steps:
+            self.add(step)
+
+    def add(self, step: Step):
+        for output in step.outputs:
+            if output in self.producers:
+                raise Exception(f'Column {output} is computed by more than one step.')
+            self.producers[output] = step
+        self.steps.append(step)
+        return step
+
+    def dependencies(self, step):
+        # steps that compute inputs of step, an input that is also an output of the step itself is read from the df
+        return {self.producers[name] for name in step.inputs if name in self.producers and name not in step.outputs}
+
+    def required_steps(self, targets):
+        if targets is None:
+            return list(self.steps)
+        required = set()
+        pending = []
+        for target in targets:
+            if target not in self.producers:
+                raise Exception(f'No step computes the target column {target}.')
+            pending.append(self.producers[target])
+        while pending:
+            step = pending.pop()
+            if step not in required:
+                required.add(step)
+                pending.extend(self.dependencies(step))
+        # keep the order of definition, which is also the order the columns are added in
+        return [step for step in self.steps if step in required]
+
+    def topological_order(self, steps):
+        order = []
+        remaining = list(steps)
+        while remaining:
+            ready = [step for step in remaining if self.dependencies(step) <= set(order)]
+            if not ready:
+                raise Exception(f'Steps {remaining} depend on each other in a cycle.')
+            order.extend(ready)
+            remaining = [step for step in remaining if step not in ready]
+        return order
+
+    def cache_keys(self, steps, df, cache):
+        """
+        Keys of the steps in cache and the steps whose outputs are cached for all trials, None for steps that can't
+        be cached. Row and stacked steps compute every trial on its own, their key is a TrialKeys with one key per
+        trial. Steps of kind 'df' can combine trials, their key covers all trials.
+        """
+        index_hash = content_hash(df.index.values)
+        # content hash of every cell of the columns
+        trial_hashes = {}
+        keys = {}
+        for step in self.topological_order(steps):
+            for name in step.inputs:
+                # a step that replaces a df column hashes the column before its output hashes take its place
+                if name not in trial_hashes:
+                    trial_hashes[name] = column_trial_hashes(df[name])
+            input_hashes = [trial_hashes[name] for name in step.inputs]
+            fingerprint = step_fingerprint(step)
+
+            if fingerprint is None or any(hashes is None for hashes in input_hashes):
+                keys[step] = None
+                for name in step.outputs:
+                    trial_hashes[name] = None
+                continue
+
+            if step.kind == 'df':
+                h = new_hash()
+                h.update(index_hash)
+                h.update(fingerprint)
+                for hashes in input_hashes:
+                    for digest in hashes:
+                        h.update(digest)
+                keys[step] = h.hexdigest()
+                output_keys = [f'{keys[step]}{i}' for i in range(len(df))]
+            else:
+                output_keys = []
+                for i in range(len(df)):
+                    h = new_hash()
+                    h.update(fingerprint)
+                    for hashes in input_hashes:
+                        h.update(hashes[i])
+                    output_keys.append(h.hexdigest())
+                keys[step] = TrialKeys(fingerprint.hex(), output_keys, cache.find_trials(fingerprint.hex(), output_keys))
+
+            for name in step.outputs:
+                trial_hashes[name] = [new_hash(f'{key}{name}'.encode()).digest() for key in output_keys]
+
+        cached = set()
+        for step, key in keys.items():
+            if isinstance(key, TrialKeys):
+                if len(key.found) and all(entry is not None for entry in key.found):
+                    cached.add(step)
+            elif key is not None and key in cache:
+                cached.add(step)
+        return keys, cached
+
+    def run(self, df: pd.DataFrame, targets=None, drop=(), max_workers=4, processes=None, progress=False,
+            cache=None):
+        """
+        Computes the steps needed for targets and adds the targets as columns to df in place.
+
+        :param df: DataFrame with one row per trial
+        :param targets: Columns to compute, all step outputs if None. Other step outputs are intermediates that are
+            freed as soon as no remaining step needs them.
+        :param drop: Columns that should not be in df afterwards, for example raw data. Columns of df are dropped as
+            soon as no remaining step needs them.
+        :param max_workers: Number of steps that can run at the same time in threads
+        :param processes: Number of processes the trials of row steps are split across. Steps then run one after the
+            other, each using all processes.
+        :param progress: Show a progress bar and print the step timings at the end
+        :param cache: PipelineCache or folder path of one, outputs of steps are loaded from it if possible and
+            computed outputs are stored in it
+        :return: df
+        """
+        steps = self.required_steps(targets)
+        step_outputs = {output for step in steps for output in step.outputs}
+        keep = (step_outputs if targets is None else set(targets)) - set(drop)
+
+        missing = {name for step in steps for name in step.inputs if name not in step_outputs and name not in df}
+        if missing:
+            raise Exception(f'Columns {sorted(missing)} are neither in the DataFrame nor computed by a step.')
+
+        keys, cached = {}, set()
+        if cache is not None:
+            cache = PipelineCache(cache) if isinstance(cache, str) else cache
+            keys, cached = self.cache_keys(steps, df, cache)
+            # going back from the kept columns, a cached step is loaded and doesn't need its inputs, steps that only
+            # lead to cached steps are left out
+            needed = set(keep)
+            used = set()
+            for step in reversed(self.topological_order(steps)):
+                if needed.isdisjoint(step.outputs):
+                    continue
+                used.add(step)
+                if step not in cached:
+                    needed.update(step.inputs)
+            steps = [step for step in steps if step in used]
+
+        # count for every column how many steps still have to read it
+        n_readers = {}
+        for step in steps:
+            if step in cached:
+                continue
+            for name in step.inputs:
+                n_readers[name] = n_readers.get(name, 0) + 1
+
+        columns = {}
+        # outputs of stacked steps as one array
+        stacked = {}
+        done = set()
+        pending = list(steps)
+        running = {}
+        self.timings = OrderedDict()
+        progress_bar = ProgressBar(len(steps), len(df)) if progress else None
+
+        def read(step, name):
+            if name in step.outputs or name not in step_outputs:
+                return df[name]
+            if step.kind == 'stacked' and name in stacked:
+                return stacked[name]
+            return columns[name]
+
+        def release(name):
+            stacked.pop(name, None)
+            if name in columns and name not in keep:
+                del columns[name]
+            elif name in df and name in drop and name not in step_outputs:
+                df.drop(columns=[name], inplace=True)
+
+        # forking while other threads run steps could copy their locks in a held state
+        with ThreadPoolExecutor(max_workers=max_workers if not processes else 1) as executor:
+            while pending or running:
+                # submit every step whose inputs are ready
+                for step in list(pending):
+                    if step in cached:
+                        pending.remove(step)
+                        running[executor.submit(
+                            self.timed_load_step, step, cache, keys[step], df.index, progress_bar)] = step
+                    elif self.dependencies(step) <= done:
+                        pending.remove(step)
+                        inputs = {name: read(step, name) for name in step.inputs}
+                        running[executor.submit(
+                            self.timed_compute_step, step, inputs, df.index, processes, progress_bar,
+                            cache if keys.get(step) else None, keys.get(step))] = step
+
+                if not running:
+                    raise Exception(f'Steps {pending} depend on each other in a cycle.')
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    for name, values in zip(step.outputs, future.result()):
+                        if isinstance(values, np.ndarray):
+                            stacked[name] = values
+                            values = unstack_array(values, df.index)
+                        columns[name] = values
+                    done.add(step)
+                    for name in step.inputs if step not in cached else ():
+                        n_readers[name] -= 1
+                        if n_readers[name] == 0:
+                            release(name)
+                    for name in step.outputs:
+                        if name not in n_readers:
+                            release(name)
+
+        for step in steps:
+            for name in step.outputs:
+                if name in keep:
+                    df[name] = columns[name]
+        df.drop(columns=[name for name in drop if name in df], inplace=True)
+
+        if cache is not None:
+            cache.evict()
+        if progress:
+            progress_bar.close()
+            self.print_timings()
+        return df
+
+    def print_timings(self):
+        total = sum(self.timings.values())
+        print(f'{len(self.timings)} steps, {total:.2f} s of computation, slowest first:')
+        for name, duration in sorted(self.timings.items(), key=lambda item: -item[1]):
+            print(f'{duration:9.3f} s {100 * duration / total if total else 0:5.1f}%  {name}')
+
+    def timed_compute_step(self, step, inputs, index, processes=None, progress_bar=None, cache=None, key=None):
+        if progress_bar is not None:
+            progress_bar.start(step)
+        t_start = time.perf_counter()
+        if cache is None:
+            result = self.compute_rows(step, inputs, index, processes, progress_bar)
+        elif isinstance(key, TrialKeys):
+            # only the trials that aren't cached yet are computed
+            parts = cache.load_trials(key.found)
+            missing = np.flatnonzero([entry is None for entry in key.found])
+            if progress_bar is not None:
+                progress_bar.advance(len(index) - len(missing))
+            if len(missing) == len(index):
+                result = self.compute_rows(step, inputs, index, processes, progress_bar)
+            else:
+                result = self.compute_rows(step, {
+                    name: values.iloc[missing] if isinstance(values, pd.Series) else values[missing]
+                    for name, values in inputs.items()}, index[missing], processes, progress_bar)
+            outputs = [values if isinstance(values, np.ndarray) else values.values for values in result]
+            cache.store_trials(key.manifest, [key.keys[i] for i in missing], outputs)
+            if len(missing) < len(index):
+                parts.append((missing, outputs, np.arange(len(missing))))
+                result = assemble_trials(step, parts, index)
+        else:
+            result = self.compute_rows(step, inputs, index, processes, progress_bar)
+            cache.store(key, result)
+        self.timings[step.name] = time.perf_counter() - t_start
+        if progress_bar is not None:
+            progress_bar.finish(step)
+        return result
+
+    def compute_rows(self, step, inputs, index, processes=None, progress_bar=None):
+        if step.kind == 'row' and processes:
+            return self.compute_step_in_processes(step, inputs, index, processes, progress_bar)
+        result = self.compute_step(step, inputs, index)
+        if progress_bar is not None:
+            progress_bar.advance(len(index))
+        return result
+
+    def timed_load_step(self, step, cache, key, index, progress_bar=None):
+        if progress_bar is not None:
+            progress_bar.start(step)
+        t_start = time.perf_counter()
+        if isinstance(key, TrialKeys):
+            result = assemble_trials(step, cache.load_trials(key.found), index)
+        else:
+            result = cache.load(key)
+        self.timings[f'{step.name} (cached)'] = time.perf_counter() - t_start
+        if progress_bar is not None:
+            progress_bar.advance(len(index))
+            progress_bar.finish(step)
+        return result
+
+    @staticmethod
+    def compute_step(step, inputs, index):
+        if step.kind == 'stacked':
+            result = step.func({name: stack_column(values) for name, values in inputs.items()})
+            result = (result,) if len(step.outputs) == 1 else result
+            if len(result) != len(step.outputs):
+                raise Exception(f'Step {step.name} returned {len(result)} outputs instead of {len(step.outputs)}.')
+            for values in result:
+                if not isinstance(values, np.ndarray) or values.ndim == 0 or values.shape[0] != len(index):
+                    raise Exception(f'Step {step.name} has to return arrays with {len(index)} trials along the first '
+                                    f'axis.')
+            # the arrays are turned into columns by run, which keeps them for the next stacked steps
+            return list(result)
+
+        if step.kind == 'df':
+            result = step.func(pd.DataFrame(inputs, index=index))
+            result = (result,) if len(step.outputs) == 1 else result
+            if len(result) != len(step.outputs):
+                raise Exception(f'Step {step.name} returned {len(result)} outputs instead of {len(step.outputs)}.')
+            return [pd.Series(values, index=index) for values in result]
+
+        input_values = {name: values.values for name, values in inputs.items()}
+        return rows_to_columns(
+            step,
+            [step.func({name: values[i] for name, values in input_values.items()}) for i in range(len(index))],
+            index)
+
+    @staticmethod
+    def compute_step_in_processes(step, inputs, index, processes, progress_bar=None):
+        n_rows = len(index)
+        # a few chunks per process, so a slow chunk doesn't leave the others idle
+        chunk_length = max(1, -(-n_rows // (4 * processes)))
+        bounds = [(start, min(start + chunk_length, n_rows)) for start in range(0, n_rows, chunk_length)]
+
+        job_number = next(fork_job_numbers)
+        fork_jobs[job_number] = (step, {name: values.values for name, values in inputs.items()})
+        try:
+            # the pool has to be forked after the inputs are registered
+            with multiprocessing.get_context('fork').Pool(processes) as pool:
+                results = []
+                # imap returns the chunks in order as they are done
+                jobs = [(job_number, start, end) for start, end in bounds]
+                for chunk_results in pool.imap(compute_rows_in_fork, jobs):
+                    results.extend(chunk_results)
+                    if progress_bar is not None:
+                        progress_bar.advance(len(chunk_results))
+        finally:
+            del fork_jobs[job_number]
+        return rows_to_columns(step, results, index)
+
+
+def rows_to_columns(step, results, index):
+    # one object array per output, filled element by element so arrays stay whole in their cells
+    columns = [np.empty(len(results), dtype=object) for _ in step.outputs]
+    for i, result in enumerate(results):
+        if len(step.outputs) == 1:
+            # like with arr_series in array_apply, a list with one element stands for that element
+            columns[0][i] = result[0] if isinstance(result, list) and len(result) == 1 else result
+            continue
+        if len(result) != len(step.outputs):
+            raise Exception(f'Step {step.name} returned {len(result)} outputs instead of {len(step.outputs)}.')
+        for column, value in zip(columns, result):
+            column[i] = value
+    # numbers and booleans get a proper dtype like with df.apply
+    return [pd.Series(column, index=index).infer_objects() for column in columns]
+
+
+def assemble_trials(step, parts, index):
+    # outputs of a row or stacked step from packs of trials, see PipelineCache.load_trials
+    result = []
+    for i_output in range(len(step.outputs)):
+        if step.kind == 'stacked':
+            first = parts[0][1][i_output]
+            values = np.empty((len(index), *first.shape[1:]), dtype=first.dtype)
+        else:
+            values = np.empty(len(index), dtype=object)
+        for positions, outputs, rows in parts:
+            values[positions] = outputs[i_output][rows]
+        result.append(values if step.kind == 'stacked' else pd.Series(values, index=index).infer_objects())
+    return result
@@ -0,0 +1,286 @@
+import os
+import sys
+import types
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+
+# file ending of the cache entries, one entry holds all outputs of one step
+ENTRY_SUFFIX = '.pickle'
+
+
+def new_hash(data=b''):
+    return hashlib.blake2b(data, digest_size=20)
+
+
+def update_value_hash(h, value, seen=None):
+    # content hash of a cell value, arrays by their bytes, containers element by element, anything else pickled
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        value = np.ascontiguousarray(value)
+        h.update(f'a{value.dtype.str}{value.shape}'.encode())
+        if value.size:
+            h.update(value.reshape(-1).view(np.uint8))
+    elif isinstance(value, (list, tuple, np.ndarray)):
+        h.update(f'l{type(value).__name__}{len(value)}'.encode())
+        for element in value:
+            update_value_hash(h, element, seen)
+    elif isinstance(value, dict):
+        h.update(f'd{len(value)}'.encode())
+        for name, element in value.items():
+            update_value_hash(h, name, seen)
+            update_value_hash(h, element, seen)
+    elif value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic)):
+        h.update(repr((type(value).__name__, value)).encode())
+    elif isinstance(value, (types.FunctionType, types.MethodType)) or hasattr(value, 'py_func'):
+        update_function_hash(h, value, set() if seen is None else seen)
+    else:
+        h.update(b'p' + pickle.dumps(value, protocol=4))
+        if is_freehead_class(type(value)):
+            # pickles only refer to the class by name, a step calling methods of the object depends on their code
+            update_class_hash(h, type(value), set() if seen is None else seen)
+
+
+def content_hash(value):
+    h = new_hash()
+    update_value_hash(h, value)
+    return h.digest()
+
+
+def column_trial_hashes(values: pd.Series):
+    """Content hash of every cell of a DataFrame column, None if a cell can't be hashed."""
+    # cells often hold the same object, like the helmet rigidbody, which is then only hashed once
+    object_hashes = {}
+    hashes = []
+    try:
+        for value in values.values:
+            if isinstance(value, np.ndarray) or id(value) not in object_hashes:
+                digest = content_hash(value)
+                if not isinstance(value, np.ndarray):
+                    object_hashes[id(value)] = digest
+            else:
+                digest = object_hashes[id(value)]
+            hashes.append(digest)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+    return hashes
+
+
+def update_code_hash(h, code):
+    # the bytecode doesn't change with comments or line numbers, unlike the source
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            update_code_hash(h, const)
+        elif isinstance(const, frozenset):
+            h.update(repr(sorted(const, key=repr)).encode())
+        else:
+            h.update(repr(const).encode())
+
+
+def global_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= global_names(const)
+    return names
+
+
+def is_freehead_function(value):
+    return isinstance(value, types.FunctionType) and (value.__module__ or '').split('.')[0] == 'freehead'
+
+
+def is_freehead_class(value):
+    return isinstance(value, type) and (value.__module__ or '').split('.')[0] == 'freehead'
+
+
+def update_class_hash(h, cls, seen):
+    # the code of all methods and the constant attributes of a freehead class and its freehead base classes
+    if cls in seen:
+        return
+    seen.add(cls)
+    h.update(cls.__qualname__.encode())
+    for base in cls.__mro__:
+        if not is_freehead_class(base):
+            continue
+        for name, attribute in sorted(vars(base).items()):
+            if isinstance(attribute, (staticmethod, classmethod)):
+                attribute = attribute.__func__
+            elif isinstance(attribute, property):
+                attribute = attribute.fget
+            if isinstance(attribute, types.FunctionType) or hasattr(attribute, 'py_func'):
+                h.update(name.encode())
+                update_function_hash(h, attribute, seen)
+            elif attribute is None or isinstance(attribute, (bool, int, float, complex, str, bytes, tuple)):
+                h.update(name.encode())
+                update_value_hash(h, attribute, seen)
+
+
+def update_function_hash(h, func, seen):
+    """
+    Hashes the code of func, its default arguments and closure values and the constants, freehead functions and
+    freehead classes it refers to, so that the hash changes with the function. Library functions it calls are not
+    followed.
+    """
+    func = getattr(func, 'py_func', func)  # numba functions
+    func = getattr(func, '__func__', func)  # methods
+    if func in seen:
+        return
+    seen.add(func)
+
+    code = func.__code__
+    update_code_hash(h, code)
+    update_value_hash(h, func.__defaults__, seen)
+    update_value_hash(h, func.__kwdefaults__, seen)
+    for cell in func.__closure__ or ():
+        update_value_hash(h, cell.cell_contents, seen)
+
+    names = global_names(code)
+    for name in sorted(names):
+        if name not in func.__globals__:
+            continue
+        value = func.__globals__[name]
+        if isinstance(value, types.ModuleType):
+            if value.__name__.split('.')[0] == 'freehead':
+                # attributes like fh.to_unit, the names of attributes are in co_names as well
+                for attribute in sorted(names):
+                    function = getattr(value, attribute, None)
+                    if is_freehead_function(getattr(function, 'py_func', function)):
+                        update_function_hash(h, function, seen)
+                    elif is_freehead_class(function):
+                        update_class_hash(h, function, seen)
+        elif is_freehead_function(getattr(value, 'py_func', value)):
+            update_function_hash(h, value, seen)
+        elif is_freehead_class(value):
+            update_class_hash(h, value, seen)
+        elif value is None or isinstance(value, (bool, int, float, complex, str, bytes, tuple, np.ndarray)):
+            h.update(name.encode())
+            update_value_hash(h, value, seen)
+
+
+def step_fingerprint(step):
+    """Hash of everything that defines what a step computes, None if its function can't be hashed."""
+    h = new_hash()
+    h.update(repr((step.kind, step.outputs, step.inputs, step.version, sys.version_info[:2])).encode())
+    try:
+        update_function_hash(h, step.func, set())
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+    return h.digest()
+
+
+class PipelineCache:
+    """
+    Folder of step outputs for Pipeline.run, addressed by the content they were computed from.
+
+    Row and stacked steps compute every trial on its own, so their outputs are stored per trial. The key of a trial
+    is a hash of the step's function, version and input column names together with the content hashes of the trial's
+    input cells. The outputs of the trials that were computed together are stored in one pack, and a manifest per
+    step function maps the trial keys to their pack, so adding or changing a trial only computes that trial again.
+    Steps of kind 'df' can combine trials, they are stored as one entry keyed by the hashes of their whole input
+    columns. The hash of a step output is derived from the key, so it doesn't need to be hashed again. Only the
+    trials whose step function or inputs changed miss the cache and are computed, steps that only lead to cached
+    steps are not even loaded.
+
+    The size of the folder is kept below max_bytes by deleting the least recently used entries after each run.
+    Changes inside library functions that a step calls don't change its key, give the step a new version then or
+    clear the cache. The code of freehead functions and classes that the step refers to, or whose objects are in its
+    inputs, is part of the key.
+
+    Example:
+        cache = PipelineCache(os.path.expanduser('~/.cache/freehead_pipeline'))
+        pipeline.run(df, cache=cache)
+    """
+
+    def __init__(self, folder_path, max_bytes=4 * 1024 ** 3):
+        self.folder_path = folder_path
+        self.max_bytes = max_bytes
+        os.makedirs(folder_path, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.folder_path, key + ENTRY_SUFFIX)
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key))
+
+    def load(self, key):
+        path = self.path(key)
+        with open(path, 'rb') as f:
+            values = pickle.load(f)
+        # the modification time is the time of last use for the eviction
+        os.utime(path)
+        return values
+
+    def store(self, key, values):
+        path = self.path(key)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as f:
+            pickle.dump(values, f, protocol=4)
+        # a reader never sees a partially written entry
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def manifest_key(manifest):
+        return 'manifest-' + manifest
+
+    def find_trials(self, manifest, trial_keys):
+        """(pack key, row) of every trial key that is stored in the manifest's packs, None for the others."""
+        if self.manifest_key(manifest) not in self:
+            return [None] * len(trial_keys)
+        stored = self.load(self.manifest_key(manifest))
+        found = [stored.get(key) for key in trial_keys]
+        # packs are evicted independently of the manifest
+        existing = {pack: pack in self for pack in {entry[0] for entry in found if entry is not None}}
+        return [entry if entry is not None and existing[entry[0]] else None for entry in found]
+
+    def load_trials(self, found):
+        """
+        Outputs of the trials that find_trials found, as (positions, outputs, rows) per pack. positions are the
+        positions in found, rows the rows of these trials in the output arrays of the pack.
+        """
+        by_pack = {}
+        for position, entry in enumerate(found):
+            if entry is not None:
+                positions, rows = by_pack.setdefault(entry[0], ([], []))
+                positions.append(position)
+                rows.append(entry[1])
+        return [(np.array(positions), self.load(pack), np.array(rows))
+                for pack, (positions, rows) in by_pack.items()]
+
+    def store_trials(self, manifest, trial_keys, outputs):
+        """Stores outputs, one array per step output with one row per trial key, as a pack of the manifest."""
+        pack = content_hash((manifest, tuple(trial_keys))).hex()
+        self.store(pack, outputs)
+        stored = self.load(self.manifest_key(manifest)) if self.manifest_key(manifest) in self else {}
+        # entries of evicted packs are dropped, so the manifest doesn't keep growing
+        existing = {pack: pack in self for pack in {entry[0] for entry in stored.values()}}
+        stored = {key: entry for key, entry in stored.items() if existing[entry[0]]}
+        stored.update((key, (pack, row)) for row, key in enumerate(trial_keys))
+        self.store(self.manifest_key(manifest), stored)
+
+    def entries(self):
+        # (last use, size, path) of every entry, least recently used first
+        entries = []
+        for name in os.listdir(self.folder_path):
+            if name.endswith(ENTRY_SUFFIX):
+                stat = os.stat(os.path.join(self.folder_path, name))
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self.folder_path, name)))
+        return sorted(entries)
+
+    @property
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
@@ -1,5 +1,7 @@
 import threading
+import asyncio
 import numpy as np
+import freehead as fh
 import pandas as pd
 import zmq
 import time
@@ -14,13 +16,18 @@ class PupilThread(threading.Thread):
     address = '127.0.0.1'
     request_port = '50020'
 
-    buffer_length = 200 * 60 * 10 # standard number of time steps in buffer (10 minutes)
+    buffer_length = 200 * 60 * 10 # initial number of time steps in ring buffer (10 minutes), grows if needed
     sample_size = 9  # pupil time, system time receipt, gaze normal x, y, z, confidence, eyecenter x, y, z
 
-    data = None
-    i_current_sample = 0
+    buffer = None
+    buffer_mark = 0
     current_sample = None
-    buffer_limit_reached = False
+
+    poll_timeout_ms = 100  # how long to wait for new messages before checking should_stop again
+
+    # decode cost counter
+    n_decoded_samples = 0
+    decode_duration_total = 0.0
 
     def __init__(self):
         super(PupilThread, self).__init__()
@@ -38,13 +45,12 @@ class PupilThread(threading.Thread):
         self.sub_port = self.request_socket.recv_string()
 
         self.sub_socket = self.context.socket(zmq.SUB)
+        self.unpacker = None
+        self.reset_unpacker()
 
         # define thread synchronization events
         self.should_stop = threading.Event()
         self.started_running = threading.Event()
-        self.recording_allowed = threading.Event()
-        self.requesting_data_reset = threading.Event()
-        self.reset_request_received = threading.Event()
 
         # no need for synchronization now that pupil sends only time.monotonic()
         # self.synchronize_time()
@@ -61,48 +67,90 @@ class PupilThread(threading.Thread):
 
         self.started_running.set()
 
-        while not self.should_stop.is_set():
-
-            if self.requesting_data_reset.is_set():
-                self.reset_request_received.set()
-                logger.debug('Waiting for recording allowance')
-                self.recording_allowed.wait()
-                logger.debug('Recording allowance received. Continuing.')
+        poller = zmq.Poller()
+        poller.register(self.sub_socket, zmq.POLLIN)
 
-            if self.i_current_sample == self.buffer_length - 1:
-                self.buffer_limit_reached = True
-                logger.warning('Buffer limit reached, all samples until reset will be lost.')
+        while not self.should_stop.is_set():
 
-            # receive samples even if buffer limit reached, so the socket doesn't fill up
             try:
-                topic = self.sub_socket.recv_string()
-                message = self.sub_socket.recv()
-                system_time_received = time.monotonic()
-                msg = msgpack.loads(message, encoding='utf-8')
-                self.current_sample = np.array([
-                    msg['timestamp'],
-                    system_time_received,
-                    msg['circle_3d']['normal'][0],
-                    msg['circle_3d']['normal'][1],
-                    msg['circle_3d']['normal'][2],
-                    msg['confidence'],
-                    msg['sphere']['center'][0],
-                    msg['sphere']['center'][1],
-                    msg['sphere']['center'][2],
-                ])
+                # wait until at least one message is there, the timeout is only for checking should_stop regularly
+                if poller.poll(self.poll_timeout_ms):
+                    self.receive_available_samples()
             except KeyboardInterrupt:
                 logger.warning('Keyboard Interrupt detected, closing...')
                 break
 
-            if not self.buffer_limit_reached:
-                self.data[self.i_current_sample, :] = self.current_sample
-
-            self.i_current_sample += 1
-            time.sleep(0.001)
-
         # after loop, close sockets and context
         self.cleanup()
 
+    def receive_available_samples(self):
+        # drain everything that has queued up since the last wake-up
+        while True:
+            try:
+                topic = self.sub_socket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            # the payload is part of the same multipart message, so it's already there
+            message = self.sub_socket.recv()
+            system_time_received = time.monotonic()
+
+            t_decode_start = time.perf_counter()
+            row = self.buffer.next_row()
+            # the row may hold an old sample from before the buffer wrapped around
+            row[:] = np.nan
+            try:
+                self.decode_into_row(message, row)
+            except (msgpack.UnpackException, ValueError, TypeError) as e:
+                # the rest of the broken message would stay in the reused unpacker and corrupt the next ones
+                logger.warning(f'Skipping pupil message that could not be decoded: {e!r}')
+                self.reset_unpacker()
+                continue
+            row[1] = system_time_received
+            self.buffer.commit()
+            self.current_sample = row
+            self.decode_duration_total += time.perf_counter() - t_decode_start
+            self.n_decoded_samples += 1
+
+    def reset_unpacker(self):
+        # reused for every message, tuples are cheaper than lists for the few arrays that are unpacked
+        self.unpacker = msgpack.Unpacker(raw=False, use_list=False)
+
+    def decode_into_row(self, message, row):
+        # walk through the msgpack map and only unpack the fields that are stored, all others are skipped
+        # without creating python objects for them
+        unpacker = self.unpacker
+        unpacker.feed(message)
+        for _ in range(unpacker.read_map_header()):
+            key = unpacker.unpack()
+            if key == 'timestamp':
+                row[0] = unpacker.unpack()
+            elif key == 'confidence':
+                row[5] = unpacker.unpack()
+            elif key == 'circle_3d':
+                self.decode_vector_into_row(unpacker, 'normal', row, 2)
+            elif key == 'sphere':
+                self.decode_vector_into_row(unpacker, 'center', row, 6)
+            else:
+                unpacker.skip()
+
+    @staticmethod
+    def decode_vector_into_row(unpacker, wanted_key, row, start):
+        for _ in range(unpacker.read_map_header()):
+            if unpacker.unpack() == wanted_key:
+                x, y, z = unpacker.unpack()
+                row[start] = x
+                row[start + 1] = y
+                row[start + 2] = z
+            else:
+                unpacker.skip()
+
+    @property
+    def mean_decode_duration(self):
+        # average seconds spent per sample between receiving and committing it to the buffer
+        if self.n_decoded_samples == 0:
+            return None
+        return self.decode_duration_total / self.n_decoded_samples
+
     def synchronize_time(self):
         t = time.monotonic()
         self.request_socket.send_string(f'T {t}')
@@ -117,23 +165,34 @@ class PupilThread(threading.Thread):
         }))
         return self.request_socket.recv_string()
 
+    @property
+    def i_current_sample(self):
+        # number of samples received since the last reset
+        if self.buffer is None:
+            return 0
+        return self.buffer.n_written - self.buffer_mark
+
+    @property
+    def data(self):
+        return None if self.buffer is None else self.buffer.view(self.buffer_mark)
+
     def reset_data_buffer(self):
-        if self.started_running.is_set():
-            self.recording_allowed.clear()
-            self.requesting_data_reset.set()
-            logger.debug('Waiting for reset request received signal.')
-            self.reset_request_received.wait()
-            # now the data gathering loop should wait for allowance, the data array can be reset
-
-        data_array = np.full((self.buffer_length, self.sample_size), np.nan, dtype=np.float)
-        self.data = data_array
-        self.i_current_sample = 0
-        self.buffer_limit_reached = False
-        logger.debug('Successfully reset data array.')
-
-        self.reset_request_received.clear()
-        self.requesting_data_reset.clear()
-        self.recording_allowed.set()
+        # the buffer is only allocated once, a reset just marks the current write position
+        if self.buffer is None:
+            self.buffer = fh.RingBuffer(self.buffer_length, self.sample_size)
+        self.buffer_mark = self.buffer.mark()
+        logger.debug('Successfully reset data buffer.')
+
+    def wait_for_sample(self, after_index, timeout=None):
+        # blocks until more than after_index samples have arrived since the last reset
+        # returns the new i_current_sample, or None if the timeout ran out first
+        if self.buffer.wait_for_sample(self.buffer_mark + after_index, timeout):
+            return self.i_current_sample
+        return None
+
+    async def wait_for_sample_async(self, after_index, timeout=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.wait_for_sample, after_index, timeout)
 
     def cleanup(self):
         self.request_socket.close()
@@ -142,12 +201,8 @@ class PupilThread(threading.Thread):
         logger.info('ZMQ context terminated gracefully.')
 
     def get_shortened_data(self):
-        if self.data is None:
+        if self.buffer is None:
             return None
-        # check if data has been written to the last sample of the row
-        # otherwise we're currently filling this time step and return the last complete
-        if self.data[self.i_current_sample, -1] == np.nan:
-            return self.data[0:self.i_current_sample - 1, :]
-        else:
-            return self.data[0:self.i_current_sample, :]
+        # copy, because the ring buffer rows are reused after the buffer has wrapped around
+        return self.buffer.view(self.buffer_mark).copy()
 
@@ -0,0 +1,115 @@
+import numpy as np
+
+
+def resampling_indices(a_time, b_time, kind='linear', max_gap=None):
+    """
+    Source indices below and above every target time, the weight of the upper one and which targets have no value,
+    with the same conventions as scipy's interp1d: targets outside of a_time get no value, a target on a source
+    timestamp is interpolated from the interval that ends there.
+    """
+    a_time = np.asarray(a_time, dtype=np.float64)
+    b_time = np.asarray(b_time, dtype=np.float64)
+    if a_time.ndim != 1 or b_time.ndim != 1:
+        raise ValueError('Timestamps have to be one dimensional.')
+    if len(a_time) < 2:
+        raise ValueError('At least two source timestamps are needed.')
+
+    # interp1d sorts the source samples as well
+    order = None
+    if np.any(a_time[1:] < a_time[:-1]):
+        order = np.argsort(a_time, kind='mergesort')
+        a_time = a_time[order]
+
+    i_hi = np.clip(np.searchsorted(a_time, b_time, side='left'), 1, len(a_time) - 1)
+    i_lo = i_hi - 1
+    interval = a_time[i_hi] - a_time[i_lo]
+    invalid = (b_time < a_time[0]) | (b_time > a_time[-1])
+    if max_gap is not None:
+        # no values inside of gaps between source samples, dropped frames aren't bridged
+        invalid |= interval > max_gap
+
+    if kind == 'linear':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = (b_time - a_time[i_lo]) / interval
+    elif kind == 'nearest':
+        # rounds down halfway between two samples like interp1d
+        bounds = (a_time[1:] + a_time[:-1]) / 2
+        i_lo = i_hi = np.clip(np.searchsorted(bounds, b_time, side='left'), 0, len(a_time) - 1)
+        weights = np.zeros(len(b_time))
+    else:
+        raise ValueError(f'Unknown kind "{kind}", use "linear" or "nearest".')
+
+    if order is not None:
+        i_lo, i_hi = order[i_lo], order[i_hi]
+    return i_lo, i_hi, weights, invalid
+
+
+class Resampler:
+    """
+    Resamples signals from the timestamps a_time onto the timestamps b_time, like interp1d with bounds_error=False
+    and fill_value=np.nan, but the indices and weights are computed once and reused for every signal with the same
+    timestamps, and all channels of a signal are resampled together.
+
+    For many trials at once, a_time is a sequence of one timestamp array per trial and b_time is either one array for
+    all trials or also one per trial. The signals are then a sequence of one array per trial, the lengths can differ
+    between trials. The result is one array with the trials along the first axis, or a list of arrays if the trials
+    have different numbers of target timestamps.
+
+    With max_gap, target timestamps between two source samples that are further apart than max_gap get no value.
+
+    Example:
+        resampler = Resampler(p_times, np.arange(-400, 801, 5), kind='linear', max_gap=20)
+        normals = resampler([p[:, 2:5] for p in p_data])
+        latencies = resampler([p[:, 1] - p[:, 0] for p in p_data])
+    """
+
+    def __init__(self, a_time, b_time, kind='linear', max_gap=None):
+        self.kind = kind
+        self.batched = not (isinstance(a_time, np.ndarray) and a_time.dtype != object and a_time.ndim == 1)
+
+        if not self.batched:
+            self.i_lo, self.i_hi, self.weights, self.invalid = resampling_indices(a_time, b_time, kind, max_gap)
+            self.n_source = len(a_time)
+            return
+
+        a_times = list(a_time)
+        shared_b_time = isinstance(b_time, np.ndarray) and b_time.dtype != object and b_time.ndim == 1
+        b_times = [b_time] * len(a_times) if shared_b_time else list(b_time)
+        if len(b_times) != len(a_times):
+            raise ValueError(f'{len(a_times)} source and {len(b_times)} target timestamp arrays.')
+
+        # indices into the source samples of all trials concatenated
+        self.a_offsets = np.concatenate(([0], np.cumsum([len(t) for t in a_times])))
+        self.b_offsets = np.concatenate(([0], np.cumsum([len(t) for t in b_times])))
+        parts = [resampling_indices(a, b, kind, max_gap) for a, b in zip(a_times, b_times)]
+        self.i_lo = np.concatenate([p[0] + offset for p, offset in zip(parts, self.a_offsets)])
+        self.i_hi = np.concatenate([p[1] + offset for p, offset in zip(parts, self.a_offsets)])
+        self.weights = np.concatenate([p[2] for p in parts])
+        self.invalid = np.concatenate([p[3] for p in parts])
+        self.n_source = int(self.a_offsets[-1])
+        b_lengths = {len(b) for b in b_times}
+        # all trials have the same number of targets, so the result can be one array
+        self.b_length = b_lengths.pop() if len(b_lengths) == 1 else None
+
+    def __call__(self, a):
+        if self.batched:
+            a = np.concatenate([np.asarray(values) for values in a], axis=0) if len(a) else np.empty(0)
+        a = np.asarray(a)
+        if a.shape[0] != self.n_source:
+            raise ValueError(f'Expected {self.n_source} samples, got {a.shape[0]}.')
+        if not np.issubdtype(a.dtype, np.inexact):
+            a = a.astype(np.float64)
+
+        if self.kind == 'nearest':
+            result = a[self.i_lo]
+        else:
+            weights = self.weights.reshape(self.weights.shape + (1,) * (a.ndim - 1))
+            lo = a[self.i_lo]
+            result = lo + (a[self.i_hi] - lo) * weights
+        result[self.invalid] = np.nan
+
+        if not self.batched:
+            return result
+        if self.b_length is not None:
+            return result.reshape((len(self.b_offsets) - 1, self.b_length) + a.shape[1:])
+        return np.split(result, self.b_offsets[1:-1])
@@ -0,0 +1,184 @@
+import numpy as np
+import logging
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """
+    Preallocated sample storage for one writer thread and any number of reader threads.
+
+    Every row is stored twice, at position i and i + capacity, so that each window of up to capacity samples is
+    available as one contiguous slice and views never have to be copied. The write cursor only ever increases, a
+    trial start is just a remembered cursor position (a mark). If the samples since the last mark don't fit into the
+    buffer anymore, the capacity is doubled instead of dropping samples.
+    """
+
+    def __init__(self, capacity, sample_size, dtype=np.float64):
+        self.sample_size = sample_size
+        self.dtype = dtype
+        # storage and capacity are swapped together so readers never see a mismatched pair
+        self._storage = (np.full((2 * capacity, sample_size), np.nan, dtype=dtype), capacity)
+        # write cursor and last mark, kept in an array so that subclasses can place them in shared memory
+        self._header = np.zeros(2, dtype=np.int64)
+        # readers can wait on this instead of polling the write cursor
+        self.new_sample_condition = threading.Condition()
+
+    @property
+    def capacity(self):
+        return self._storage[1]
+
+    @property
+    def n_written(self):
+        # number of samples ever written, the only thing the writer changes after filling a row
+        return int(self._header[0])
+
+    @property
+    def last_mark(self):
+        # oldest position that readers still need, is protected from being overwritten
+        return int(self._header[1])
+
+    def mark(self) -> int:
+        # remember the current write position, everything written after this can later be retrieved with view()
+        mark = self.n_written
+        self._header[1] = mark
+        return mark
+
+    def next_row(self) -> np.ndarray:
+        # returns the row that the next sample will be written to, it becomes visible to readers with commit()
+        self._ensure_space(1)
+        data, capacity = self._storage
+        return data[self.n_written % capacity]
+
+    def commit(self):
+        data, capacity = self._storage
+        i = self.n_written % capacity
+        data[i + capacity] = data[i]
+        self._header[0] += 1
+        self._notify()
+
+    def append(self, sample):
+        self.next_row()[:] = sample
+        self.commit()
+
+    def extend(self, samples):
+        n = samples.shape[0]
+        if n == 0:
+            return
+        self._ensure_space(n)
+        data, capacity = self._storage
+        start = self.n_written % capacity
+        # write into the first copy, wrapping around at most once
+        first = min(n, capacity - start)
+        data[start:start + first] = samples[:first]
+        data[:n - first] = samples[first:]
+        # and into the mirrored copy
+        data[start + capacity:start + capacity + first] = samples[:first]
+        data[capacity:capacity + n - first] = samples[first:]
+        self._header[0] += n
+        self._notify()
+
+    def _notify(self):
+        with self.new_sample_condition:
+            self.new_sample_condition.notify_all()
+
+    def wait_for_sample(self, n_written, timeout=None) -> bool:
+        # blocks until more than n_written samples have been written in total, False if the timeout ran out first
+        with self.new_sample_condition:
+            return self.new_sample_condition.wait_for(lambda: self.n_written > n_written, timeout)
+
+    def view(self, since_mark=None) -> np.ndarray:
+        # contiguous view without copying of all samples written since the given mark (default the last mark)
+        n_written = self.n_written
+        data, capacity = self._storage
+        since_mark = self.last_mark if since_mark is None else since_mark
+        n = n_written - since_mark
+        if n < 0:
+            raise ValueError(f'Mark {since_mark} lies in the future, only {n_written} samples were written.')
+        if n > capacity:
+            raise ValueError(f'Mark {since_mark} is older than the {capacity} samples held by the buffer.')
+        start = since_mark % capacity
+        return data[start:start + n]
+
+    def latest(self) -> np.ndarray:
+        if self.n_written == 0:
+            return None
+        data, capacity = self._storage
+        return data[(self.n_written - 1) % capacity]
+
+    def _ensure_space(self, n):
+        capacity = self.capacity
+        needed = self.n_written + n - self.last_mark
+        if needed <= capacity:
+            return
+        new_capacity = capacity
+        while new_capacity < needed:
+            new_capacity *= 2
+        logger.warning(f'Ring buffer capacity of {capacity} samples exceeded since last mark, growing to {new_capacity}.')
+        new_data = np.full((2 * new_capacity, self.sample_size), np.nan, dtype=self.dtype)
+        # copy everything that is still readable, so older views and marks stay valid
+        n_keep = min(self.n_written, capacity)
+        old_first = self.n_written - n_keep
+        old_rows = self.view(old_first)
+        new_start = old_first % new_capacity
+        for offset in (0, new_capacity):
+            first = min(n_keep, new_capacity - new_start)
+            new_data[offset + new_start:offset + new_start + first] = old_rows[:first]
+            new_data[offset:offset + n_keep - first] = old_rows[first:]
+        self._storage = (new_data, new_capacity)
+
+
+class SharedRingBuffer(RingBuffer):
+    """
+    Ring buffer that lives in a multiprocessing.shared_memory block, so that an acquisition process can write to it
+    while the experiment process reads from it without copying. Write cursor and mark are stored in the same block.
+
+    Shared memory can't be grown behind the back of the other process, so here the capacity is fixed. If a trial
+    outgrows it, the mark is moved forward and the oldest samples of that trial are overwritten.
+    """
+
+    header_bytes = 16
+
+    def __init__(self, capacity, sample_size, dtype=np.float64, name=None, condition=None):
+        self.sample_size = sample_size
+        self.dtype = np.dtype(dtype)
+        create = name is None
+        size = self.header_bytes + 2 * capacity * sample_size * self.dtype.itemsize
+        self.shared_memory = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self._header = np.ndarray((2,), dtype=np.int64, buffer=self.shared_memory.buf)
+        data = np.ndarray(
+            (2 * capacity, sample_size), dtype=self.dtype, buffer=self.shared_memory.buf, offset=self.header_bytes)
+        if create:
+            self._header[:] = 0
+            data[:] = np.nan
+        self._storage = (data, capacity)
+        # has to be created before the writing process is started, so it is shared with it
+        self.new_sample_condition = multiprocessing.Condition() if condition is None else condition
+
+    @property
+    def name(self):
+        return self.shared_memory.name
+
+    def close(self):
+        # numpy views have to be gone before the memory can be released
+        self._header = None
+        self._storage = None
+        self.shared_memory.close()
+
+    def unlink(self):
+        self.close()
+        self.shared_memory.unlink()
+
+    def _ensure_space(self, n):
+        capacity = self.capacity
+        needed = self.n_written + n - self.last_mark
+        if needed <= capacity:
+            return
+        # free an eighth of the buffer at once so this isn't logged for every single sample
+        new_mark = self.n_written + n - capacity + capacity // 8
+        logger.warning(f'Shared ring buffer capacity of {capacity} samples exceeded since last mark, '
+                       f'{new_mark - self.last_mark} oldest samples are overwritten.')
+        self._header[1] = new_mark
@@ -0,0 +1,128 @@
+import threading
+import queue
+import os
+import json
+import pickle
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# files inside a session folder
+SCHEMA_FILE = 'schema.json'  # dtype and row shape of every array stream
+INDEX_FILE = 'index.jsonl'  # one line per committed trial with its offsets into the other files
+METADATA_FILE = 'metadata.pickles'  # one pickle record per trial with all fields that aren't arrays
+TRIALS_FILE = 'trials.pickle'  # the trial frame of the session
+RIG_FILE = 'rig.npy'  # led rig positions of the session
+STREAM_SUFFIX = '.bin'  # raw rows of one array field, concatenated over all trials
+
+
+def stream_file(name):
+    return name + STREAM_SUFFIX
+
+
+class SessionWriter(threading.Thread):
+    """
+    Persists every completed trial to an append-only session folder while the experiment continues, so that an
+    hour-long session doesn't only live in memory until it is pickled at the end.
+
+    Array fields like o_data and p_data are appended as raw rows to one file per field, everything else is appended
+    as one pickle record per trial. Only after those are flushed to disk is the trial committed with a line in the
+    index file, so a crash can at most lose the trial that was being written. recover_session cuts off such a
+    partially written trial, load_session reads a session folder back into a DataFrame.
+
+    write_trial only puts the trial into a queue, the writing happens in this thread, so it never blocks the sampling
+    loop. Can be given to LedShiftExperiment as trial_sink.
+    """
+
+    def __init__(self, folder_path, trial_frame=None, rig_leds=None):
+        super(SessionWriter, self).__init__()
+        self.daemon = True
+        self.folder_path = folder_path
+        self.queue = queue.Queue()
+        self.schema = {}
+        self.stream_files = {}
+        self.stream_rows = {}
+
+        if os.path.exists(os.path.join(folder_path, INDEX_FILE)):
+            raise FileExistsError(f'There is already a session in {folder_path}.')
+        os.makedirs(folder_path, exist_ok=True)
+
+        if trial_frame is not None:
+            trial_frame.to_pickle(os.path.join(folder_path, TRIALS_FILE))
+        if rig_leds is not None:
+            np.save(os.path.join(folder_path, RIG_FILE), rig_leds)
+
+        self.metadata_file = open(os.path.join(folder_path, METADATA_FILE), 'ab')
+        self.index_file = open(os.path.join(folder_path, INDEX_FILE), 'a')
+
+    def write_trial(self, trial_index, trial_data):
+        self.queue.put((trial_index, trial_data))
+
+    def close(self):
+        # writes everything that is still queued before returning
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            trial_index, trial_data = item
+            try:
+                self.commit_trial(trial_index, trial_data)
+            except Exception:
+                logger.exception(f'Trial {trial_index} could not be written to {self.folder_path}.')
+
+        for f in (*self.stream_files.values(), self.metadata_file, self.index_file):
+            f.close()
+        logger.info(f'Session writer for {self.folder_path} closed.')
+
+    def commit_trial(self, trial_index, trial_data):
+        array_offsets = {}
+        metadata = {}
+        for name, value in trial_data.items():
+            if isinstance(value, np.ndarray) and value.dtype != object and value.ndim > 0 and self.fits_stream(name, value):
+                start = self.stream_rows[name]
+                np.ascontiguousarray(value).tofile(self.stream_files[name])
+                self.stream_rows[name] += value.shape[0]
+                array_offsets[name] = [start, self.stream_rows[name]]
+            else:
+                metadata[name] = value
+
+        metadata_start = self.metadata_file.tell()
+        pickle.dump(metadata, self.metadata_file, protocol=pickle.HIGHEST_PROTOCOL)
+        metadata_end = self.metadata_file.tell()
+
+        for f in (*self.stream_files.values(), self.metadata_file):
+            f.flush()
+            os.fsync(f.fileno())
+
+        # the trial only counts as written once this line is complete
+        self.index_file.write(json.dumps(dict(
+            trial=trial_index,
+            fields=list(trial_data.keys()),
+            metadata=[metadata_start, metadata_end],
+            arrays=array_offsets)) + '\n')
+        self.index_file.flush()
+        os.fsync(self.index_file.fileno())
+        logger.debug(f'Trial {trial_index} written to {self.folder_path}.')
+
+    def fits_stream(self, name, value):
+        # the first array of a field fixes dtype and row shape of its stream
+        if name not in self.schema:
+            self.schema[name] = dict(dtype=value.dtype.str, shape=list(value.shape[1:]))
+            self.stream_files[name] = open(os.path.join(self.folder_path, stream_file(name)), 'ab')
+            self.stream_rows[name] = 0
+            self.write_schema()
+        return self.schema[name] == dict(dtype=value.dtype.str, shape=list(value.shape[1:]))
+
+    def write_schema(self):
+        # replace atomically, so there is never a half written schema
+        temporary_path = os.path.join(self.folder_path, SCHEMA_FILE + '.tmp')
+        with open(temporary_path, 'w') as f:
+            json.dump(self.schema, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, os.path.join(self.folder_path, SCHEMA_FILE))
@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+import numbers
+from collections import OrderedDict
+
+
+class ScalarColumn:
+    # growable typed column, falls back to object dtype if the values don't fit a numeric type
+
+    def __init__(self, capacity=64):
+        self.values = None
+        self.length = 0
+        self.capacity = capacity
+
+    @staticmethod
+    def dtype_for(value):
+        if isinstance(value, (bool, np.bool_)):
+            return np.dtype(bool)
+        elif isinstance(value, numbers.Integral):
+            return np.dtype(np.int64)
+        elif isinstance(value, numbers.Real):
+            return np.dtype(np.float64)
+        else:
+            return np.dtype(object)
+
+    def append(self, value):
+        if self.values is None:
+            self.values = np.empty(self.capacity, dtype=self.dtype_for(value))
+        elif self.values.dtype != object and self.dtype_for(value) != self.values.dtype:
+            # ints and floats can share a float column, everything else is stored as objects
+            both = {self.values.dtype, self.dtype_for(value)}
+            new_dtype = np.dtype(np.float64) if both == {np.dtype(np.int64), np.dtype(np.float64)} else np.dtype(object)
+            self.values = self.values.astype(new_dtype)
+
+        if self.length == self.values.size:
+            self.values = np.concatenate((self.values, np.empty_like(self.values)))
+        self.values[self.length] = value
+        self.length += 1
+
+    def get(self):
+        return self.values[:self.length]
+
+    def last(self):
+        return self.values[self.length - 1]
+
+
+class RaggedColumn:
+    # arrays of different lengths along the first axis, stored back to back in one growable array plus offsets
+
+    def __init__(self, capacity=1024):
+        self.values = None
+        self.length = 0
+        self.capacity = capacity
+        self.offsets = [0]
+
+    def fits(self, array):
+        return self.values is None or (array.shape[1:] == self.values.shape[1:] and array.dtype == self.values.dtype)
+
+    def append(self, array):
+        array = np.atleast_1d(array)
+        if self.values is None:
+            self.values = np.empty((max(self.capacity, array.shape[0]), *array.shape[1:]), dtype=array.dtype)
+        end = self.length + array.shape[0]
+        if end > self.values.shape[0]:
+            new_values = np.empty((max(end, 2 * self.values.shape[0]), *self.values.shape[1:]), dtype=self.values.dtype)
+            new_values[:self.length] = self.values[:self.length]
+            self.values = new_values
+        self.values[self.length:end] = array
+        self.length = end
+        self.offsets.append(end)
+
+    def empty_cell(self):
+        # value of a trial that doesn't have the field, with the shape and dtype of the other trials
+        return np.empty((0, *self.values.shape[1:]), dtype=self.values.dtype)
+
+    def get(self):
+        # one view per trial into the shared array, nothing is copied
+        return [self.values[start:end] for start, end in zip(self.offsets[:-1], self.offsets[1:])]
+
+    def last(self):
+        return self.values[self.offsets[-2]:self.offsets[-1]]
+
+
+class ObjectColumn:
+    # anything else, for example the helmet rigidbody, is kept by reference
+
+    def __init__(self):
+        self.values = []
+
+    def append(self, value):
+        self.values.append(value)
+
+    def get(self):
+        return self.values
+
+    def last(self):
+        return self.values[-1]
+
+
+class TrialStore:
+    """
+    Append-only collection of trial results that is turned into a DataFrame only once, at the end.
+
+    Scalar fields go into growable typed columns, numpy arrays like the raw o_data and p_data of each trial are copied
+    into one ragged array per field. Appending is amortized constant time, unlike appending to a DataFrame, which
+    copies all previous trials every time.
+
+    If a sink is given, every appended trial is also passed to sink.write_trial(trial_index, trial_data) right away
+    (streaming mode), so completed trials are persisted even if the session crashes later. The sink gets the store's
+    own copies of the arrays, so it can hold on to them while the acquisition buffers are reused.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.columns = OrderedDict()
+        self.n_trials = 0
+
+    def __len__(self):
+        return self.n_trials
+
+    def append(self, trial_data: dict):
+        for name, value in trial_data.items():
+            if name not in self.columns:
+                self.columns[name] = self.new_column(value)
+                # trials before this one didn't have the field
+                for _ in range(self.n_trials):
+                    self.columns[name].append(
+                        np.empty((0, *value.shape[1:]), dtype=value.dtype)
+                        if isinstance(self.columns[name], RaggedColumn) else None)
+
+            column = self.columns[name]
+            if isinstance(column, RaggedColumn) and not (isinstance(value, np.ndarray) and column.fits(value)):
+                column = self.columns[name] = self.to_object_column(column)
+            column.append(value)
+
+        for name, column in self.columns.items():
+            if name not in trial_data:
+                column.append(column.empty_cell() if isinstance(column, RaggedColumn) else None)
+
+        if self.sink is not None:
+            self.sink.write_trial(self.n_trials, OrderedDict((name, self.columns[name].last()) for name in trial_data))
+        self.n_trials += 1
+
+    @staticmethod
+    def new_column(value):
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            return RaggedColumn()
+        elif isinstance(value, (numbers.Number, np.bool_, str)) or value is None:
+            return ScalarColumn()
+        else:
+            return ObjectColumn()
+
+    @staticmethod
+    def to_object_column(column):
+        object_column = ObjectColumn()
+        object_column.values = column.get()
+        return object_column
+
+    def to_dataframe(self) -> pd.DataFrame:
+        data = OrderedDict()
+        for name, column in self.columns.items():
+            values = column.get()
+            if isinstance(values, list):
+                # fill element by element, numpy would otherwise try to stack arrays of equal shape
+                object_values = np.empty(len(values), dtype=object)
+                for i, value in enumerate(values):
+                    object_values[i] = value
+                values = object_values
+            data[name] = values
+        return pd.DataFrame(data, index=pd.RangeIndex(self.n_trials))
@@ -1,9 +1,13 @@
 import logging
 import sys
 import os
+from .RingBuffer import RingBuffer, SharedRingBuffer
 from .PupilThread import PupilThread
 from .OptotrakThread import OptotrakThread
+from .LatencyHistogram import LatencyHistogram
 from .ArduinoThread import ArduinoThread
+from .FakeArduino import FakeArduino
+from .AcquisitionProcess import AcquisitionProcess, OptotrakProcess, PupilProcess
 from .wait_for_keypress import wait_for_keypress
 from .u_theta import u_theta
 from .from_yawpitchroll import from_yawpitchroll
@@ -18,6 +22,11 @@ from .is_rotation_matrix import is_rotation_matrix
 from .tup3d import tup3d
 from .multidim_ortho_procrustes import multidim_ortho_procrustes
 from .anynan import anynan
+from .TrialStore import TrialStore
+from .SessionWriter import SessionWriter
+from .recover_session import recover_session
+from .load_session import load_session
+from .ColumnarRecording import ColumnarRecording, write_columnar_recording, load_recording, convert_recording
 from .LedShiftExperiment import LedShiftExperiment
 from .qplot3d import qplot3d
 from .create_trial_frame import create_trial_frame
@@ -25,10 +34,15 @@ from .normals_nonlinear_angular_transform import normals_nonlinear_angular_trans
 from .was_key_pressed import was_key_pressed
 from .expand_df_arrays import expand_df_arrays
 from .array_apply import array_apply
+from .Pipeline import Pipeline, Step
+from .PipelineCache import PipelineCache
 from .padded_diff import padded_diff
 from .sacc_dec_engb_merg import sacc_dec_engb_merg
 from .sacc_dec_engb_merg_horizontal import sacc_dec_engb_merg_horizontal
+from .sacc_dec_engb_merg_batch import sacc_dec_engb_merg_batch, saccades_per_trial
+from .OnlineSaccadeDetector import OnlineSaccadeDetector, SaccadeEvent
 from .to_azim_elev import to_azim_elev
+from .Resampler import Resampler
 from .interpolate_a_onto_b_time import interpolate_a_onto_b_time
 from .save_experiment_files import save_experiment_files
 from .focus_pygame_window import focus_pygame_window
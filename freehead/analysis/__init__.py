@@ -3,3 +3,4 @@ from .load_participant_df import load_participant_df
 from .load_complete_dataframe import load_complete_dataframe
 from .apply_analysis_pipeline_for_all_trials import apply_analysis_pipeline_for_all_trials
 from .apply_analysis_pipeline_for_valid_trials import apply_analysis_pipeline_for_valid_trials
+from .convert_recordings import convert_recordings
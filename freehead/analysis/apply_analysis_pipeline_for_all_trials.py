@@ -2,7 +2,8 @@ import pandas as pd
 import freehead as fh
 import numpy as np
 from scipy.signal import savgol_filter
-from collections import OrderedDict
+from freehead.Pipeline import Pipeline, Step
+from freehead.sacc_dec_engb_merg_batch import STATUS_OK, STATUS_NAMES
 import warnings
 
 
@@ -12,97 +13,140 @@ def prepend_nan(arr, axis=0, n=1):
     return np.concatenate((pad, arr), axis=axis)
 
 
-def apply_analysis_pipeline_for_all_trials(df: pd.DataFrame):
+def trial_resampler(s, data_column, time_column):
+    # from the timestamps of every trial in ms relative to the saccade start onto t_sacc, shared by all signals
+    return fh.Resampler(
+        [1000 * (data[:, time_column] - t_start) for data, t_start in zip(s[data_column], s['t_saccade_started'])],
+        list(s['t_sacc']),
+        kind='linear')
+
+
+def upsample_pupil_data(s):
+    resample = trial_resampler(s, 'p_data', 0)
+    return resample([p[:, 2:5] for p in s['p_data']]), resample([p[:, 1] - p[:, 0] for p in s['p_data']])
+
+
+def detect_saccades(s):
+    # horizontal saccades of all trials at once, trials without saccades get None and are counted by reason
+    result = fh.sacc_dec_engb_merg_batch(
+        s['gaze_angle_vs_target'][:, :, 0], s['gaze_angvel_vs_target_savgol'][:, :, 0], 6, 5)
+    status = result[-1]
+    for code, n_trials in zip(*np.unique(status[status != STATUS_OK], return_counts=True)):
+        print(f'Engbert Mergenthaler found no saccades in {n_trials} trials: {STATUS_NAMES[code]}')
+    return fh.saccades_per_trial(result)
+
+
+def led_position(s, led_column):
+    # rows of the rig positions of every trial at the led number of that trial
+    return s['rig'][np.arange(len(s['rig'])), s[led_column], :]
+
+
+all_trials_pipeline = Pipeline([
+    # chosen so that to target direction is positive (right to left is positive angle in mathematics)
+    Step('direction_sign', ['left_to_right'], lambda r: -1 if r['left_to_right'] else +1),
+    Step('fixation_led', ['fixation_led', 'left_to_right'],
+         lambda r: r['fixation_led'] if r['left_to_right'] else 254 - r['fixation_led']),
+    Step('target_led', ['fixation_led', 'direction_sign', 'amplitude'],
+         lambda s: s['fixation_led'] - s['direction_sign'] * s['amplitude'], kind='stacked'),
+    Step('starget_led', ['target_led', 'direction_sign', 'shift'],
+         lambda s: s['target_led'] - s['direction_sign'] * s['shift'], kind='stacked'),
+    Step('is_outward_response', ['response', 'left_to_right'],
+         lambda r: r['response'] == ('right' if r['left_to_right'] else 'left')),
+    Step('response_ward', ['is_outward_response'], lambda r: 'outward' if r['is_outward_response'] else 'inward'),
+    Step('correct_response', ['shift', 'left_to_right'],
+         lambda r: None if r['shift'] == 0 else 'right' if (r['shift'] > 0) == r['left_to_right'] else 'left'),
+    Step('is_correct', ['correct_response', 'response'],
+         lambda r: None if r['correct_response'] is None else r['correct_response'] == r['response']),
+    Step('shift_percent_uni', ['shift_percent', 'left_to_right'],
+         lambda r: r['shift_percent'] if r['left_to_right'] else -r['shift_percent']),
+    # new time index for upsampling
+    Step('t_sacc', [], lambda r: np.arange(-400, 801, 5)),
+    # pupil data in around saccade interval upsampled, and the latency of the pupil signal with the same weights
+    Step(('p_data_upsampled', 'pupil_latency'), ['p_data', 't_saccade_started', 't_sacc'], upsample_pupil_data,
+         kind='stacked'),
+    # optotrak data upsampled
+    Step('o_data_upsampled', ['o_data', 't_saccade_started', 't_sacc'],
+         lambda s: trial_resampler(s, 'o_data', 30)([o[:, 3:15] for o in s['o_data']]), kind='stacked'),
+    # rotation and reference positions of head rigidbody, solved together
+    Step(('R_head_world', 'Ts_head_world'), ['helmet', 'o_data_upsampled'],
+         lambda r: r['helmet'].solve(r['o_data_upsampled'].reshape((-1, 4, 3)))),
+    # yaw pitch roll head rigidbody
+    # from here on all trials have the same time base t_sacc, stacked steps compute all trials at once
+    Step('ypr_head_world', ['R_head_world'],
+         lambda s: fh.to_yawpitchroll(s['R_head_world']).reshape(s['R_head_world'].shape[:2] + (3,)), kind='stacked'),
+    # position of fixation led
+    Step('fixation_pos', ['rig', 'fixation_led'], lambda s: led_position(s, 'fixation_led'), kind='stacked'),
+    # position of target led
+    Step('target_pos', ['rig', 'target_led'], lambda s: led_position(s, 'target_led'), kind='stacked'),
+    # position of shifted target led
+    Step('starget_pos', ['rig', 'starget_led'], lambda s: led_position(s, 'starget_led'), kind='stacked'),
+    # vector from eye to target position
+    Step('eye_to_fixation', ['fixation_pos', 'Ts_head_world'],
+         lambda s: fh.to_unit(s['fixation_pos'][:, None, :] - s['Ts_head_world'][:, :, 3, :]), kind='stacked'),
+    # vector from eye to target position
+    Step('eye_to_target', ['target_pos', 'Ts_head_world'],
+         lambda s: fh.to_unit(s['target_pos'][:, None, :] - s['Ts_head_world'][:, :, 3, :]), kind='stacked'),
+    # vector from eye to shifted target position
+    Step('eye_to_starget', ['starget_pos', 'Ts_head_world'],
+         lambda s: fh.to_unit(s['starget_pos'][:, None, :] - s['Ts_head_world'][:, :, 3, :]), kind='stacked'),
+    # gaze vector in head without distortion correction
+    Step('gaze_in_head_distorted', ['R_eye_head', 'p_data_upsampled'],
+         lambda s: np.einsum('nij,ntj->nti', s['R_eye_head'], s['p_data_upsampled']), kind='stacked'),
+    # gaze vector in head with distortion correction
+    Step('gaze_in_head', ['gaze_in_head_distorted', 'nonlinear_parameters'],
+         lambda r: fh.normals_nonlinear_angular_transform(r['gaze_in_head_distorted'], r['nonlinear_parameters'])),
+    # gaze angles in head
+    Step('gaze_in_head_ang', ['gaze_in_head'], lambda s: np.rad2deg(fh.to_azim_elev(s['gaze_in_head'])),
+         kind='stacked'),
+    # gaze vector in world
+    Step('gaze_in_world', ['R_head_world', 'gaze_in_head'],
+         lambda s: np.einsum('ntij,ntj->nti', s['R_head_world'], s['gaze_in_head']), kind='stacked'),
+    # gaze angles in world
+    Step('gaze_in_world_ang', ['gaze_in_world'], lambda s: np.rad2deg(fh.to_azim_elev(s['gaze_in_world'])),
+         kind='stacked'),
+    # angles from eye to target in world
+    Step('eye_to_target_ang', ['eye_to_target'], lambda s: np.rad2deg(fh.to_azim_elev(s['eye_to_target'])),
+         kind='stacked'),
+    # difference of eye to target angles and gaze in world
+    Step('gaze_angle_vs_target', ['gaze_in_world_ang', 'eye_to_target_ang'],
+         lambda s: s['gaze_in_world_ang'] - s['eye_to_target_ang'], kind='stacked'),
+    # angles from eye to shifted target in world
+    Step('eye_to_starget_ang', ['eye_to_starget'], lambda s: np.rad2deg(fh.to_azim_elev(s['eye_to_starget'])),
+         kind='stacked'),
+    # difference of eye to shifted target angles and gaze in world
+    Step('gaze_angle_vs_starget', ['gaze_in_world_ang', 'eye_to_starget_ang'],
+         lambda s: s['gaze_in_world_ang'] - s['eye_to_starget_ang'], kind='stacked'),
+    # angles from eye to fixation in world
+    Step('eye_to_fixation_ang', ['eye_to_fixation'], lambda s: np.rad2deg(fh.to_azim_elev(s['eye_to_fixation'])),
+         kind='stacked'),
+    # difference of eye to fixation angles and gaze in world
+    Step('gaze_angle_vs_fixation', ['gaze_in_world_ang', 'eye_to_fixation_ang'],
+         lambda s: s['gaze_in_world_ang'] - s['eye_to_fixation_ang'], kind='stacked'),
+    # time steps
+    Step('dt', ['t_sacc'], lambda s: fh.padded_diff(s['t_sacc'], axis=1), kind='stacked'),
+    # velocity of difference of eye to target angles and gaze in world
+    Step('gaze_angvel_vs_target', ['gaze_angle_vs_target', 'dt'],
+         lambda s: fh.padded_diff(s['gaze_angle_vs_target'], axis=1) / s['dt'][:, :, None], kind='stacked'),
+    Step('gaze_angvel_vs_target_savgol', ['gaze_angvel_vs_target'],
+         lambda s: prepend_nan(
+             savgol_filter(s['gaze_angvel_vs_target'][:, 1:, ...], 3, 1, axis=1),
+             axis=1), kind='stacked'),
+    # saccade detection engbert & mergenthaler
+    Step('eng_merg', ['gaze_angle_vs_target', 'gaze_angvel_vs_target_savgol'], detect_saccades, kind='stacked'),
+])
+
+
+def apply_analysis_pipeline_for_all_trials(df: pd.DataFrame, processes=None, cache=None):
+    # with processes, the trials of each step are computed in that many processes
+    # with a cache (a PipelineCache or its folder path), unchanged steps are loaded instead of computed
 
     warnings.filterwarnings('ignore', category=np.RankWarning)
     
     df.rename(columns={'shift_percent_approx': 'shift_percent'}, inplace=True)
 
-    fh.array_apply(
+    all_trials_pipeline.run(
         df,
-        OrderedDict([
-            # chosen so that to target direction is positive (right to left is positive angle in mathematics)
-            ('direction_sign', lambda r: -1 if r['left_to_right'] else +1),
-            ('fixation_led', lambda r: r['fixation_led'] if r['left_to_right'] else 254 - r['fixation_led']),
-            (('df', 'target_led'), lambda df: df['fixation_led'] - df['direction_sign'] * df['amplitude']),
-            (('df', 'starget_led'), lambda df: df['target_led'] - df['direction_sign'] * df['shift']),
-            ('is_outward_response', lambda r: r['response'] == ('right' if r['left_to_right'] else 'left')),
-            ('response_ward', lambda r: 'outward' if r['is_outward_response'] else 'inward'),
-            ('correct_response', lambda r: None if r['shift'] == 0 else 'right' if (r['shift'] > 0) == r['left_to_right'] else 'left'),
-            ('is_correct', lambda r: None if r['correct_response'] is None else r['correct_response'] == r['response']),
-            ('shift_percent_uni', lambda r: r['shift_percent'] if r['left_to_right'] else -r['shift_percent']),
-            # new time index for upsampling
-            ('t_sacc', lambda r: np.arange(-400, 801, 5)),
-            # pupil data in around saccade interval upsampled
-            ('p_data_upsampled', lambda r: fh.interpolate_a_onto_b_time(r['p_data'][:, 2:5],
-                                                                1000 * (r['p_data'][:, 0] - r['t_saccade_started']),
-                                                                r['t_sacc'], kind='linear')),
-            # optotrak data upsampled
-            ('o_data_upsampled', lambda r: fh.interpolate_a_onto_b_time(r['o_data'][:, 3:15],
-                                                                  1000 * (r['o_data'][:, 30] - r['t_saccade_started']),
-                                                                  r['t_sacc'], kind='linear')),
-            # latency of pupil signal
-            ('pupil_latency', lambda r: fh.interpolate_a_onto_b_time(r['p_data'][:, 1] - r['p_data'][:, 0], 1000 * (
-                        r['p_data'][:, 0] - r['t_saccade_started']), r['t_sacc'], kind='linear')),
-            # rotation of head rigidbody
-            ('R_head_world', lambda r: r['helmet'].solve(r['o_data_upsampled'].reshape((-1, 4, 3)))[0]),
-            # yaw pitch roll head rigidbody
-            ('ypr_head_world', lambda r: fh.to_yawpitchroll(r['R_head_world'])),
-            # reference positions of head rigidbody
-            ('Ts_head_world', lambda r: r['helmet'].solve(r['o_data_upsampled'].reshape((-1, 4, 3)))[1]),
-            # position of fixation led
-            ('fixation_pos', lambda r: r['rig'][r['fixation_led'], :]),
-            # position of target led
-            ('target_pos', lambda r: r['rig'][r['target_led'], :]),
-            # position of shifted target led
-            ('starget_pos', lambda r: r['rig'][r['starget_led'], :]),
-            # vector from eye to target position
-            ('eye_to_fixation', lambda r: fh.to_unit(r['fixation_pos'] - r['Ts_head_world'][:, 3, :])),
-            # vector from eye to target position
-            ('eye_to_target', lambda r: fh.to_unit(r['target_pos'] - r['Ts_head_world'][:, 3, :])),
-            # vector from eye to shifted target position
-            ('eye_to_starget', lambda r: fh.to_unit(r['starget_pos'] - r['Ts_head_world'][:, 3, :])),
-            # gaze vector in head without distortion correction
-            ('gaze_in_head_distorted', lambda r: (r['R_eye_head'] @ r['p_data_upsampled'].T).T),
-            # gaze vector in head with distortion correction
-            ('gaze_in_head',
-             lambda r: fh.normals_nonlinear_angular_transform(r['gaze_in_head_distorted'], r['nonlinear_parameters'])),
-            # gaze angles in head
-            ('gaze_in_head_ang', lambda r: np.rad2deg(fh.to_azim_elev(r['gaze_in_head']))),
-            # gaze vector in world
-            ('gaze_in_world', lambda r: np.einsum('tij,tj->ti', r['R_head_world'], r['gaze_in_head'])),
-            # gaze angles in world
-            ('gaze_in_world_ang', lambda r: np.rad2deg(fh.to_azim_elev(r['gaze_in_world']))),
-            # angles from eye to target in world
-            ('eye_to_target_ang', lambda r: np.rad2deg(fh.to_azim_elev(r['eye_to_target']))),
-            # difference of eye to target angles and gaze in world
-            ('gaze_angle_vs_target', lambda r: r['gaze_in_world_ang'] - r['eye_to_target_ang']),
-            # angles from eye to shifted target in world
-            ('eye_to_starget_ang', lambda r: np.rad2deg(fh.to_azim_elev(r['eye_to_starget']))),
-            # difference of eye to shifted target angles and gaze in world
-            ('gaze_angle_vs_starget', lambda r: r['gaze_in_world_ang'] - r['eye_to_starget_ang']),
-            # angles from eye to fixation in world
-            ('eye_to_fixation_ang', lambda r: np.rad2deg(fh.to_azim_elev(r['eye_to_fixation']))),
-            # difference of eye to fixation angles and gaze in world
-            ('gaze_angle_vs_fixation', lambda r: r['gaze_in_world_ang'] - r['eye_to_fixation_ang']),
-            # time steps
-            ('dt', lambda r: fh.padded_diff(r['t_sacc'])),
-            # velocity of difference of eye to target angles and gaze in world
-            ('gaze_angvel_vs_target', lambda r: fh.padded_diff(r['gaze_angle_vs_target']) / r['dt'][:, None]),
-            ('gaze_angvel_vs_target_savgol',
-                lambda r: prepend_nan(
-                    savgol_filter(r['gaze_angvel_vs_target'][1:, ...], 3, 1, axis=0),
-                    axis=0)),
-            # saccade detection engbert & mergenthaler
-            ('eng_merg', lambda r: fh.sacc_dec_engb_merg_horizontal(r['gaze_angle_vs_target'][:, 0],
-                                                                    r['gaze_angvel_vs_target_savgol'][:, 0], 6, 5)),
-        ]),
-        add_inplace=True,
-        print_log=True
-    )
-
-    df.drop(
-        columns=[
+        drop=[
             'p_data',
             'o_data',
             # 'helmet',
@@ -110,5 +154,7 @@ def apply_analysis_pipeline_for_all_trials(df: pd.DataFrame):
             'p_data_upsampled',
             'gaze_in_head_distorted',
         ],
-        inplace=True
+        processes=processes,
+        progress=True,
+        cache=cache
     )
@@ -0,0 +1,22 @@
+import os
+from . import get_available_recordings
+from freehead.ColumnarRecording import convert_recording
+
+
+def convert_recordings(data_folder):
+    """Converts every recording in data_folder that is still in the original layout to a columnar recording.
+
+    The columnar folder is put next to the original files and named like them, with 'columnar' in place of
+    'experiment', so get_available_recordings picks it up instead. The original files are left in place.
+    """
+    for participant, participant_dict in get_available_recordings(data_folder).items():
+        for session, files in sorted(participant_dict.items()):
+            if 'columnar' in files:
+                continue
+            folder_path, experiment_file = os.path.split(files['experiment'])
+            columnar_folder = os.path.join(
+                folder_path, os.path.splitext(experiment_file)[0].replace('_experiment_', '_columnar_'))
+
+            print(f'Converting session {session} of participant {participant}...', end='')
+            convert_recording(files['experiment'], files['trials'], files['rig'], columnar_folder)
+            print(' Done.')
@@ -1,5 +1,6 @@
 import os
 import re
+from freehead.ColumnarRecording import is_columnar_recording
 
 
 def get_available_recordings(data_folder):
@@ -12,19 +13,27 @@ def get_available_recordings(data_folder):
         sf_path = os.path.join(data_folder, sf)
         files = [f for f in os.listdir(sf_path) if re.match(r'.*' + sf, f)]
 
-        if len(files) != 3:
+        # a converted recording (see convert_recordings) is used instead of the original files
+        columnar = [f for f in files if re.match(r'.*columnar', f) and is_columnar_recording(os.path.join(sf_path, f))]
+        files = [f for f in files if not re.match(r'.*columnar', f)]
+
+        if not columnar and len(files) != 3:
             raise Exception(f'Not all data files present in folder {sf}.')
 
-        participant = files[0][0]
-        session = files[0][1]
+        participant = (columnar + files)[0][0]
+        session = (columnar + files)[0][1]
+
+        if participant not in participants:
+            participants[participant] = {}
+
+        if columnar:
+            participants[participant][session] = dict(columnar=os.path.join(sf_path, columnar[0]))
+            continue
 
         rig = (f for f in files if re.match(r'.*rig', f)).__next__()
         experiment = (f for f in files if re.match(r'.*experiment', f)).__next__()
         trials = (f for f in files if re.match(r'.*trials', f)).__next__()
 
-        if participant not in participants:
-            participants[participant] = {}
-
         participants[participant][session] = dict(
             rig=os.path.join(sf_path, rig),
             experiment=os.path.join(sf_path, experiment),
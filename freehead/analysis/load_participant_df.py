@@ -1,12 +1,15 @@
 import pandas as pd
-import numpy as np
+from freehead.ColumnarRecording import load_recording
 
 
 def load_participant_df(participant, participant_dict: dict):
 
     sessions = list(sorted(participant_dict.keys()))
 
+    # columnar recordings are memory mapped, their sample arrays are only read once they're used
     files = [
+        [participant_dict[session]['columnar']]
+        if 'columnar' in participant_dict[session] else
         [
             participant_dict[session]['experiment'],
             participant_dict[session]['trials'],
@@ -15,8 +18,7 @@ def load_participant_df(participant, participant_dict: dict):
     ]
 
     print(f'Loading files for participant {participant}...', end='')
-    exp_dfs, trial_dfs, led_rigs = zip(
-        *[(pd.read_pickle(e), pd.read_pickle(t), np.load(l)) for e, t, l in files])
+    exp_dfs, trial_dfs, led_rigs = zip(*[load_recording(*f) for f in files])
     print(' Done.')
 
     for session, df, tdf, rig in (zip(sessions, exp_dfs, trial_dfs, led_rigs)):
@@ -10,7 +10,14 @@ def array_apply(df: pd.DataFrame, func, add_inplace=False, print_log=False):
 
     :param df: A pandas DataFrame
     :param func: A function to apply, or an OrderedDict of functions to apply
-    :param add_inplace:
+    :param add_inplace: If True, func has to be an OrderedDict, whose results are added to df as columns. Keys are
+        either a column name or a tuple (operationtype, name) with operationtype 'row' (the default), 'df' or
+        'stacked'. name can also be a tuple of column names, then the function returns a tuple with one value per
+        column and is only evaluated once, e.g.
+        (('row', ('R_head_world', 'Ts_head_world')), lambda r: r['helmet'].solve(...)).
+        A 'stacked' function is called once with StackedColumns of df, where every column is one array with the trials
+        along the first axis, and returns such arrays, e.g. ('stacked', 'gaze_in_world_ang'): lambda s: np.rad2deg(
+        fh.to_azim_elev(s['gaze_in_world'])) for all trials at once.
     :return:
     """
     if not add_inplace:
@@ -47,16 +54,98 @@ def array_apply(df: pd.DataFrame, func, add_inplace=False, print_log=False):
                 if print_log:
                     print(f'Computing "{name}" ({i + 1} of {n_funcs})...')
                 if operationtype == 'df':
-                    df[name] = f(df)
+                    result = f(df)
+                elif operationtype == 'stacked':
+                    result = f(StackedColumns(df))
+                    if isinstance(name, str):
+                        result = unstack_array(result, df.index)
+                    else:
+                        result = [unstack_array(output, df.index) for output in result]
                 elif operationtype == 'row':
-                    df[name] = df.apply(lambda r: arr_series(f(r)), axis=1)
+                    result = df.apply(lambda r: arr_series(f(r)), axis=1)
                 else:
                     raise Exception(f'Unknown operation type {operationtype} for {name}.')
+
+                if isinstance(name, str):
+                    df[name] = result
+                else:
+                    # multiple outputs, f returns a tuple and is evaluated only once per row
+                    for output_name, output in zip(name, split_outputs(result, len(name), operationtype)):
+                        df[output_name] = output
         else:
             Exception('func needs to be an OrderedDict with callables')
         return None
 
 
+def split_outputs(result, n_outputs, operationtype):
+    # a 'row' result is a series of tuples, a 'df' or 'stacked' result a tuple of columns
+    if operationtype in ('df', 'stacked'):
+        if len(result) != n_outputs:
+            raise Exception(f'Expected {n_outputs} outputs, got {len(result)}.')
+        return result
+
+    if isinstance(result, pd.DataFrame):
+        # df.apply puts the series returned by arr_series into a single column
+        result = result.iloc[:, 0]
+    columns = [np.empty(len(result), dtype=object) for _ in range(n_outputs)]
+    for i, outputs in enumerate(result.values):
+        if len(outputs) != n_outputs:
+            raise Exception(f'Expected {n_outputs} outputs, got {len(outputs)}.')
+        # filled element by element, so arrays stay whole in their cells
+        for column, output in zip(columns, outputs):
+            column[i] = output
+    return [pd.Series(column, index=result.index).infer_objects() for column in columns]
+
+
+def stack_column(values):
+    """
+    One array with the trials along the first axis from a column: numeric columns as they are, arrays of the same
+    shape stacked, anything else as an object array with one element per trial.
+    """
+    if isinstance(values, np.ndarray) and values.dtype != object:
+        return values
+    values = values.values if isinstance(values, pd.Series) else np.asarray(values)
+    if values.dtype != object or not len(values):
+        return values
+    first = values[0]
+    if isinstance(first, np.ndarray) and first.dtype != object and all(
+            isinstance(v, np.ndarray) and v.shape == first.shape for v in values):
+        return np.stack(values)
+    return values
+
+
+def unstack_array(array, index):
+    """
+    Column from an array with the trials along the first axis, the cells are views of the rows of array if it has more
+    than one dimension, so the data stays in one contiguous block.
+    """
+    array = np.asarray(array)
+    if array.ndim == 0 or array.shape[0] != len(index):
+        raise Exception(f'Expected an array with {len(index)} trials along the first axis, got shape {array.shape}.')
+    if array.ndim == 1:
+        return pd.Series(array, index=index).infer_objects()
+    views = np.empty(len(index), dtype=object)
+    for i in range(len(index)):
+        views[i] = array[i]
+    return pd.Series(views, index=index)
+
+
+class StackedColumns:
+    # columns of a DataFrame as arrays with the trials along the first axis, stacked when first accessed
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.arrays = {}
+
+    def __getitem__(self, name):
+        if name not in self.arrays:
+            self.arrays[name] = stack_column(self.df[name])
+        return self.arrays[name]
+
+    def __len__(self):
+        return len(self.df)
+
+
 def arr_series(arrs, name=None):
     # wraps a single array in a list so the auto expansion doesn't start
     if isinstance(arrs, np.ndarray):
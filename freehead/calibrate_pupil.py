@@ -1,4 +1,5 @@
-from scipy.optimize import minimize, Bounds, differential_evolution
+import time
+from scipy.optimize import minimize, Bounds, differential_evolution, least_squares
 import numpy as np
 import freehead as fh
 
@@ -137,3 +138,161 @@ def calibrate_pupil_nonlinear(
         ini_params = np.concatenate((ini_T_eye_head, ini_ypr, ini_polynom_params))
 
     return minimize(err_func, ini_params)
+
+
+# derivatives of the rotations about z, x and y that make up from_yawpitchroll, d/dtheta u_theta(u, theta) = [u]x u_theta
+CROSS_Z = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 0]], dtype=np.float64)
+CROSS_X = np.array([[0, 0, 0], [0, 0, -1], [0, 1, 0]], dtype=np.float64)
+CROSS_Y = np.array([[0, 0, 1], [0, 0, 0], [-1, 0, 0]], dtype=np.float64)
+
+
+def yawpitchroll_derivatives(ypr):
+    # derivatives of from_yawpitchroll(ypr) with respect to yaw, pitch and roll in degrees
+    yaw, pitch, roll = np.deg2rad(ypr)
+    yaw_rotation = fh.u_theta(np.array([0, 0, 1]), yaw)
+    pitch_rotation = fh.u_theta(np.array([1, 0, 0]), pitch)
+    roll_rotation = fh.u_theta(np.array([0, 1, 0]), roll)
+    return np.deg2rad(1) * np.stack((
+        CROSS_Z @ yaw_rotation @ pitch_rotation @ roll_rotation,
+        yaw_rotation @ CROSS_X @ pitch_rotation @ roll_rotation,
+        yaw_rotation @ pitch_rotation @ CROSS_Y @ roll_rotation))
+
+
+def nonlinear_calibration_residuals(params, T_head_world, R_head_world, gaze_normals, T_target_world, T_eye_head=None,
+                                    with_jacobian=False):
+    """
+    Residuals of calibrate_pupil_nonlinear_least_squares, the differences between the unit gaze vectors in world
+    coordinates and the unit vectors from the eye to the targets, three per sample. Their length is 2 * sin(angle / 2),
+    so they are smooth where the angle is zero, unlike the angle itself.
+
+    params are yaw, pitch, roll in degrees, then aa, bb, cc of normals_nonlinear_angular_transform and, if T_eye_head
+    is None, T_eye_head. With with_jacobian, the analytic derivatives with respect to params are returned as well.
+    """
+    ypr = params[0:3]
+    aa = params[3:5]
+    bb = params[5:7]
+    cc = params[7:9]
+    if T_eye_head is None:
+        T_eye_head = params[9:12]
+
+    T_eye_world = np.einsum('tij,j->ti', R_head_world, T_eye_head) + T_head_world
+    eye_to_target_unnormalized = T_target_world - T_eye_world
+    eye_to_target_distance = np.linalg.norm(eye_to_target_unnormalized, axis=1)
+    eye_to_target = eye_to_target_unnormalized / eye_to_target_distance[:, None]
+
+    # same steps as normals_nonlinear_angular_transform, with the intermediate values kept for the derivatives
+    R_eye_head = fh.from_yawpitchroll(ypr)
+    gaze_normals_head = np.einsum('ij,tj->ti', R_eye_head, gaze_normals)
+    elev_azim = np.arctan2(gaze_normals_head[:, [0, 2]], gaze_normals_head[:, 1, None])
+    xz_transformed = np.tan(aa * (elev_azim ** 2) + bb * elev_azim + cc)
+    xyz = np.ones(gaze_normals_head.shape, dtype=np.float64)
+    xyz[:, [0, 2]] = xz_transformed
+    xyz_length = np.linalg.norm(xyz, axis=1)
+    gaze_normals_head_transformed = xyz / xyz_length[:, None]
+    gaze_normals_world = np.einsum('tij,tj->ti', R_head_world, gaze_normals_head_transformed)
+
+    residuals = (gaze_normals_world - eye_to_target).reshape(-1)
+    if not with_jacobian:
+        return residuals
+
+    n_samples = len(gaze_normals)
+    identity = np.eye(3)
+
+    # d gaze_normals_world / d xz_transformed, through the normalization and the head rotation
+    d_unit_d_xyz = (identity - np.einsum('ti,tj->tij', gaze_normals_head_transformed, gaze_normals_head_transformed)) \
+        / xyz_length[:, None, None]
+    d_world_d_xz = np.einsum('tij,tjk->tik', R_head_world, d_unit_d_xyz[:, :, [0, 2]])
+
+    # d xz_transformed / d polynomial value, the polynomial value / d elev_azim
+    d_tan = 1 + xz_transformed ** 2
+    d_polynom_d_angle = 2 * aa * elev_azim + bb
+
+    # d elev_azim / d gaze_normals_head, both angles are arctan2 of one component over the y component
+    y = gaze_normals_head[:, 1]
+    d_angle_d_head = np.zeros((n_samples, 2, 3))
+    for i_angle, i_component in enumerate((0, 2)):
+        component = gaze_normals_head[:, i_component]
+        squared_length = component ** 2 + y ** 2
+        d_angle_d_head[:, i_angle, i_component] = y / squared_length
+        d_angle_d_head[:, i_angle, 1] = -component / squared_length
+
+    d_head_d_ypr = np.einsum('kij,tj->tik', yawpitchroll_derivatives(ypr), gaze_normals)
+    d_xz_d_ypr = (d_tan * d_polynom_d_angle)[:, :, None] * np.einsum('taj,tjk->tak', d_angle_d_head, d_head_d_ypr)
+
+    n_params = len(params)
+    jacobian = np.empty((n_samples, 3, n_params))
+    jacobian[:, :, 0:3] = np.einsum('tia,tak->tik', d_world_d_xz, d_xz_d_ypr)
+    jacobian[:, :, 3:5] = d_world_d_xz * (d_tan * elev_azim ** 2)[:, None, :]
+    jacobian[:, :, 5:7] = d_world_d_xz * (d_tan * elev_azim)[:, None, :]
+    jacobian[:, :, 7:9] = d_world_d_xz * d_tan[:, None, :]
+    if n_params == 12:
+        # the eye moves with T_eye_head, the unit vector to the target changes in the opposite direction
+        d_unit_d_target_vector = (identity - np.einsum('ti,tj->tij', eye_to_target, eye_to_target)) \
+            / eye_to_target_distance[:, None, None]
+        jacobian[:, :, 9:12] = np.einsum('tij,tjk->tik', d_unit_d_target_vector, R_head_world)
+
+    return residuals, jacobian.reshape((-1, n_params))
+
+
+def calibrate_pupil_nonlinear_least_squares(
+        T_head_world,
+        R_head_world,
+        gaze_normals,
+        T_target_world,
+        ini_T_eye_head=np.zeros(3),
+        ini_ypr=np.zeros(3),
+        ini_polynom_params=np.array([0, 0, 1.0, 1.0, 0, 0]),
+        leave_T_eye_head=False):
+    """
+    Same calibration as calibrate_pupil_nonlinear, solved as a least squares problem with analytic Jacobians, see
+    nonlinear_calibration_residuals. This minimizes the squared angles instead of their mean, so for noisy data the
+    parameters are not exactly the same.
+
+    The result of scipy's least_squares is returned with the same x as calibrate_pupil_nonlinear, yaw, pitch, roll,
+    the polynomial parameters and, without leave_T_eye_head, T_eye_head. fun is the mean angle in degrees like the
+    error of calibrate_pupil_nonlinear, the residuals are in residuals and the wall-clock time in seconds in
+    wall_time.
+    """
+    t_start = time.perf_counter()
+
+    T_head_world = np.asarray(T_head_world, dtype=np.float64)
+    R_head_world = np.asarray(R_head_world, dtype=np.float64)
+    gaze_normals = np.asarray(gaze_normals, dtype=np.float64)
+    T_target_world = np.asarray(T_target_world, dtype=np.float64)
+
+    if leave_T_eye_head:
+        T_eye_head = np.asarray(ini_T_eye_head, dtype=np.float64)
+        ini_params = np.concatenate((ini_ypr, ini_polynom_params))
+    else:
+        T_eye_head = None
+        ini_params = np.concatenate((ini_ypr, ini_polynom_params, ini_T_eye_head))
+
+    # method='lm' can't solve underdetermined problems and nan residuals never converge
+    if 3 * len(gaze_normals) < len(ini_params):
+        raise ValueError(f'At least {-(-len(ini_params) // 3)} samples are needed, got {len(gaze_normals)}.')
+    if not all(np.all(np.isfinite(a)) for a in (T_head_world, R_head_world, gaze_normals, T_target_world)):
+        raise ValueError('Calibration data contains nan or infinite values.')
+
+    cached = {}
+
+    def residuals_and_jacobian(params):
+        # least_squares asks for the residuals and the jacobian at the same parameters separately
+        if 'params' not in cached or not np.array_equal(cached['params'], params):
+            cached['params'] = params.copy()
+            cached['values'] = nonlinear_calibration_residuals(
+                params, T_head_world, R_head_world, gaze_normals, T_target_world, T_eye_head, with_jacobian=True)
+        return cached['values']
+
+    result = least_squares(
+        lambda params: residuals_and_jacobian(params)[0],
+        ini_params.astype(np.float64),
+        jac=lambda params: residuals_and_jacobian(params)[1],
+        method='lm')
+
+    # the residual vectors are chords of the angles between the unit vectors
+    chords = np.linalg.norm(result.fun.reshape((-1, 3)), axis=1)
+    angles = np.rad2deg(2 * np.arcsin(np.clip(chords / 2, 0, 1)))
+    result.residuals = result.fun
+    result.fun = angles.mean()
+    result.wall_time = time.perf_counter() - t_start
+    return result
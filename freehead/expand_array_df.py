@@ -16,7 +16,130 @@ def expand_scalar_column(column, array_lengths):
     return np.repeat(column, array_lengths)
 
 
-def expand_array_df(df, columns):
+def contiguous_backing(cells):
+    """
+    The array that the cells are consecutive parts of, like the rows of a stacked pipeline output or the trials of a
+    ColumnarRecording, as a view, or None if they aren't laid out like that.
+    """
+    first = cells[0]
+    base = first.base
+    if base is None or not isinstance(base, np.ndarray) or not base.flags.c_contiguous:
+        return None
+    address = first.__array_interface__['data'][0]
+    start = address
+    for cell in cells:
+        if (cell.base is not base or not cell.flags.c_contiguous or cell.dtype != first.dtype
+                or cell.shape[1:] != first.shape[1:] or cell.__array_interface__['data'][0] != address):
+            return None
+        address += cell.nbytes
+    flat = base.reshape(-1).view(first.dtype)
+    offset = (start - base.__array_interface__['data'][0]) // first.dtype.itemsize
+    n_rows = sum(len(cell) for cell in cells)
+    return flat[offset:offset + n_rows * int(np.prod(first.shape[1:]))].reshape((n_rows,) + first.shape[1:])
+
+
+class LongFormView:
+    """
+    Long form of the array columns of a DataFrame, like expand_array_df, without copying the samples.
+
+    The samples of every array column are kept in one contiguous buffer with the trial offsets, if the cells already
+    are consecutive parts of one array, that array is used directly, otherwise the cells are concatenated once. The
+    long form columns are views into the buffers. Scalar columns are only repeated to the length of the samples when
+    they are accessed, through one index of the trial of every sample.
+
+    Example:
+        view = expand_array_df(df, ['t_sacc', ('gaze_in_world_ang', ('azim', 'elev')), 'subject'], lazy=True)
+        view['azim']  # a view
+        view.trial_slice(3)  # samples of the fourth trial
+        view.to_dataframe(['azim', 'subject'])
+    """
+
+    def __init__(self, df, columns):
+        affected_columns = [c if isinstance(c, str) else c[0] for c in columns]
+        array_columns = [name for name in affected_columns if isinstance(df[name].iloc[0], np.ndarray)]
+        if not array_columns:
+            raise Exception('No affected column contains numpy arrays to expand.')
+
+        self.lengths = np.array([len(a) for a in df[array_columns[0]]], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths)))
+        self.n_samples = int(self.offsets[-1])
+        self.index = df.index
+
+        # one contiguous buffer per array column, samples x flattened values
+        self.buffers = OrderedDict()
+        for name in array_columns:
+            cells = list(df[name])
+            if any(len(cell) != length for cell, length in zip(cells, self.lengths)):
+                raise Exception(f'The arrays of column {name} have different lengths than those of {array_columns[0]}.')
+            buffer = contiguous_backing(cells)
+            if buffer is None:
+                buffer = np.concatenate(cells, axis=0)
+            self.buffers[name] = buffer.reshape(self.n_samples, -1) if buffer.ndim > 1 else buffer
+
+        self.scalars = OrderedDict()
+        # long form name -> (column, index into the flattened values or None)
+        self.sources = OrderedDict()
+        for c in columns:
+            colname = c if isinstance(c, str) else c[0]
+            if colname in self.buffers and self.buffers[colname].ndim > 1:
+                n_values = self.buffers[colname].shape[1]
+                new_colnames = [colname + f'_{i}' for i in range(n_values)] if isinstance(c, str) else c[1]
+                for i, name in enumerate(new_colnames):
+                    if name != '_':
+                        self.sources[name] = (colname, i)
+            else:
+                if colname not in self.buffers:
+                    self.scalars[colname] = df[colname].values
+                self.sources[colname if isinstance(c, str) else c[1]] = (colname, None)
+
+        self.repeated = {}
+        self._repeat_index = None
+
+    @property
+    def columns(self):
+        return list(self.sources)
+
+    def __len__(self):
+        return self.n_samples
+
+    @property
+    def repeat_index(self):
+        # position of the trial of every sample
+        if self._repeat_index is None:
+            self._repeat_index = np.repeat(np.arange(len(self.lengths)), self.lengths)
+        return self._repeat_index
+
+    def __getitem__(self, name):
+        colname, i = self.sources[name]
+        if colname in self.buffers:
+            buffer = self.buffers[colname]
+            return buffer if i is None else buffer[:, i]
+        if colname not in self.repeated:
+            self.repeated[colname] = self.scalars[colname][self.repeat_index]
+        return self.repeated[colname]
+
+    def trial_slice(self, i):
+        # the samples of the trial at position i
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def to_dataframe(self, columns=None):
+        # the array columns of the DataFrame share the memory of the buffers, every sample keeps the index of its
+        # trial like with expand_array_df
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame(
+            OrderedDict((name, self[name]) for name in columns), index=self.index[self.repeat_index], copy=False)
+
+
+def expand_array_df(df, columns, lazy=False):
+    """
+    Long form of df with one row per sample of the array columns, scalar columns are repeated for every sample.
+
+    columns are names, or tuples of a name and a new name, or of a name and new names for the columns of the flattened
+    samples of an array column, '_' skips one of them. With lazy, a LongFormView is returned instead of a DataFrame,
+    which doesn't copy the samples.
+    """
+    if lazy:
+        return LongFormView(df, columns)
 
     affected_columns = [c if isinstance(c, str) else c[0] for c in columns]
 
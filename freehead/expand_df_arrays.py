@@ -3,7 +3,7 @@ import numpy as np
 from collections import OrderedDict
 
 
-def expand_df_arrays(df, array_lambdas, scalar_lambdas, index_columns):
+def expand_df_arrays(df, array_lambdas, scalar_lambdas, index_columns, categorical=False):
     """Function to bring dataframes with arrays in cells into long form
 
     It is assumed that all resulting arrays from one row of the dataframe have the same length of the first dimension.
@@ -15,6 +15,8 @@ def expand_df_arrays(df, array_lambdas, scalar_lambdas, index_columns):
         :param array_lambdas: A dict of named lambda functions that operate on arrays from the dataframe rows
         :param scalar_lambdas: A dict of named lambda functions that operate on scalars from the dataframe rows
         :param index_columns: A name or list of names of the columns from the expanded frame that will be the new index.
+        :param categorical: If True, scalar columns of strings become categoricals, which saves the memory of one
+            string object per sample
     Returns:
         expanded_df: A dataframe with arrays resulting from array lambdas expanded out into one row per array step.
 
@@ -44,51 +46,81 @@ def expand_df_arrays(df, array_lambdas, scalar_lambdas, index_columns):
         )
         expanded_df
     """
-    columns = OrderedDict()
-
-    row_counts = None
+    if not array_lambdas:
+        raise Exception('At least one array lambda is needed to know the length of each row.')
 
-    for name, lambd in array_lambdas.items():
-        results = []
+    # every lambda is evaluated once per row, in one pass over the rows
+    array_results = OrderedDict((name, []) for name in array_lambdas)
+    scalar_results = OrderedDict((name, []) for name in scalar_lambdas)
+    row_counts = []
 
-        for i_row, row in df.iterrows():
+    for i_row, row in df.iterrows():
+        row_count = None
+        for name, lambd in array_lambdas.items():
             result = lambd(row)
-            if row_counts is not None and result.shape[0] != row_counts[i_row]:
+            if row_count is None:
+                # the first array of a row decides how often the scalars of that row are repeated
+                row_count = result.shape[0]
+            elif result.shape[0] != row_count:
                 raise Exception(
-                    f'Array resulting from row {i_row} in column {name} needs length {row_counts[i_row]}'
+                    f'Array resulting from row {i_row} in column {name} needs length {row_count}'
                     f'but has {result.shape[0]}.')
-            results.append(result)
+            array_results[name].append(result)
+        row_counts.append(row_count)
+        for name, lambd in scalar_lambdas.items():
+            scalar_results[name].append(lambd(row))
 
-        if row_counts is None:
-            # record row counts for first column
-            # these are later used to repeat scalars as often as necessary for each array
-            row_counts = pd.Series([result.shape[0] for result in results], index=df.index)
+    row_counts = np.array(row_counts, dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(row_counts)))
+    n_samples = int(offsets[-1])
+
+    columns = OrderedDict()
 
-        result = np.concatenate(results)
+    for name, results in array_results.items():
+        ndim = results[0].ndim if results else 1
+        if any(result.ndim != ndim for result in results):
+            raise Exception(f'Arrays resulting from column {name} have different numbers of dimensions.')
 
-        if len(result.shape) > 2:
+        if ndim > 2:
             raise Exception('Lambda functions need to return one- or two-dimensional arrays.')
 
-        elif len(result.shape) == 2:
+        elif ndim == 2:
+            n_columns = results[0].shape[1]
             if not isinstance(name, tuple):
                 raise Exception(
-                    f'Return array has shape {result.shape}.'
-                    f'There need to be {result.shape[1]} names but there is only one ({name})')
-            if len(name) != result.shape[1]:
-                raise Exception(f'Result array has {result.shape[1]} columns but only {len(name)} names were supplied.')
-            for i, subname in enumerate(name):
-                columns[subname] = result[:, i]
-
-        elif len(result.shape) == 1:
+                    f'Return array has {n_columns} columns.'
+                    f'There need to be {n_columns} names but there is only one ({name})')
+            if len(name) != n_columns:
+                raise Exception(f'Result array has {n_columns} columns but only {len(name)} names were supplied.')
+            subnames = name
+
+        else:
             if not isinstance(name, str):
                 raise Exception(f'Column name is not a string but {type(name)}')
-            columns[name] = result
-
-    for name, lambd in scalar_lambdas.items():
-        results = []
-        for i_row, row in df.iterrows():
-            results.append(lambd(row))
-        columns[name] = [result for (row_count, result) in zip(row_counts, results) for _ in range(row_count)]
-
-    expanded_df = pd.DataFrame(columns).set_index(index_columns)
+            subnames = None
+
+        # the results of all rows are copied straight into one preallocated array per output column
+        dtype = np.result_type(*results) if results else np.float64
+        for i, subname in enumerate(subnames or [name]):
+            column = np.empty(n_samples, dtype=dtype)
+            for result, start, end in zip(results, offsets[:-1], offsets[1:]):
+                column[start:end] = result[:, i] if subnames else result
+            columns[subname] = column
+
+    # positions of the rows that each sample belongs to, for repeating the scalars
+    repeat_index = np.repeat(np.arange(len(row_counts)), row_counts)
+    for name, results in scalar_results.items():
+        values = pd.Series(results)
+        if categorical and values.map(lambda value: isinstance(value, str)).all():
+            columns[name] = pd.Categorical(values).take(repeat_index)
+        else:
+            columns[name] = values.take(repeat_index).values
+
+    index_columns = [index_columns] if isinstance(index_columns, str) else list(index_columns)
+    if len(index_columns) == 1:
+        index = pd.Index(columns.pop(index_columns[0]), name=index_columns[0])
+    else:
+        index = pd.MultiIndex.from_arrays([columns.pop(name) for name in index_columns], names=index_columns)
+
+    expanded_df = pd.DataFrame(columns, index=index)
     return expanded_df
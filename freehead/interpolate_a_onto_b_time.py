@@ -1,7 +1,11 @@
 from scipy.interpolate import interp1d
 import numpy as np
+from .Resampler import Resampler
 
 
-def interpolate_a_onto_b_time(a, a_time, b_time, kind='linear'):
+def interpolate_a_onto_b_time(a, a_time, b_time, kind='linear', max_gap=None):
+    # linear and nearest interpolation with Resampler, which can also skip gaps, other kinds with interp1d
+    if kind in ('linear', 'nearest'):
+        return [Resampler(np.asarray(a_time), np.asarray(b_time), kind=kind, max_gap=max_gap)(a)]
     interpolator = interp1d(a_time, a, axis=0, bounds_error=False, fill_value=np.nan, kind=kind)
-    return [interpolator(b_time)]
\ No newline at end of file
+    return [interpolator(b_time)]
@@ -1,24 +1,26 @@
 import os
 import re
 import pandas as pd
-import numpy as np
+from .ColumnarRecording import is_columnar_recording, load_recording
 
 
 def load_combined_session_dfs(paths):
 
     all_files = [
-        [os.path.join(path, f) for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
+        [os.path.join(path, f) for f in os.listdir(path)]
         for path in paths]
 
+    # a columnar recording in the folder is used instead of the three original files
     files = [
         [
             list(filter(re.compile(s).match, f))[0]
             for s in ['.*_experiment_.*', '.*_trials_.*', '.*_rig_.*']
         ]
+        if not any(is_columnar_recording(p) for p in f) else
+        [next(p for p in f if is_columnar_recording(p))]
         for f in all_files]
 
-    exp_df_list, trial_df_list, led_rigs = zip(
-        *[(pd.read_pickle(e), pd.read_pickle(t), np.load(l)) for e, t, l in files])
+    exp_df_list, trial_df_list, led_rigs = zip(*[load_recording(*f) for f in files])
 
     for i, (df, tdf, rig) in enumerate(zip(exp_df_list, trial_df_list, led_rigs)):
         df['session'] = i + 1
@@ -0,0 +1,45 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from .SessionWriter import METADATA_FILE, stream_file
+from .recover_session import read_session_index, read_session_schema
+
+
+def load_session(folder_path) -> pd.DataFrame:
+    """Reads the committed trials of a session folder written by a SessionWriter into an experiment DataFrame.
+
+    Works on sessions that are still being written or that crashed, trials that weren't committed are ignored.
+    """
+    entries, _ = read_session_index(folder_path)
+    schema = read_session_schema(folder_path)
+
+    streams = {}
+    for name, stream in schema.items():
+        n_rows = max((entry['arrays'][name][1] for entry in entries if name in entry['arrays']), default=0)
+        streams[name] = np.fromfile(
+            os.path.join(folder_path, stream_file(name)),
+            dtype=np.dtype(stream['dtype']),
+            count=n_rows * int(np.prod(stream['shape']))).reshape((n_rows, *stream['shape']))
+
+    rows = []
+    with open(os.path.join(folder_path, METADATA_FILE), 'rb') as f:
+        for entry in entries:
+            f.seek(entry['metadata'][0])
+            metadata = pickle.load(f)
+            for name, (start, end) in entry['arrays'].items():
+                metadata[name] = streams[name][start:end]
+            # restore the original field order
+            rows.append(OrderedDict((name, metadata[name]) for name in entry['fields']))
+
+    columns = OrderedDict()
+    for i, row in enumerate(rows):
+        for name, value in row.items():
+            if name not in columns:
+                columns[name] = np.full(len(rows), None, dtype=object)
+            columns[name][i] = value
+
+    df = pd.DataFrame(columns, index=[entry['trial'] for entry in entries])
+    # typed columns for scalars, like a DataFrame built from the trials directly
+    return df.infer_objects()
@@ -1,9 +1,17 @@
 import numpy as np
+from numba import jit
 
 
-def multidim_ortho_procrustes(measured, reference):
+def multidim_ortho_procrustes(measured, reference, method='svd'):
     # from reference onto measured
-    # both N x M x 3
+    # both N x M x 3, reference can also be 1 x M x 3 for the same reference in every frame
+    # method 'svd' or 'quaternion', both give the same rotations, the quaternion method solves frames whose markers
+    # are close to collinear with svd as well
+    if method == 'quaternion':
+        return quaternion_ortho_procrustes(measured, reference)
+    elif method != 'svd':
+        raise ValueError(f'Unknown method "{method}", use "svd" or "quaternion".')
+
     # from https://www.cse.iitb.ac.in/~ajitvr/CS763_Spring2017/procrustes.pdf
 
     u, w, vt = np.linalg.svd(np.einsum('nmi,nmj->nij', reference, measured))
@@ -23,4 +31,123 @@ def multidim_ortho_procrustes(measured, reference):
             J,
             u[negative_determinants]))
 
-    return Rs
\ No newline at end of file
+    return Rs
+
+
+def quaternion_ortho_procrustes(measured, reference):
+    measured = np.ascontiguousarray(measured, dtype=np.float64)
+    reference = np.ascontiguousarray(reference, dtype=np.float64)
+    if reference.shape[0] not in (1, measured.shape[0]) or reference.shape[1:] != measured.shape[1:]:
+        raise ValueError(f'Reference of shape {reference.shape} doesn\'t fit measured of shape {measured.shape}.')
+    Rs, ill_conditioned = quaternion_ortho_procrustes_jit(measured, reference)
+    if ill_conditioned.any():
+        Rs[ill_conditioned] = multidim_ortho_procrustes(
+            measured[ill_conditioned],
+            reference if reference.shape[0] == 1 else reference[ill_conditioned],
+            method='svd')
+    return Rs
+
+
+# the three other indices for each index of a 4 x 4 matrix, for taking minors
+OTHER_INDICES = np.array([[1, 2, 3], [0, 2, 3], [0, 1, 3], [0, 1, 2]])
+# below this ratio of the adjugate row norm to the cubed eigenvalue bound, the largest eigenvalues of the quaternion
+# matrix lie so close together that the eigenvector loses precision, the rotation error grows with the inverse square
+# of the ratio and stays below 1e-10 above it
+ILL_CONDITIONED_RATIO = 1e-2
+
+
+@jit(nopython=True, cache=True)
+def det3(a, b, c, d, e, f, g, h, i):
+    return a * (e * i - f * h) - b * (d * i - f * g) + c * (d * h - e * g)
+
+
+@jit(nopython=True, cache=True)
+def quaternion_ortho_procrustes_jit(measured, reference):
+    # Horn's closed form solution with unit quaternions: the rotation is given by the eigenvector of the largest
+    # eigenvalue of a symmetric 4 x 4 matrix built from the cross covariance. The eigenvalue is found with newton
+    # steps on the characteristic polynomial, starting from an upper bound (like Theobald's QCP method), and the
+    # eigenvector from the adjugate of the shifted matrix. A quaternion is always a proper rotation, so there are no
+    # reflections to correct.
+    # frames with nearly collinear markers can't be solved accurately like this, they are flagged in ill_conditioned
+    n_frames, n_markers = measured.shape[0], measured.shape[1]
+    Rs = np.empty((n_frames, 3, 3))
+    ill_conditioned = np.zeros(n_frames, dtype=np.bool_)
+    S = np.empty((3, 3))
+    K = np.empty((4, 4))
+    q = np.empty(4)
+    best_q = np.empty(4)
+
+    for n in range(n_frames):
+        ref = reference[n if reference.shape[0] > 1 else 0]
+
+        S[:, :] = 0.0
+        upper_bound = 0.0
+        for m in range(n_markers):
+            for i in range(3):
+                upper_bound += 0.5 * (ref[m, i] * ref[m, i] + measured[n, m, i] * measured[n, m, i])
+                for j in range(3):
+                    S[i, j] += ref[m, i] * measured[n, m, j]
+
+        sxx, sxy, sxz = S[0, 0], S[0, 1], S[0, 2]
+        syx, syy, syz = S[1, 0], S[1, 1], S[1, 2]
+        szx, szy, szz = S[2, 0], S[2, 1], S[2, 2]
+        K[0, 0], K[0, 1], K[0, 2], K[0, 3] = sxx + syy + szz, syz - szy, szx - sxz, sxy - syx
+        K[1, 0], K[1, 1], K[1, 2], K[1, 3] = syz - szy, sxx - syy - szz, sxy + syx, szx + sxz
+        K[2, 0], K[2, 1], K[2, 2], K[2, 3] = szx - sxz, sxy + syx, -sxx + syy - szz, syz + szy
+        K[3, 0], K[3, 1], K[3, 2], K[3, 3] = sxy - syx, szx + sxz, syz + szy, -sxx - syy + szz
+
+        # characteristic polynomial l^4 + c2 l^2 + c1 l + c0 of the traceless K
+        c2 = -2.0 * (sxx * sxx + sxy * sxy + sxz * sxz + syx * syx + syy * syy + syz * syz
+                     + szx * szx + szy * szy + szz * szz)
+        c1 = -8.0 * det3(sxx, sxy, sxz, syx, syy, syz, szx, szy, szz)
+        c0 = 0.0
+        for j in range(4):
+            # expansion along the first row
+            cols = OTHER_INDICES[j]
+            c0 += (1.0 - 2.0 * (j % 2)) * K[0, j] * det3(
+                K[1, cols[0]], K[1, cols[1]], K[1, cols[2]],
+                K[2, cols[0]], K[2, cols[1]], K[2, cols[2]],
+                K[3, cols[0]], K[3, cols[1]], K[3, cols[2]])
+
+        # all roots are real, so newton steps from above the largest root converge to it monotonically
+        eigenvalue = upper_bound
+        for _ in range(50):
+            p = ((eigenvalue * eigenvalue + c2) * eigenvalue + c1) * eigenvalue + c0
+            dp = (4.0 * eigenvalue * eigenvalue + 2.0 * c2) * eigenvalue + c1
+            if dp == 0.0:
+                break
+            step = p / dp
+            eigenvalue -= step
+            if abs(step) <= 1e-13 * abs(eigenvalue):
+                break
+
+        for i in range(4):
+            K[i, i] -= eigenvalue
+
+        # every row of the adjugate of K - l I is a multiple of the eigenvector, the longest is the most accurate
+        best_norm = 0.0
+        for k in range(4):
+            rows = OTHER_INDICES[k]
+            for j in range(4):
+                cols = OTHER_INDICES[j]
+                q[j] = (1.0 - 2.0 * ((j + k) % 2)) * det3(
+                    K[rows[0], cols[0]], K[rows[0], cols[1]], K[rows[0], cols[2]],
+                    K[rows[1], cols[0]], K[rows[1], cols[1]], K[rows[1], cols[2]],
+                    K[rows[2], cols[0]], K[rows[2], cols[1]], K[rows[2], cols[2]])
+            norm = np.sqrt(q[0] * q[0] + q[1] * q[1] + q[2] * q[2] + q[3] * q[3])
+            if norm > best_norm:
+                best_norm = norm
+                best_q[:] = q
+
+        if not best_norm > ILL_CONDITIONED_RATIO * upper_bound ** 3:
+            Rs[n, :, :] = np.nan
+            # frames with nan markers stay nan
+            ill_conditioned[n] = np.isfinite(upper_bound)
+            continue
+
+        w, x, y, z = best_q[0] / best_norm, best_q[1] / best_norm, best_q[2] / best_norm, best_q[3] / best_norm
+        Rs[n, 0, 0], Rs[n, 0, 1], Rs[n, 0, 2] = w * w + x * x - y * y - z * z, 2 * (x * y - w * z), 2 * (x * z + w * y)
+        Rs[n, 1, 0], Rs[n, 1, 1], Rs[n, 1, 2] = 2 * (x * y + w * z), w * w - x * x + y * y - z * z, 2 * (y * z - w * x)
+        Rs[n, 2, 0], Rs[n, 2, 1], Rs[n, 2, 2] = 2 * (x * z - w * y), 2 * (y * z + w * x), w * w - x * x - y * y + z * z
+
+    return Rs, ill_conditioned
@@ -0,0 +1,62 @@
+import os
+import json
+import logging
+import numpy as np
+from .SessionWriter import SCHEMA_FILE, INDEX_FILE, METADATA_FILE, stream_file
+
+logger = logging.getLogger(__name__)
+
+
+def read_session_index(folder_path):
+    """Returns the committed index entries of a session folder and the byte length they take up in the index file.
+
+    A line only counts if it is complete, everything from the first broken line on was being written during a crash.
+    """
+    entries = []
+    committed_bytes = 0
+    with open(os.path.join(folder_path, INDEX_FILE), 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+            committed_bytes += len(line)
+    return entries, committed_bytes
+
+
+def read_session_schema(folder_path):
+    schema_path = os.path.join(folder_path, SCHEMA_FILE)
+    if not os.path.exists(schema_path):
+        return {}
+    with open(schema_path) as f:
+        return json.load(f)
+
+
+def recover_session(folder_path):
+    """Cuts a session folder back to its last committed trial after a crash, so it can be loaded again.
+
+    :param folder_path: Folder written by a SessionWriter
+    :return: The number of trials that were recovered
+    """
+    entries, committed_bytes = read_session_index(folder_path)
+
+    def truncate(path, size):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            logger.warning(f'Removing {os.path.getsize(path) - size} uncommitted bytes from {path}.')
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+
+    truncate(os.path.join(folder_path, INDEX_FILE), committed_bytes)
+    truncate(
+        os.path.join(folder_path, METADATA_FILE),
+        max((entry['metadata'][1] for entry in entries), default=0))
+
+    for name, stream in read_session_schema(folder_path).items():
+        n_rows = max((entry['arrays'][name][1] for entry in entries if name in entry['arrays']), default=0)
+        row_bytes = np.dtype(stream['dtype']).itemsize * int(np.prod(stream['shape']))
+        truncate(os.path.join(folder_path, stream_file(name)), n_rows * row_bytes)
+
+    logger.info(f'Recovered {len(entries)} trials from {folder_path}.')
+    return len(entries)
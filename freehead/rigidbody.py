@@ -2,9 +2,59 @@ import numpy as np
 import freehead as fh
 import pickle
 import os
+from numba import jit
+
+
+@jit(nopython=True, cache=True)
+def solve_single_frame_jit(markers, subset_centroids, subset_references_centered, ref_points):
+    # markers: M x 3 of one frame, the subset tables are indexed by the visibility bitmask of the markers
+    n_markers = markers.shape[0]
+    rotation = np.full((3, 3), np.nan)
+    result_ref_points = np.full(ref_points.shape, np.nan)
+
+    bitmask = 0
+    n_visible = 0
+    centroid = np.zeros(3)
+    for m in range(n_markers):
+        if not (np.isnan(markers[m, 0]) or np.isnan(markers[m, 1]) or np.isnan(markers[m, 2])):
+            bitmask |= 1 << m
+            n_visible += 1
+            centroid += markers[m, :]
+    if n_visible < 3:
+        return rotation, result_ref_points
+    centroid /= n_visible
+
+    # cross covariance of reference and measured markers, like in multidim_ortho_procrustes
+    reference_centered = subset_references_centered[bitmask]
+    H = np.zeros((3, 3))
+    for m in range(n_markers):
+        if bitmask & (1 << m):
+            for i in range(3):
+                for j in range(3):
+                    H[i, j] += reference_centered[m, i] * (markers[m, j] - centroid[j])
+
+    u, w, vt = np.linalg.svd(H)
+    if np.linalg.det(u) * np.linalg.det(vt) < 0:
+        # the rotation would be a reflection, flip the axis of the smallest singular value
+        vt[2, :] = -vt[2, :]
+    for i in range(3):
+        for k in range(3):
+            rotation[i, k] = vt[0, i] * u[k, 0] + vt[1, i] * u[k, 1] + vt[2, i] * u[k, 2]
+
+    subset_centroid = subset_centroids[bitmask]
+    for p in range(ref_points.shape[0]):
+        for i in range(3):
+            result_ref_points[p, i] = centroid[i]
+            for j in range(3):
+                result_ref_points[p, i] += rotation[i, j] * (ref_points[p, j] - subset_centroid[j])
+    return rotation, result_ref_points
 
 
 class Rigidbody:
+    # the subset geometry tables have one entry per marker subset, that is 2 ** n_markers entries
+    max_cached_subset_markers = 12
+    # method of multidim_ortho_procrustes for solving many frames, 'svd' or 'quaternion'
+    procrustes_method = 'svd'
 
     def __init__(self, markers: np.ndarray, ref_points=None):
         assert(markers.ndim == 2 and markers.shape[1] == 3)
@@ -18,9 +68,22 @@ class Rigidbody:
         elif ref_points.shape == (3,):
             ref_points = ref_points[None, :]
         self.ref_points = ref_points
+        self._cache_subset_geometry()
+
+    def __setstate__(self, state):
+        # rigidbodies pickled before the subset tables existed, like the helmets of older recordings, don't have them
+        self.__dict__.update(state)
+        self._cache_subset_geometry()
 
     def solve(self, markers):
         if markers.ndim == 2:
+            if self.subset_centroids is not None:
+                # compiled path for the real-time loop, which solves one frame per sample
+                return solve_single_frame_jit(
+                    np.ascontiguousarray(markers, dtype=np.float64),
+                    self.subset_centroids,
+                    self.subset_references_centered,
+                    self.ref_points)
             rotation, ref_points = self._solve_multiple(markers[None, :, :])
             return rotation.reshape((3, 3)), ref_points.reshape((-1, 3))
         elif markers.ndim == 3:
@@ -40,13 +103,57 @@ class Rigidbody:
         new_ref_in_neutral_rotation = self.ref_points[0, :] + distance_in_neutral_rotation
         # add new reference points to array
         self.ref_points = np.vstack((self.ref_points, new_ref_in_neutral_rotation))
+        self._cache_subset_geometry()
+
+    def _cache_subset_geometry(self):
+        # the reference geometry of every combination of at least 3 visible markers only changes with the reference
+        # points, so it is computed once here and looked up by visibility bitmask (bit m set if marker m is visible)
+        # when solving. tables are indexed by bitmask, rows of subsets with fewer than 3 markers are unused
+        n_markers = self.reference_markers.shape[0]
+        self.ref_points = np.ascontiguousarray(self.ref_points, dtype=np.float64)
+        if n_markers > self.max_cached_subset_markers:
+            self.subset_centroids = None
+            self.subset_references_centered = None
+            self.subset_ref_center_to_ref_points = None
+            return
+
+        bitmasks = np.arange(2 ** n_markers)
+        visible = (bitmasks[:, None] >> np.arange(n_markers)[None, :]) & 1 == 1  # 2^M x M
+        n_visible = np.maximum(visible.sum(axis=1), 1)
+        self.subset_centroids = np.einsum('bm,mi->bi', visible, self.reference_markers) / n_visible[:, None]  # 2^M x 3
+        self.subset_references_centered = np.where(
+            visible[:, :, None], self.reference_markers[None, :, :] - self.subset_centroids[:, None, :], 0.0)  # 2^M x M x 3
+        self.subset_ref_center_to_ref_points = self.ref_points[None, :, :] - self.subset_centroids[:, None, :]  # 2^M x P x 3
+
+    def _subset_geometry(self, bitmask, visible):
+        # centered reference markers of the visible subset, their centroid and the vectors from it to the ref points
+        if self.subset_centroids is not None:
+            return (
+                self.subset_references_centered[bitmask, visible, :],
+                self.subset_centroids[bitmask],
+                self.subset_ref_center_to_ref_points[bitmask])
+        reference_subset = self.reference_markers[visible, :]  # Mu x 3
+        reference_subset_centroid = reference_subset.mean(axis=0)  # 3
+        return (
+            reference_subset - reference_subset_centroid,  # Mu x 3
+            reference_subset_centroid,
+            self.ref_points - reference_subset_centroid)  # P x 3 - 3 = P x 3
+
+    @staticmethod
+    def _visibility_bitmasks(which_not_nan):
+        # N x M booleans to one integer per frame, python ints for rigidbodies with too many markers for int64
+        n_markers = which_not_nan.shape[1]
+        if n_markers <= 62:
+            return which_not_nan @ (np.int64(1) << np.arange(n_markers, dtype=np.int64))
+        return which_not_nan.astype(object) @ np.array([1 << m for m in range(n_markers)], dtype=object)
 
     def _solve_multiple(self, markers):
         # check which markers have nan values
         # markers: N x M x 3
         which_not_nan = ~np.any(np.isnan(markers), axis=2)
-        # find unique marker combination rows
-        unique, indices = np.unique(which_not_nan, axis=0, return_inverse=True)
+        # bucket frames by their combination of visible markers
+        bitmasks = self._visibility_bitmasks(which_not_nan)
+        frame_order, group_bounds = self._group_by_bitmask(bitmasks)
 
         # prepare result array
         n = markers.shape[0]
@@ -57,41 +164,49 @@ class Rigidbody:
         result_ref_points = np.full((n, p, 3), np.nan)
 
         # loop through unique marker combinations
-        for unique_index in range(unique.shape[0]):
+        for start, end in zip(group_bounds[:-1], group_bounds[1:]):
             # do vectorized version for each combination
-            unique_combination = unique[unique_index, :]
-            if unique_combination.sum() < 3:
+            rows = frame_order[start:end]
+            valid_marker_rows = which_not_nan[rows[0]]
+            if valid_marker_rows.sum() < 3:
                 # ignore combinations of fewer than 3 valid markers
                 continue
 
-            unique_rows = indices == unique_index
-            valid_marker_rows = unique[unique_index]
-            # index markers from rows with current unique marker combination
-
-            # make a multidimensional index array for getting the wanted rows
-            index_mask = np.repeat(
-                np.logical_and(unique_rows[:, None, None], valid_marker_rows[None, :, None]),
-                3,
-                axis=2)
-            valid_markers = markers[index_mask].reshape((unique_rows.sum(), -1, 3))  # Nu x Mu x 3
-            reference_subset = self.reference_markers[valid_marker_rows, :] # Mu x 3
+            # gather the valid markers of the frames with the current combination
+            valid_marker_indices = np.flatnonzero(valid_marker_rows)
+            valid_markers = markers[rows[:, None], valid_marker_indices[None, :], :]  # Nu x Mu x 3
+            reference_subset_centered, reference_subset_centroid, ref_center_to_ref_points = self._subset_geometry(
+                bitmasks[rows[0]], valid_marker_rows)
 
             valid_markers_centroid = valid_markers.mean(axis=1)  # Nu x 3
             valid_markers_centered = valid_markers - valid_markers_centroid[:, None, :]  # Nu x Mu x 3
 
-            reference_subset_centroid = reference_subset.mean(axis=0)  # 3
-            reference_subset_centered = reference_subset - reference_subset_centroid  # Mu x 3
-
-            ref_center_to_ref_points = self.ref_points - reference_subset_centroid  # P x 3 - 3 = P x 3
-
-            rotations = fh.multidim_ortho_procrustes(valid_markers_centered, reference_subset_centered[None, :, :])  # Nu x 3 x 3
+            rotations = fh.multidim_ortho_procrustes(
+                valid_markers_centered, reference_subset_centered[None, :, :], method=self.procrustes_method)  # Nu x 3 x 3
             ref_points_translated = np.einsum('nij,tj->nti', rotations, ref_center_to_ref_points) + valid_markers_centroid[:, None, :]  # Nu x P x 3
 
-            result_rotations[unique_rows, :, :] = rotations
-            result_ref_points[unique_rows, :, :] = ref_points_translated
+            result_rotations[rows, :, :] = rotations
+            result_ref_points[rows, :, :] = ref_points_translated
 
         return result_rotations, result_ref_points
 
+    @staticmethod
+    def _group_by_bitmask(bitmasks):
+        # returns the frame indices sorted by bitmask and the bounds of each bitmask's run in them
+        # up to 16 markers, the stable sort of uint16 values is a radix sort and the run lengths are counted with
+        # bincount, so grouping stays linear in the number of frames
+        if bitmasks.dtype != object and (bitmasks.size == 0 or bitmasks.max() < 2 ** 16):
+            frame_order = np.argsort(bitmasks.astype(np.uint16), kind='stable')
+            counts = np.bincount(bitmasks)
+            group_bounds = np.concatenate(([0], np.cumsum(counts[counts > 0])))
+        else:
+            frame_order = np.argsort(bitmasks, kind='stable')
+            sorted_bitmasks = bitmasks[frame_order]
+            group_bounds = np.concatenate((
+                np.flatnonzero(np.concatenate(([True], sorted_bitmasks[1:] != sorted_bitmasks[:-1]))),
+                [bitmasks.size]))
+        return frame_order, group_bounds
+
 
 class FourMarkerProbe(Rigidbody):
     def __init__(self):
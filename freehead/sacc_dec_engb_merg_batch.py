@@ -0,0 +1,131 @@
+import numpy as np
+from numba import jit
+
+# status of every trial in the result of sacc_dec_engb_merg_batch
+STATUS_OK = 0
+STATUS_NO_SACCADES = 1  # no run of samples above the threshold that is long enough
+STATUS_NO_THRESHOLD = 2  # the velocity threshold is nan or effectively zero
+STATUS_INVALID_SACCADE = 3  # a saccade is too short to take its peak or only has nan positions
+STATUS_NAMES = {
+    STATUS_OK: 'ok',
+    STATUS_NO_SACCADES: 'no saccades',
+    STATUS_NO_THRESHOLD: 'no velocity threshold',
+    STATUS_INVALID_SACCADE: 'invalid saccade',
+}
+
+
+@jit(nopython=True, cache=True)
+def sacc_dec_engb_merg_batch_jit(x, vel, offsets, VFAC, MINDUR):
+    n_trials = len(offsets) - 1
+    # there can't be more saccades than every second sample
+    max_saccades = len(vel) // 2 + 1
+    trials = np.empty(max_saccades, dtype=np.int64)
+    pairs = np.empty((max_saccades, 2), dtype=np.int64)
+    vpeaks = np.empty(max_saccades)
+    start_end_pos = np.empty(max_saccades)
+    amplitudes = np.empty(max_saccades)
+    status = np.full(n_trials, STATUS_OK, dtype=np.int64)
+    n_saccades = 0
+
+    for trial in range(n_trials):
+        trial_x = x[offsets[trial]:offsets[trial + 1]]
+        trial_vel = vel[offsets[trial]:offsets[trial + 1]]
+
+        msd = np.sqrt(np.nanmedian(trial_vel ** 2) - np.nanmedian(trial_vel) ** 2)
+        if not msd >= 1e-16:
+            status[trial] = STATUS_NO_THRESHOLD
+            continue
+        threshold = msd * VFAC
+
+        n_trial_saccades = 0
+        run_start = -1
+        for i in range(len(trial_vel) + 1):
+            above = i < len(trial_vel) and np.abs(trial_vel[i] / threshold) > 1
+            if above:
+                if run_start < 0:
+                    run_start = i
+                continue
+            if run_start < 0:
+                continue
+            a = run_start
+            b = i - 1  # inclusive end like in sacc_dec_engb_merg_horizontal
+            run_start = -1
+            if b - a < MINDUR:
+                continue
+
+            # peak velocity and extremes of the positions in a:b, ignoring nans, first occurrence like nanargmax
+            i_vpeak = -1
+            i_min = -1
+            i_max = -1
+            for j in range(a, b):
+                if not np.isnan(trial_vel[j]) and (i_vpeak < 0 or np.abs(trial_vel[j]) > np.abs(trial_vel[i_vpeak])):
+                    i_vpeak = j
+                if not np.isnan(trial_x[j]):
+                    if i_min < 0 or trial_x[j] < trial_x[i_min]:
+                        i_min = j
+                    if i_max < 0 or trial_x[j] > trial_x[i_max]:
+                        i_max = j
+            if i_vpeak < 0 or i_min < 0:
+                status[trial] = STATUS_INVALID_SACCADE
+                break
+
+            k = n_saccades + n_trial_saccades
+            trials[k] = trial
+            pairs[k, 0] = a
+            pairs[k, 1] = b
+            vpeaks[k] = trial_vel[i_vpeak]
+            start_end_pos[k] = trial_x[b] - trial_x[a]
+            amplitudes[k] = np.sign(i_max - i_min) * (trial_x[i_max] - trial_x[i_min])
+            n_trial_saccades += 1
+
+        if status[trial] != STATUS_OK:
+            # like the single trial version, a trial with an invalid saccade has no results at all
+            continue
+        if n_trial_saccades == 0:
+            status[trial] = STATUS_NO_SACCADES
+        n_saccades += n_trial_saccades
+
+    return (trials[:n_saccades], pairs[:n_saccades], vpeaks[:n_saccades], start_end_pos[:n_saccades],
+            amplitudes[:n_saccades], status)
+
+
+def sacc_dec_engb_merg_batch(x, vel, VFAC, MINDUR, offsets=None):
+    """
+    Engbert & Mergenthaler saccade detection like sacc_dec_engb_merg_horizontal for all trials in one call.
+
+    :param x: Horizontal positions, either trials x samples or the samples of all trials concatenated
+    :param vel: Horizontal velocities in the same layout as x
+    :param VFAC: Threshold as multiple of the median based velocity standard deviation of each trial
+    :param MINDUR: Minimum number of samples after the first one of a saccade
+    :param offsets: For concatenated samples, the n_trials + 1 offsets of the trials
+    :return: trials, pairs, vpeaks, start_end_pos, amplitudes, status. The first five have one entry per saccade,
+        trials is the trial position and pairs the inclusive start and end sample of the saccade within its trial.
+        status has one entry per trial, STATUS_OK or the reason why the trial has no saccades, see STATUS_NAMES.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    vel = np.asarray(vel, dtype=np.float64)
+    if x.shape != vel.shape:
+        raise ValueError(f'Positions of shape {x.shape} and velocities of shape {vel.shape} don\'t fit.')
+    if offsets is None:
+        if x.ndim != 2:
+            raise ValueError('Without offsets, positions and velocities need to be trials x samples.')
+        offsets = np.arange(x.shape[0] + 1) * x.shape[1]
+    elif x.ndim != 1:
+        raise ValueError('With offsets, positions and velocities need to be concatenated samples.')
+    return sacc_dec_engb_merg_batch_jit(
+        np.ascontiguousarray(x).reshape(-1), np.ascontiguousarray(vel).reshape(-1),
+        np.asarray(offsets, dtype=np.int64), float(VFAC), int(MINDUR))
+
+
+def saccades_per_trial(result):
+    """
+    The result of sacc_dec_engb_merg_batch as one value per trial like sacc_dec_engb_merg_horizontal returns it,
+    a tuple of pairs, vpeaks, start_end_pos and amplitudes, or None if the trial has no saccades.
+    """
+    trials, pairs, vpeaks, start_end_pos, amplitudes, status = result
+    bounds = np.searchsorted(trials, np.arange(len(status) + 1))
+    per_trial = np.empty(len(status), dtype=object)
+    for trial, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        if status[trial] == STATUS_OK:
+            per_trial[trial] = (pairs[start:end], vpeaks[start:end], start_end_pos[start:end], amplitudes[start:end])
+    return per_trial
@@ -71,8 +71,9 @@ def sacc_dec_engb_merg_horizontal(x, vel, VFAC, MINDUR):
             return None
         else:
             return long_enough_pairs, vpeaks, start_end_pos, amplitudes
-    except:
-        print('Engbert Mergenthaler failed')
+    except (ValueError, IndexError) as e:
+        # sacc_dec_engb_merg_batch reports the reason for every trial instead
+        print(f'Engbert Mergenthaler failed: {e}')
         return None
 
 
@@ -5,8 +5,7 @@ athread = fh.ArduinoThread()
 athread.start()
 athread.started_running.wait()
 
-for i in range(254):
-    athread.write_uint8(i, 120, 254 -i, i)
+athread.write_many([(i, 120, 254 - i, i) for i in range(254)])
 
 time.sleep(6)    
 athread.should_stop.set()
@@ -0,0 +1,53 @@
+import freehead as fh
+import numpy as np
+import time
+
+# compares the svd and quaternion methods of multidim_ortho_procrustes on noisy four marker frames, and on three marker
+# subsets that get close to collinear
+# frames are solved in chunks so that 10 million frames fit into memory
+chunk_length = 1_000_000
+
+rng = np.random.default_rng(0)
+reference = rng.normal(size=(1, 4, 3)) * 50
+reference -= reference.mean(axis=1, keepdims=True)
+
+
+def random_frames(n, reference=reference, noise=0.5):
+    R = np.array([fh.from_yawpitchroll(*ypr) for ypr in rng.uniform(-90, 90, (min(n, 1000), 3))])
+    R = R[rng.integers(0, R.shape[0], n)]
+    measured = np.einsum('nij,mj->nmi', R, reference[0]) + rng.normal(size=(n, *reference.shape[1:])) * noise
+    return measured - measured.mean(axis=1, keepdims=True)
+
+
+# compile before timing
+fh.multidim_ortho_procrustes(random_frames(10), reference, method='quaternion')
+
+for n in [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]:
+    durations = {'svd': 0.0, 'quaternion': 0.0}
+    max_difference = 0.0
+    for start in range(0, n, chunk_length):
+        measured = random_frames(min(chunk_length, n - start))
+        results = {}
+        for method in durations:
+            t_start = time.perf_counter()
+            results[method] = fh.multidim_ortho_procrustes(measured, reference, method=method)
+            durations[method] += time.perf_counter() - t_start
+        max_difference = max(max_difference, np.abs(results['svd'] - results['quaternion']).max())
+
+    print(f'{n:>9d} frames: svd {durations["svd"]:8.3f} s, quaternion {durations["quaternion"]:8.3f} s, '
+          f'speedup {durations["svd"] / durations["quaternion"]:5.1f}x, max difference {max_difference:.1e}')
+    assert max_difference < 1e-9
+
+# triangles with a 100 mm base and decreasing height, down to collinear markers
+for height in [10, 1, 0.1, 0.01, 1e-6, 0]:
+    triangle = np.array([[[0, 0, 0], [100, 0, 0], [50, height, 0]]], dtype=np.float64)
+    triangle -= triangle.mean(axis=1, keepdims=True)
+    max_difference = 0.0
+    for noise in [0, 1e-6, 0.5]:
+        measured = random_frames(10 ** 4, triangle, noise)
+        results = {
+            method: fh.multidim_ortho_procrustes(measured, triangle, method=method) for method in ('svd', 'quaternion')}
+        max_difference = max(max_difference, np.abs(results['svd'] - results['quaternion']).max())
+
+    print(f'triangle height {height:g} mm: max difference {max_difference:.1e}')
+    assert max_difference < 1e-9
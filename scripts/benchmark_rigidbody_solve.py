@@ -0,0 +1,24 @@
+import freehead as fh
+import numpy as np
+import timeit
+
+# a helmet like rigidbody with four markers and the eye as additional reference point
+rng = np.random.default_rng(0)
+reference_markers = rng.normal(size=(4, 3)) * 50
+helmet = fh.Rigidbody(reference_markers)
+helmet.add_reference_points(reference_markers, rng.normal(size=(1, 3)) * 100)
+
+R = fh.from_yawpitchroll(20, -10, 5)
+markers = reference_markers @ R.T + np.array([100, 200, 300])
+markers_one_missing = markers.copy()
+markers_one_missing[2, :] = np.nan
+
+# compile before timing
+helmet.solve(markers)
+
+n = 10000
+for name, frame in [('all markers', markers), ('one marker missing', markers_one_missing)]:
+    t_single = timeit.timeit(lambda: helmet.solve(frame), number=n) / n
+    t_multiple = timeit.timeit(lambda: helmet._solve_multiple(frame[None, :, :]), number=n) / n
+    print(f'{name}: single frame solver {t_single * 1e6:.1f} µs, '
+          f'batch solver on one frame {t_multiple * 1e6:.1f} µs, speedup {t_multiple / t_single:.1f}x')
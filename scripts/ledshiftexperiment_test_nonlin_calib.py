@@ -2,6 +2,7 @@ import freehead as fh
 import numpy as np
 import pygame
 import sys
+from datetime import datetime
 #%% initialize background threads
 # pygame.init()
 pygame.display.init()
@@ -91,11 +92,17 @@ print('number of trials:', len(trial_frame))
 #%%
 subject_prefix = input('Subject prefix: ')
 fh.focus_pygame_window()
-experiment = fh.LedShiftExperiment(othread, pthread, athread, rig_led_positions, trial_frame)
+# every finished trial is written to disk right away, if the session crashes run fh.recover_session on the folder
+session_folder = '../recordings/' + subject_prefix + '_session_' + datetime.strftime(datetime.now(), '%Y-%m-%d_%H-%M-%S')
+session_writer = fh.SessionWriter(session_folder, trial_frame, rig_led_positions)
+session_writer.start()
+experiment = fh.LedShiftExperiment(
+    othread, pthread, athread, rig_led_positions, trial_frame, trial_sink=session_writer)
 
 sys.setswitchinterval(0.0001)
 experiment_df = experiment.run()
 sys.setswitchinterval(0.005)
+session_writer.close()
 
 fh.save_experiment_files(experiment_df, trial_frame, rig_led_positions, subject_prefix)
 
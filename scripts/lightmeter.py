@@ -13,9 +13,7 @@ athread = fh.ArduinoThread()
 athread.start()
 athread.started_running.wait()
 
-for i in range(4000):
-    athread.write_uint8(255, 255, 255, 255)
-    athread.write_uint8(255, 0, 0, 0)
+athread.write_many([(255, 255, 255, 255), (255, 0, 0, 0)] * 4000)
 
 time.sleep(5)
 
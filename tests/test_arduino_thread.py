@@ -0,0 +1,63 @@
+import os
+import time
+import numpy as np
+from freehead.ArduinoThread import ArduinoThread
+from freehead.FakeArduino import FakeArduino
+
+
+def start_threads(update_duration):
+    fake = FakeArduino(update_duration=update_duration)
+    fake.start()
+    athread = ArduinoThread(path=fake.path)
+    athread.startup_duration = 0
+    athread.start()
+    athread.started_running.wait()
+    return fake, athread
+
+
+def stop_threads(fake, athread):
+    # the arduino thread first, so it doesn't read from the closed pseudo terminal
+    athread.should_stop.set()
+    athread.join()
+    fake.should_stop.set()
+    fake.join()
+
+
+def wait_until(condition, timeout=1.0):
+    t_deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < t_deadline
+        time.sleep(0.001)
+
+
+def test_stray_byte_keeps_commands_in_flight():
+    fake, athread = start_threads(update_duration=0.02)
+    try:
+        athread.write_many([(led, 1, 2, 3) for led in range(3)])
+        wait_until(lambda: len(athread.in_flight) == 3)
+        # a corrupted byte that matches no sequence byte in flight
+        os.write(fake.master_fd, bytes([200]))
+        wait_until(lambda: len(athread.command_timestamps) == 3)
+
+        assert athread.failed_commands == []
+        assert np.all(np.isfinite(athread.command_timestamps))
+    finally:
+        stop_threads(fake, athread)
+
+
+def test_late_ack_of_timed_out_command():
+    fake, athread = start_threads(update_duration=1.5 * ArduinoThread.ack_timeout)
+    try:
+        athread.write_uint8(1, 1, 2, 3)
+        wait_until(lambda: athread.failed_commands == [0])
+        fake.update_duration = 0.001
+        # sent while the fake is still executing the first command, whose ack then arrives late
+        athread.write_uint8(2, 1, 2, 3)
+        wait_until(lambda: len(athread.command_timestamps) == 2)
+
+        assert athread.failed_commands == [0]
+        assert np.isnan(athread.command_timestamps[0])
+        assert np.isfinite(athread.command_timestamps[1])
+        assert fake.commands == [(1, 1, 2, 3), (2, 1, 2, 3)]
+    finally:
+        stop_threads(fake, athread)
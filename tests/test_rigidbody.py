@@ -0,0 +1,46 @@
+import pickle
+import numpy as np
+from freehead.rigidbody import Rigidbody
+
+reference_markers = np.array([
+    [172.8, -761.6, 135.6],
+    [160.0, -807.2, 151.1],
+    [201.6, -809.8, 178.3],
+    [214.5, -764.1, 162.9]])
+ref_points = np.array([
+    [187.2, -785.7, 157.0],
+    [153.2, -919.4, 196.1]])
+
+
+def baseline_pickle():
+    # a rigidbody as it was pickled before the subset geometry was cached, with only the markers and ref points
+    rigidbody = Rigidbody.__new__(Rigidbody)
+    rigidbody.__dict__.update(reference_markers=reference_markers, ref_points=ref_points)
+    return pickle.dumps(rigidbody)
+
+
+def test_solve_single_frame_of_unpickled_baseline_rigidbody():
+    rigidbody = pickle.loads(baseline_pickle())
+    markers = reference_markers + np.array([10.0, -5.0, 2.0])
+    markers[1, :] = np.nan
+
+    rotation, solved_ref_points = rigidbody.solve(markers)
+
+    np.testing.assert_allclose(rotation, np.eye(3), atol=1e-10)
+    np.testing.assert_allclose(solved_ref_points, ref_points + np.array([10.0, -5.0, 2.0]), atol=1e-8)
+
+
+def test_solve_multiple_frames_of_unpickled_baseline_rigidbody():
+    rigidbody = pickle.loads(baseline_pickle())
+    offsets = np.array([[10.0, -5.0, 2.0], [0.0, 3.0, -1.0], [-4.0, 0.0, 7.0], [1.0, 1.0, 1.0]])
+    markers = reference_markers[None, :, :] + offsets[:, None, :]
+    # one subset per frame, including one that can't be solved
+    markers[1, 0, :] = np.nan
+    markers[2, 3, :] = np.nan
+    markers[3, :2, :] = np.nan
+
+    rotations, solved_ref_points = rigidbody.solve(markers)
+
+    np.testing.assert_allclose(rotations[:3], np.broadcast_to(np.eye(3), (3, 3, 3)), atol=1e-10)
+    np.testing.assert_allclose(solved_ref_points[:3], ref_points[None, :, :] + offsets[:3, None, :], atol=1e-8)
+    assert np.all(np.isnan(rotations[3])) and np.all(np.isnan(solved_ref_points[3]))
@@ -0,0 +1,26 @@
+import numpy as np
+from freehead.TrialStore import TrialStore, RaggedColumn
+
+
+def test_missing_field_in_2d_ragged_column():
+    store = TrialStore()
+    store.append({'a': np.ones((3, 2)), 'b': 1})
+    store.append({'b': 2.5})
+
+    assert isinstance(store.columns['a'], RaggedColumn)
+    df = store.to_dataframe()
+    assert df['a'][0].shape == (3, 2)
+    assert df['a'][1].shape == (0, 2)
+    assert df['b'].tolist() == [1.0, 2.5]
+
+
+def test_field_that_appears_in_a_later_trial():
+    store = TrialStore()
+    store.append({'b': 1})
+    store.append({'a': np.ones((3, 2), dtype=np.float32), 'b': 2})
+
+    assert isinstance(store.columns['a'], RaggedColumn)
+    df = store.to_dataframe()
+    assert df['a'][0].shape == (0, 2)
+    assert df['a'][0].dtype == np.float32
+    assert df['a'][1].shape == (3, 2)